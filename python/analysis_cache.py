@@ -0,0 +1,218 @@
+import fcntl, json, os
+from contextlib import contextmanager
+import numpy as np
+from dedup_cache import file_hash
+from cqt import finite_range, quantize, replace_zeros, segment_floors
+from spectrogram import (LOG_LEVELS, log_range, log_rows, make_spectrograms,
+                         segment_columns, write_log_spectrograms)
+from melograph import (MIN_FREQUENCY, MAX_FREQUENCY, crop_track, pitch_track,
+                       sa_range, write_melograph)
+
+# Wide-range intermediates per recording, so that verifying or editing the Sa
+# only re-crops and re-renders the log spectrograms and melograph instead of
+# going back to the audio. `analysis/<id>/` under the server root holds
+#
+#   log_cqt.f16  float16 log10 CQT magnitudes, columns x bins, on the spec
+#                data's grid (spectrogram.py) widened to the crops of every
+#                Sa from MIN_SA to MAX_SA
+#   pitch.npz    the predominant pitch track and its confidence over the
+#                same range
+#   cache.json   how each was made, and the wav's mtime, size and hash
+#
+# Both are dropped when the wav changes (checked as in make_all.py: a stat,
+# and a hash only when the mtime moved but the size didn't). An Sa outside
+# what is cached gets the intermediate rebuilt wide enough for it.
+#
+# The stamp describes the data files (the CQT's shape in particular), so the
+# two are only read under a shared lock and rebuilt and stamped under an
+# exclusive one; a request that finds the cache missing takes the exclusive
+# lock and looks again, in case another request rebuilt it meanwhile.
+
+ANALYSIS_DIR = os.environ.get('ANALYSIS_DIR', 'analysis')
+VERSION = 1
+MIN_SA = 65
+MAX_SA = 330
+CACHE_RANGE = (log_range(MIN_SA)[0], log_range(MAX_SA)[1])
+STAMP_NAME = 'cache.json'
+CQT_NAME = 'log_cqt.f16'
+PITCH_NAME = 'pitch.npz'
+# columns of the cached CQT cropped at a time
+CROP_COLUMNS = 8192
+
+def cache_dir(rec_id):
+    return os.path.join(ANALYSIS_DIR, rec_id)
+
+def wav_path(rec_id):
+    return os.path.join('audio', 'wav', rec_id + '.wav')
+
+@contextmanager
+def locked(rec_id, shared=False):
+    # the Sa endpoints can be reading and rebuilding a recording's cache at
+    # once; not reentrant, as each call takes its own flock
+    os.makedirs(cache_dir(rec_id), exist_ok=True)
+    with open(os.path.join(cache_dir(rec_id), 'lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+def read_stamp(rec_id):
+    try:
+        with open(os.path.join(cache_dir(rec_id), STAMP_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_stamp(rec_id, stamp):
+    tmp_path = os.path.join(cache_dir(rec_id), STAMP_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(stamp, f)
+    os.replace(tmp_path, os.path.join(cache_dir(rec_id), STAMP_NAME))
+
+def matches(stamp, path, stat=None):
+    # whether `stamp` was made from the audio now at `path`
+    if stamp is None or stamp['version'] != VERSION:
+        return False
+    stat = os.stat(path) if stat is None else stat
+    if stat.st_size != stamp['size']:
+        return False
+    if stat.st_mtime_ns == stamp['mtime_ns']:
+        return True
+    return file_hash(path) == stamp['hash']
+
+def cached(rec_id, path, part):
+    # the description of a cached part, or None if it's missing or stale
+    stamp = read_stamp(rec_id)
+    if not matches(stamp, path):
+        return None
+    return stamp.get(part)
+
+def store(rec_id, path, part, info, stat):
+    # records a part built from the audio as it was at `stat`, dropping the
+    # other part if it was made from different audio; the caller holds the
+    # exclusive lock from before the part's file was replaced
+    stamp = read_stamp(rec_id)
+    if not matches(stamp, path, stat):
+        stamp = {
+            'version': VERSION,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': file_hash(path)
+        }
+    stamp[part] = info
+    write_stamp(rec_id, stamp)
+
+def crop_spectrogram(rec_id, info, rows):
+    # uint8 log spectrogram of `rows` of the cached CQT, bins x columns, over
+    # the crop's own range and with zeros replaced per segment, as
+    # spectrogram.make_spectrograms quantizes it; from float16 logs, so a
+    # pixel on a level boundary can land one level off the fresh build's
+    # (tests/test_analysis_cache.py)
+    logs = np.memmap(os.path.join(cache_dir(rec_id), CQT_NAME),
+                     dtype=np.float16, mode='r', shape=tuple(info['shape']))
+    num_columns = logs.shape[0]
+    segment = segment_columns(info['hop'], info['sample_rate'])
+    lo = hi = None
+    floors = {}
+    for col in range(0, num_columns, CROP_COLUMNS):
+        block = logs[col:col + CROP_COLUMNS, rows].T.astype(np.float64)
+        lo, hi = finite_range(block, lo, hi)
+        segment_floors(block, col, floors, segment)
+    arr = np.empty((rows.stop - rows.start, num_columns), dtype=np.uint8)
+    for col in range(0, num_columns, CROP_COLUMNS):
+        block = logs[col:col + CROP_COLUMNS, rows].T.astype(np.float64)
+        block = replace_zeros(block, col, floors, segment)
+        arr[:, col:col + CROP_COLUMNS] = quantize(block, lo, hi, LOG_LEVELS)
+    return arr
+
+def cached_crop(rec_id, path, sa):
+    # the log spectrogram for `sa` from the cached CQT, or None if it isn't
+    # cached wide enough; the caller holds the lock
+    info = cached(rec_id, path, 'cqt')
+    if info is None:
+        return None
+    rows = log_rows(sa, info['offset'])
+    if rows.start < 0 or rows.stop > info['shape'][1]:
+        return None
+    return crop_spectrogram(rec_id, info, rows)
+
+def spectrograms(rec_id, sa=None, tiles_dir=None, spec_dir=None,
+                 full_path=None, audio=None, cmap='magma', workers=None):
+    # The log spectrograms for `sa` to `tiles_dir`, cropped from the cached
+    # CQT when there is one covering it; otherwise (or when the spec data is
+    # wanted in `spec_dir` too) one transform of the audio writes everything
+    # asked for and refreshes the cache.
+    path = wav_path(rec_id) if full_path is None else full_path
+    crop_only = tiles_dir is not None and spec_dir is None
+    arr = None
+    if crop_only:
+        with locked(rec_id, shared=True):
+            arr = cached_crop(rec_id, path, sa)
+    if arr is None:
+        with locked(rec_id):
+            if crop_only:
+                arr = cached_crop(rec_id, path, sa)
+            if arr is None:
+                stat = os.stat(path)
+                info = make_spectrograms(
+                    path, audio, spec_dir=spec_dir, sa=sa,
+                    tiles_dir=tiles_dir, cmap=cmap, workers=workers,
+                    cover=CACHE_RANGE,
+                    cache_path=os.path.join(cache_dir(rec_id), CQT_NAME))
+                store(rec_id, path, 'cqt', info, stat)
+                return
+    write_log_spectrograms(arr, tiles_dir, cmap, workers)
+
+def cached_track(rec_id, path, min_freq, max_freq):
+    # (info, pitch, confidence) of the cached pitch track, or None if it
+    # isn't cached over [min_freq, max_freq]; the caller holds the lock
+    info = cached(rec_id, path, 'pitch')
+    if info is None or info['min_freq'] > min_freq \
+            or max_freq > info['max_freq']:
+        return None
+    with np.load(os.path.join(cache_dir(rec_id), PITCH_NAME)) as data:
+        return info, data['pitch'], data['confidence']
+
+def melograph(rec_id, sa=None, folder_path=None, full_path=None, audio=None,
+              sample_rate=44100, workers=None):
+    # The melograph for `sa` (75-2400 Hz without one) to `folder_path`,
+    # cropped from the cached pitch track, which is made first if it's missing
+    # or too narrow. `audio` is as EasyLoader(replayGain=0) returns it;
+    # `workers` is passed on to melograph.pitch_track.
+    path = wav_path(rec_id) if full_path is None else full_path
+    if sa is None:
+        min_freq, max_freq = MIN_FREQUENCY, MAX_FREQUENCY
+    else:
+        min_freq, max_freq = sa_range(sa)
+    with locked(rec_id, shared=True):
+        track = cached_track(rec_id, path, min_freq, max_freq)
+    if track is None:
+        with locked(rec_id):
+            track = cached_track(rec_id, path, min_freq, max_freq)
+            if track is None:
+                track = make_track(rec_id, path, min_freq, max_freq, audio,
+                                   sample_rate, workers)
+    info, pitch, confidence = track
+    pitch, confidence = crop_track(pitch, confidence, min_freq, max_freq)
+    write_melograph(pitch, confidence, info['duration'], folder_path, sa)
+
+def make_track(rec_id, path, min_freq, max_freq, audio, sample_rate,
+               workers):
+    # tracks the audio over the cached range widened to [min_freq, max_freq]
+    # and caches it; the caller holds the exclusive lock
+    stat = os.stat(path)
+    if audio is None:
+        import essentia.standard as ess
+        audio = ess.EasyLoader(filename=path, replayGain=0)()
+    info = {
+        'min_freq': min(CACHE_RANGE[0], min_freq),
+        'max_freq': max(CACHE_RANGE[1], max_freq),
+        'duration': len(audio) / sample_rate
+    }
+    pitch, confidence = pitch_track(audio, info['min_freq'], info['max_freq'],
+                                    workers)
+    pitch_file = os.path.join(cache_dir(rec_id), PITCH_NAME)
+    tmp_path = f'{pitch_file}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, pitch=pitch, confidence=confidence)
+    os.replace(tmp_path, pitch_file)
+    store(rec_id, path, 'pitch', info, stat)
+    return info, pitch, confidence
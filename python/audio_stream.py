@@ -0,0 +1,85 @@
+import subprocess
+import numpy as np
+from media_info import probe
+
+# Block-wise decoding and encoding through ffmpeg pipes, so that long
+# recordings never have to be held in memory in full.
+
+BLOCK_SECONDS = 10
+
+def probe_duration(path):
+    return probe(path)['duration']
+
+def read_blocks(path, sample_rate=44100, channels=2,
+                block_size=BLOCK_SECONDS * 44100):
+    # Yields float32 arrays of shape (block_size, channels); the last block
+    # may be shorter.
+    command = [
+        'ffmpeg', '-loglevel', 'error', '-i', path, '-vn',
+        '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels), 'pipe:1'
+    ]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+    frame_bytes = 4 * channels
+    finished = False
+    try:
+        while True:
+            buf = proc.stdout.read(block_size * frame_bytes)
+            if not buf:
+                finished = True
+                break
+            usable = len(buf) - len(buf) % frame_bytes
+            block = np.frombuffer(buf[:usable], dtype='<f4')
+            yield block.reshape(-1, channels)
+    finally:
+        proc.stdout.close()
+        if not finished:
+            # the consumer stopped early
+            proc.kill()
+        if proc.wait() != 0 and finished:
+            raise RuntimeError(f'ffmpeg failed decoding {path}')
+
+def read_window(path, start, duration, sample_rate=44100, channels=1):
+    # `duration` seconds from `start`, as float32 of shape (samples,) for
+    # mono or (samples, channels). -ss before -i seeks in the input, so only
+    # the window (from the nearest preceding keyframe) is decoded.
+    command = [
+        'ffmpeg', '-loglevel', 'error', '-ss', str(start), '-t', str(duration),
+        '-i', path, '-vn', '-f', 'f32le', '-ar', str(sample_rate),
+        '-ac', str(channels), 'pipe:1'
+    ]
+    out = subprocess.run(command, stdout=subprocess.PIPE)
+    if out.returncode != 0:
+        raise RuntimeError(f'ffmpeg failed decoding {path}')
+    frame_bytes = 4 * channels
+    buf = out.stdout[:len(out.stdout) - len(out.stdout) % frame_bytes]
+    block = np.frombuffer(buf, dtype='<f4')
+    return block if channels == 1 else block.reshape(-1, channels)
+
+class PipeEncoder:
+    # An ffmpeg encoder reading raw float PCM from its stdin.
+
+    def __init__(self, out_path, codec_args, sample_rate=44100, channels=2):
+        self.out_path = out_path
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels),
+            '-i', 'pipe:0', *codec_args, out_path
+        ]
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, block):
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        self.proc.stdin.write(block.tobytes())
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f'ffmpeg failed writing {self.out_path}')
+
+    def abort(self):
+        self.proc.kill()
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.proc.wait()
@@ -6,7 +6,23 @@ import sys
 sys.path.append('articulation_classification')
 from articulation_classification import AudioClassifier
 import requests
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from melograph_store import MelographReader
+
+def get_melograph(rec_id: str):
+    # the binary melograph (melograph_store.py), read from the downloaded
+    # bytes
+    url = f"https://swara.studio/melographs/{rec_id}/melograph.mel"
+    try:
+        response = requests.get(url)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+    except requests.exceptions.RequestException as err:
+        print(f"Error fetching data: {err}")
+        return None
+    return MelographReader(data=response.content)
+
 def get_melograph_json(rec_id: str):
+    # recordings processed before melograph.mel existed only have this
     url = f"https://swara.studio/melographs/{rec_id}/melograph.json"
     try:
         response = requests.get(url)
@@ -16,18 +32,32 @@ def get_melograph_json(rec_id: str):
         print(f"Error fetching data: {err}")
         return None
 
-rec_id = "62fa903990b9ba8cdae9d251"
-melograph_data = get_melograph_json(rec_id)
-data_chunks_list = melograph_data['data_chunks']
-time_chunks_starts = melograph_data['time_chunk_starts']
-time_chunks_list = []
-increment = melograph_data['time_increment']
-for s_idx, start in enumerate(time_chunks_starts):
-    data_chunk = data_chunks_list[s_idx]
-    time_chunk = [start + i * increment for i, _ in enumerate(data_chunk)]
-    time_chunks_list.append(time_chunk)
-# filter to only include segments between 13:30 and 13:50
-filtered_start_idxs = [i for i, start in enumerate(time_chunks_starts) if start >= 810 and start <= 830]
-data_chunks_list = [data_chunks_list[i] for i in filtered_start_idxs]
-time_chunks_list = [time_chunks_list[i] for i in filtered_start_idxs]
+def get_chunks(rec_id: str, start_time, end_time):
+    # (data chunks, time chunks) for the segments starting between
+    # start_time and end_time, or None if the recording has no melograph
+    melograph = get_melograph(rec_id)
+    if melograph is not None:
+        # found by bisecting the melograph's index
+        chunks = melograph.chunks(start_time, end_time)
+        return ([values.tolist() for _, values, _ in chunks],
+                [times.tolist() for times, _, _ in chunks])
+    melograph_data = get_melograph_json(rec_id)
+    if melograph_data is None:
+        return None
+    increment = melograph_data['time_increment']
+    data_chunks_list = []
+    time_chunks_list = []
+    for start, data_chunk in zip(melograph_data['time_chunk_starts'],
+                                 melograph_data['data_chunks']):
+        if start_time <= start <= end_time:
+            data_chunks_list.append(data_chunk)
+            time_chunks_list.append(
+                [start + i * increment for i in range(len(data_chunk))])
+    return data_chunks_list, time_chunks_list
 
+rec_id = "62fa903990b9ba8cdae9d251"
+# only the segments starting between 13:30 and 13:50
+chunks = get_chunks(rec_id, 810, 830)
+if chunks is None:
+    sys.exit(f"No melograph found for {rec_id}")
+data_chunks_list, time_chunks_list = chunks
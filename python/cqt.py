@@ -0,0 +1,264 @@
+import functools, math, tempfile, time
+import numpy as np
+
+# Constant-Q magnitudes on a fixed time grid, computed in bounded memory.
+#
+# Column n is centred on sample n * hop and only depends on the FRAME samples
+# around it (zeros before the start and after the end), so audio can be fed in
+# blocks of any size and the output is the same as for a single pass over the
+# whole signal. Each frame is FFT'd once and every bin is read off the
+# spectrum with a Hann window around its centre frequency, of width
+# alpha * f + gamma as in NSGConstantQ's variable-Q scale; the default hop
+# gives about as many columns per second as NSGConstantQ's full
+# rasterization. Frames are always worked through in batches of BATCH columns
+# aligned to multiples of BATCH, so that the arithmetic per column is
+# identical however the input was split. That also means every FFT has the
+# same (BATCH, frame_size) shape, whatever the recording's length.
+
+BATCH = 64
+# plans kept per process; each distinct Sa crop of the log spectrograms is one
+PLAN_CACHE_SIZE = 64
+
+class CQTPlan:
+    # The per-bin spectral kernels for one set of parameters. Bin 0 is the
+    # lowest frequency.
+
+    def __init__(self, sample_rate=44100, min_frequency=75, max_frequency=2400,
+                 bins_per_octave=72, gamma=20, window_size_factor=1, hop=None,
+                 frame_size=None):
+        start = time.perf_counter()
+        self.sample_rate = sample_rate
+        num_bins = int(math.floor(bins_per_octave
+                                  * math.log2(max_frequency / min_frequency))) + 1
+        self.freqs = min_frequency * 2 ** (np.arange(num_bins) / bins_per_octave)
+        alpha = 2 ** (1 / bins_per_octave) - 2 ** (-1 / bins_per_octave)
+        bandwidths = (alpha * self.freqs + gamma) / window_size_factor
+        if hop is None:
+            hop = int(round(sample_rate / bandwidths[-1]))
+        self.hop = hop
+        if frame_size is None:
+            # long enough for the narrowest bin's impulse response to die away
+            frame_size = 2 ** math.ceil(math.log2(4 * sample_rate
+                                                  / bandwidths[0]))
+        self.frame_size = frame_size
+        self.starts = []
+        self.kernels = []
+        bin_hz = sample_rate / self.frame_size
+        # (-1)^j moves each bin's phase reference to the frame centre
+        for f, bw in zip(self.freqs, bandwidths):
+            lo = max(int(math.ceil((f - bw / 2) / bin_hz)), 0)
+            hi = min(int(math.floor((f + bw / 2) / bin_hz)),
+                     self.frame_size // 2)
+            j = np.arange(lo, hi + 1)
+            window = 0.5 + 0.5 * np.cos(2 * np.pi * (j * bin_hz - f) / bw)
+            sign = np.where(j % 2 == 0, 1.0, -1.0)
+            self.starts.append(lo)
+            self.kernels.append(window * sign * 2 / self.frame_size)
+        self.setup_seconds = time.perf_counter() - start
+
+    @property
+    def num_bins(self):
+        return len(self.freqs)
+
+    def num_columns(self, num_samples):
+        return -(-num_samples // self.hop)
+
+    def columns(self, frames):
+        # magnitudes, bins x frames, for a (frames, frame_size) array
+        spectrum = np.fft.rfft(frames, axis=1)
+        out = np.empty((self.num_bins, len(frames)))
+        for k, (start, kernel) in enumerate(zip(self.starts, self.kernels)):
+            out[k] = np.abs(spectrum[:, start:start + len(kernel)] @ kernel)
+        return out
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def get_plan(sample_rate=44100, min_frequency=75, max_frequency=2400,
+             bins_per_octave=72, gamma=20, window_size_factor=1, hop=None,
+             frame_size=None):
+    # Plans are read-only once built, so one is shared by every chunk of a
+    # recording and every recording with the same parameters in the process
+    # (make_all.py's workers go through many).
+    return CQTPlan(sample_rate, min_frequency, max_frequency, bins_per_octave,
+                   gamma, window_size_factor, hop, frame_size)
+
+class ChunkedCQT:
+    # Feed consecutive blocks to `add`, then call `finish`; each returns the
+    # columns completed since the last call (possibly none).
+
+    def __init__(self, plan: CQTPlan):
+        self.plan = plan
+        half = plan.frame_size // 2
+        # samples from absolute index `buf_start` on; the signal is zero before 0
+        self.buf = np.zeros(half)
+        self.buf_start = -half
+        self.num_samples = 0
+        self.next_column = 0
+
+    def batch_span(self):
+        # absolute samples needed for the batch starting at `next_column`
+        half = self.plan.frame_size // 2
+        first = self.next_column * self.plan.hop - half
+        last = (self.next_column + BATCH - 1) * self.plan.hop + half
+        return first, last
+
+    def run_batches(self, end=None):
+        out = []
+        while True:
+            if end is not None and self.next_column >= end:
+                break
+            first, last = self.batch_span()
+            if self.buf_start + len(self.buf) < last:
+                break
+            segment = self.buf[first - self.buf_start:last - self.buf_start]
+            frames = np.lib.stride_tricks.sliding_window_view(
+                segment, self.plan.frame_size)[::self.plan.hop]
+            out.append(self.plan.columns(frames))
+            self.next_column += BATCH
+            # drop what the next batch no longer needs
+            first, _ = self.batch_span()
+            self.buf = self.buf[first - self.buf_start:]
+            self.buf_start = first
+        if not out:
+            return np.empty((self.plan.num_bins, 0))
+        return np.hstack(out)
+
+    def add(self, block):
+        self.buf = np.concatenate((self.buf, np.asarray(block, dtype=np.float64)))
+        self.num_samples += len(block)
+        return self.run_batches()
+
+    def finish(self):
+        total = self.plan.num_columns(self.num_samples)
+        done = self.next_column
+        # pad with silence to the end of the last batch
+        _, last = self.batch_span()
+        last += (max(total - done - 1, 0) // BATCH) * BATCH * self.plan.hop
+        pad = last - (self.buf_start + len(self.buf))
+        if pad > 0:
+            self.buf = np.concatenate((self.buf, np.zeros(pad)))
+        out = self.run_batches(end=total)
+        return out[:, :total - done]
+
+def cqt_blocks(blocks, plan: CQTPlan):
+    # yields bins x n arrays of magnitudes as the blocks come in
+    engine = ChunkedCQT(plan)
+    for block in blocks:
+        out = engine.add(block)
+        if out.shape[1]:
+            yield out
+    out = engine.finish()
+    if out.shape[1]:
+        yield out
+
+def cqt_file(path, plan: CQTPlan, block_seconds=10):
+    # streams the file through ffmpeg, mixed to mono at the plan's rate
+    from audio_stream import read_blocks
+    blocks = read_blocks(path, plan.sample_rate, 1,
+                         block_seconds * plan.sample_rate)
+    return cqt_blocks((b[:, 0] for b in blocks), plan)
+
+def cqt(audio, plan: CQTPlan):
+    return np.hstack(list(cqt_blocks([audio], plan)))
+
+def log_magnitude(mags):
+    # float64 log10, kept at full precision until quantized; zero magnitudes
+    # come out as -inf
+    with np.errstate(divide='ignore'):
+        return np.log10(mags, dtype=np.float64)
+
+def finite_range(logs, lo=None, hi=None):
+    # min and max of the finite logs, folded into a running lo and hi
+    finite = logs[~np.isneginf(logs)]
+    if finite.size:
+        lo = finite.min() if lo is None else min(lo, finite.min())
+        hi = finite.max() if hi is None else max(hi, finite.max())
+    return lo, hi
+
+def segment_slices(start, width, segment_columns=None):
+    # (segment, columns) for the parts of a chunk of `width` columns starting
+    # at column `start` that fall in each segment of `segment_columns`
+    if segment_columns is None:
+        yield 0, slice(0, width)
+        return
+    col = start
+    while col < start + width:
+        segment = col // segment_columns
+        end = min((segment + 1) * segment_columns, start + width)
+        yield segment, slice(col - start, end - start)
+        col = end
+
+def segment_floors(logs, start, floors, segment_columns=None):
+    # folds a chunk into `floors`, each segment's smallest finite log
+    for segment, cols in segment_slices(start, logs.shape[1],
+                                        segment_columns):
+        floors[segment], _ = finite_range(logs[:, cols], floors.get(segment))
+
+def replace_zeros(logs, start, floors, segment_columns=None):
+    # Zero magnitudes (-inf) take the smallest nonzero one of their segment,
+    # as NSGConstantQ's output had replaceZeros applied to each 600 s pass;
+    # in a segment of nothing but silence they are left to `quantize`.
+    if not np.isneginf(logs).any():
+        return logs
+    logs = logs.copy()
+    for segment, cols in segment_slices(start, logs.shape[1],
+                                        segment_columns):
+        if floors.get(segment) is not None:
+            part = logs[:, cols]
+            part[np.isneginf(part)] = floors[segment]
+    return logs
+
+def quantize(logs, lo, hi, levels=256):
+    # uint8 levels between lo and hi, zero magnitudes (-inf) taking lo; lo is
+    # None when there was nothing but silence
+    if lo is None:
+        return np.zeros(logs.shape, dtype=np.uint8)
+    logs = np.where(np.isneginf(logs), lo, logs)
+    return (levels * (logs - lo) / (hi - lo)).astype(np.uint8)
+
+class LogQuantizer:
+    # Maps log magnitudes onto 0..levels between their global min and max
+    # without holding them all in memory. Pass one (`add`) spills each
+    # chunk's float64 logs to a temp file and keeps a running min (over
+    # nonzero magnitudes) and max, overall and per segment of
+    # `segment_columns`; pass two (`chunks`) reads them back one chunk at a
+    # time, gives zero magnitudes their segment's minimum and quantizes them.
+    # The result is byte for byte what quantizing the whole array did.
+
+    def __init__(self, levels=256, spill_dir=None, segment_columns=None):
+        self.levels = levels
+        self.spill = tempfile.TemporaryFile(dir=spill_dir)
+        self.widths = []
+        self.num_bins = None
+        self.lo = None
+        self.hi = None
+        self.segment_columns = segment_columns
+        self.floors = {}
+
+    @property
+    def num_columns(self):
+        return sum(self.widths)
+
+    def add(self, mags):
+        self.add_logs(log_magnitude(mags))
+
+    def add_logs(self, logs):
+        logs = np.asarray(logs, dtype=np.float64)
+        self.num_bins = logs.shape[0]
+        self.lo, self.hi = finite_range(logs, self.lo, self.hi)
+        segment_floors(logs, self.num_columns, self.floors,
+                       self.segment_columns)
+        self.spill.write(logs.tobytes())
+        self.widths.append(logs.shape[1])
+
+    def chunks(self):
+        self.spill.seek(0)
+        start = 0
+        for width in self.widths:
+            data = self.spill.read(self.num_bins * width * 8)
+            logs = np.frombuffer(data, dtype=np.float64)
+            logs = logs.reshape(self.num_bins, width)
+            logs = replace_zeros(logs, start, self.floors,
+                                 self.segment_columns)
+            yield quantize(logs, self.lo, self.hi, self.levels)
+            start += width
+        self.spill.close()
@@ -0,0 +1,70 @@
+import argparse, time
+import numpy as np
+from cqt import get_plan, cqt_blocks, BATCH
+from spectrogram import spec_plan, wide_plan
+
+# Set-up against transform time of the chunked CQT, on synthetic audio:
+#
+#   python3 cqt_benchmark.py --seconds 600 --sa 146.8 155.6 146.8
+#
+# For each recording (one per --sa, plus the full-range spec data plan), the
+# plan lookup and the first batch (numpy's FFT plan for the frame size) are
+# timed apart from the steady-state transform; repeated parameters show the
+# plan cache being hit. An Sa is timed with the plan spectrogram.py crops its
+# log spectrograms from (the spec data's own for most Sas, so no second
+# transform), or with --separate as the transform of its own it used to get.
+
+SR = 44100
+BLOCK_SECONDS = 10
+
+def synth(seconds, sr=SR):
+    t = np.arange(int(seconds * sr)) / sr
+    noise = np.random.default_rng(0).normal(0, 0.05, len(t))
+    return (np.sin(2 * np.pi * 146.8 * t) + noise).astype(np.float32)
+
+def sa_plan(sa, octaves=3, offset=0.1):
+    # the log spectrograms' crop as a transform of its own, as it was made
+    # before spectrogram.py cropped it from the spec data's
+    return get_plan(SR, 2 ** (np.log2(sa) - offset),
+                    2 ** (np.log2((2 ** octaves) * sa) + offset))
+
+def run(audio, make_plan):
+    start = time.perf_counter()
+    plan = make_plan()
+    setup = time.perf_counter() - start
+    block = BLOCK_SECONDS * SR
+    blocks = (audio[i:i + block] for i in range(0, len(audio), block))
+    first = None
+    columns = 0
+    start = time.perf_counter()
+    for out in cqt_blocks(blocks, plan):
+        if first is None:
+            first = time.perf_counter() - start
+        columns += out.shape[1]
+    total = time.perf_counter() - start
+    return plan, setup, first, total, columns
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=600)
+    parser.add_argument('--sa', type=float, nargs='*', default=[146.8, 146.8])
+    parser.add_argument('--separate', action='store_true',
+                        help='time the Sa crops as transforms of their own')
+    args = parser.parse_args()
+
+    audio = synth(args.seconds)
+    runs = [('spec data', lambda: spec_plan(SR))]
+    for sa in args.sa:
+        if args.separate:
+            runs.append((f'sa {sa}', lambda sa=sa: sa_plan(sa)))
+        else:
+            runs.append((f'sa {sa}', lambda sa=sa: wide_plan(sa, SR)[0]))
+    for name, make_plan in runs:
+        plan, setup, first, total, columns = run(audio, make_plan)
+        steady = args.seconds / max(total - first, 1e-9)
+        print(f'{name}: {plan.num_bins} bins, frame {plan.frame_size}, '
+              f'hop {plan.hop}; plan {1000 * setup:.1f} ms '
+              f'(built in {1000 * plan.setup_seconds:.1f} ms), first block '
+              f'{1000 * first:.0f} ms, {columns} columns in {total:.2f}s '
+              f'({steady:.0f}x real time after the first block, '
+              f'{columns // BATCH} batches)')
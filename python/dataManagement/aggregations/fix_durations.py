@@ -1,7 +1,8 @@
 from pymongo import MongoClient
 from bson.objectid import ObjectId
-import os, mutagen
-from mutagen.wave import WAVE
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from media_info import probe
 username = os.environ.get('USER_NAME')
 password = os.environ.get('PASSWORD')
 query = "mongodb+srv://" + username + ":" + password + "@swara.f5cuf.mongodb.net/?retryWrites=true&w=majority"
@@ -16,7 +17,7 @@ for i, event in enumerate(all_events):
         id = rec['audioFileId']
         dur = rec['duration']
         path = './audio/wav/' + str(id) + '.wav'
-        real_dur = WAVE(path).info.length
+        real_dur = probe(path)['duration']
         if real_dur != dur:
             print('fixing ' + str(id))
             print('old dur: ' + str(dur))
@@ -0,0 +1,108 @@
+import hashlib, os, shutil, sqlite3, time
+
+# Content-hash deduplication of uploaded audio. The sha256 of each processed
+# upload's bytes is recorded against its recording id in a local sqlite
+# index; when the same bytes arrive again, the derived files of the earlier
+# recording are copied to the new id instead of being made again. They are
+# copied rather than hard linked because several writers rewrite their files
+# in place, which through a shared inode would change the other recording's.
+
+DEDUP_INDEX = os.environ.get('DEDUP_INDEX', 'dedup_index.sqlite')
+HASH_BLOCK = 2 ** 20
+PYTHON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def spec_data_dir(rec_id):
+    # where process_audio.make_visuals and visualization_scripts/
+    # make_spec_data.py put a recording's spec data, whatever the working
+    # directory
+    return os.path.join(PYTHON_DIR, 'visualization_scripts', 'spec_data',
+                        rec_id)
+
+def melograph_dir(rec_id):
+    # likewise for its melograph (visualization_scripts/generate_melograph.py)
+    return os.path.join(PYTHON_DIR, 'melographs', rec_id)
+
+# derived files per recording, relative to the server root, and whether they
+# must all exist for a cached recording to be reused. The melographs and log
+# spectrograms depend on each recording's own Sa, which is edited separately,
+# so they are left out; they are cropped again from the copied analysis/
+# intermediates (analysis_cache.py).
+ARTIFACTS = (
+    ('audio/wav/{}.wav', True),
+    ('audio/mp3/{}.mp3', True),
+    ('audio/opus/{}.opus', True),
+    ('peaks/{}.peaks', False),
+    ('peaks/{}.json', False),
+    ('spec_data/{}', False),
+    (spec_data_dir('{}'), False),
+    ('analysis/{}', False),
+)
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class DedupIndex:
+
+    def __init__(self, path=DEDUP_INDEX):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS recordings (
+                hash TEXT NOT NULL,
+                rec_id TEXT NOT NULL,
+                duration REAL,
+                sa_estimate REAL,
+                created REAL,
+                PRIMARY KEY (hash, rec_id)
+            )""")
+        self.conn.commit()
+
+    def add(self, content_hash, rec_id, duration=None, sa_estimate=None):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?)',
+            (content_hash, rec_id, duration, sa_estimate, time.time()))
+        self.conn.commit()
+
+    def remove(self, content_hash, rec_id):
+        self.conn.execute(
+            'DELETE FROM recordings WHERE hash = ? AND rec_id = ?',
+            (content_hash, rec_id))
+        self.conn.commit()
+
+    def lookup(self, content_hash, exclude=None):
+        # Most recent earlier recording with these bytes whose required files
+        # are still all on disk; entries whose files are gone are dropped.
+        rows = self.conn.execute(
+            'SELECT rec_id, duration, sa_estimate FROM recordings '
+            'WHERE hash = ? ORDER BY created DESC', (content_hash,)).fetchall()
+        for rec_id, duration, sa_estimate in rows:
+            if rec_id == exclude:
+                continue
+            if all(os.path.exists(pattern.format(rec_id))
+                   for pattern, required in ARTIFACTS if required):
+                return { 'rec_id': rec_id, 'duration': duration,
+                         'saEstimate': sa_estimate }
+            self.remove(content_hash, rec_id)
+        return None
+
+    def close(self):
+        self.conn.close()
+
+def reuse_artifacts(old_id, new_id):
+    # returns the paths made for `new_id`; copy2 keeps the mtimes, so the
+    # copied analysis/ stamps still match the copied wav
+    made = []
+    for pattern, _ in ARTIFACTS:
+        src = pattern.format(old_id)
+        dst = pattern.format(new_id)
+        if not os.path.exists(src) or os.path.exists(dst):
+            continue
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
+        made.append(dst)
+    return made
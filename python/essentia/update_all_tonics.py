@@ -1,8 +1,8 @@
-import os 
+import os, sys
 # import matplotlib.pyplot as plt
-import essentia.standard as ess
-import numpy as np
 from pymongo import MongoClient
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tonic import estimate_tonic_file, make_executor
 
 username = os.environ.get('USER_NAME')
 password = os.environ.get('PASSWORD')
@@ -13,22 +13,17 @@ audioEvents = client['swara']['audioEvents']
 findQuery = {''}
 projection = {'_id': 1, 'recordings': 1}
 result = audioEvents.find({ }, projection)
+tonic_executor = make_executor()
 for audioEvent in result:
     for key in audioEvent['recordings'].keys():
         rec = audioEvent['recordings'][key]
         recId = rec['audioFileId']
         path = './audio/wav/' + str(recId) + '.wav'
-        dur = 120
         durtot = rec['duration']
-        if durtot <= dur:
-            dur = durtot - 1
-        startTime = np.random.randint(0, durtot - dur)
-        endTime = durtot + startTime
-        loader = ess.EasyLoader(filename=path, startTime=startTime, endTime=endTime)
-        audio = loader()
-        tonic = ess.TonicIndianArtMusic(maxTonicFrequency=200)(audio)
+        tonic = estimate_tonic_file(path, durtot, executor=tonic_executor)['frequency']
         
         query = { '_id': audioEvent['_id'] }
         update = { "$set": { "recordings." + key + '.saEstimate': tonic } }
         audioEvents.update_one(query, update)
-        print(key)
\ No newline at end of file
+        print(key)
+tonic_executor.shutdown()
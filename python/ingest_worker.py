@@ -0,0 +1,205 @@
+import fcntl, json, os, sys, time, threading, traceback, argparse, uuid
+from concurrent.futures import ThreadPoolExecutor
+from process_audio import process_audio, get_mongo_client
+from tonic import make_executor
+
+# Long-running replacement for spawning `python3 process_audio.py` once per
+# upload. Jobs are JSON files dropped into `<queue_dir>/pending`; a worker
+# claims them by renaming into its own `running/<worker id>` directory, and
+# moves them to `done` or `failed` when finished. A job file looks like:
+#
+#   {"path": "<id>.mp3", "objectId": "<audio event id or 'undefined'>",
+#    "recordingIdx": "0", "recordingId": "<id>", "visuals": false,
+#    "stream": null}
+#
+# With `visuals`, a copy of the job with its `result` is also written to
+# `ingested` once the recording is processed and stored, while the
+# spectrograms and melograph are still being made; it is removed when the
+# job finishes.
+#
+# Anything that can write a file (the node server included) can enqueue a job;
+# writing to a temp name and renaming keeps half-written jobs from being read.
+#
+# A worker's id is its pid and a random suffix, and it holds an exclusive lock
+# on `running/<worker id>.lock` for as long as it runs. Jobs are only put back
+# in `pending` from the directories of workers whose lock can be taken, i.e.
+# which have died, so several workers can share one queue.
+
+QUEUE_DIR = os.environ.get('INGEST_QUEUE_DIR', 'ingest_queue')
+STATES = ('pending', 'running', 'ingested', 'done', 'failed')
+POLL_INTERVAL = 0.5
+# how often a worker looks for jobs left behind by dead ones
+REQUEUE_INTERVAL = 60
+
+def init_queue(queue_dir=QUEUE_DIR):
+    for state in STATES:
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+def enqueue(path, objectId, recording_idx, recording_id, queue_dir=QUEUE_DIR):
+    init_queue(queue_dir)
+    job = {
+        'path': path,
+        'objectId': objectId,
+        'recordingIdx': str(recording_idx),
+        'recordingId': recording_id,
+        'enqueued': time.time()
+    }
+    # time-prefixed names keep the queue roughly first in, first out
+    job_name = f'{time.time_ns()}_{uuid.uuid4().hex}.json'
+    tmp_path = os.path.join(queue_dir, job_name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, os.path.join(queue_dir, 'pending', job_name))
+    return job_name
+
+def register_worker(queue_dir=QUEUE_DIR):
+    # (worker id, open lock file); the lock is taken before the directory
+    # exists, so no other worker can see the directory and think it abandoned
+    worker_id = f'{os.getpid()}_{uuid.uuid4().hex[:8]}'
+    running_dir = os.path.join(queue_dir, 'running')
+    lock_file = open(os.path.join(running_dir, worker_id + '.lock'), 'w')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    os.makedirs(os.path.join(running_dir, worker_id))
+    return worker_id, lock_file
+
+def claim_next(queue_dir, worker_id):
+    pending_dir = os.path.join(queue_dir, 'pending')
+    for job_name in sorted(os.listdir(pending_dir)):
+        if not job_name.endswith('.json'):
+            continue
+        running_path = os.path.join(queue_dir, 'running', worker_id, job_name)
+        try:
+            os.rename(os.path.join(pending_dir, job_name), running_path)
+        except FileNotFoundError:
+            # another worker got there first
+            continue
+        return job_name
+    return None
+
+def requeue_stale(queue_dir=QUEUE_DIR):
+    # jobs left in `running` by workers that died are put back in line; a
+    # live worker's lock can't be taken, so its jobs are left alone
+    running_dir = os.path.join(queue_dir, 'running')
+    pending_dir = os.path.join(queue_dir, 'pending')
+    for name in os.listdir(running_dir):
+        path = os.path.join(running_dir, name)
+        if name.endswith('.json'):
+            # claimed before workers had their own directories
+            os.rename(path, os.path.join(pending_dir, name))
+            continue
+        if not os.path.isdir(path):
+            continue
+        lock_path = path + '.lock'
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if not os.path.isdir(path):
+                # requeued by another worker while this one waited
+                continue
+            for job_name in os.listdir(path):
+                os.rename(os.path.join(path, job_name),
+                          os.path.join(pending_dir, job_name))
+            os.rmdir(path)
+            os.remove(lock_path)
+
+def write_job(queue_dir, state, job_name, job):
+    # written under a temp name and renamed, like enqueued jobs
+    tmp_path = os.path.join(queue_dir, job_name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, os.path.join(queue_dir, state, job_name))
+
+def finish(queue_dir, worker_id, job_name, job, state):
+    write_job(queue_dir, state, job_name, job)
+    os.remove(os.path.join(queue_dir, 'running', worker_id, job_name))
+    try:
+        os.remove(os.path.join(queue_dir, 'ingested', job_name))
+    except FileNotFoundError:
+        pass
+
+def run_job(queue_dir, worker_id, job_name, db, tonic_executor):
+    with open(os.path.join(queue_dir, 'running', worker_id, job_name)) as f:
+        job = json.load(f)
+    start = time.time()
+
+    def ready(result):
+        # a job that fails while making visuals keeps its `result`, so that
+        # the upload itself is still known to have gone through
+        job['result'] = result
+        if job.get('visuals'):
+            write_job(queue_dir, 'ingested', job_name, job)
+
+    try:
+        job['result'] = process_audio(
+            job['path'], job['objectId'], job['recordingIdx'],
+            job['recordingId'], db, tonic_executor=tonic_executor,
+            visuals=job.get('visuals', False), stream=job.get('stream'),
+            ready=ready)
+        state = 'done'
+    except Exception:
+        job['error'] = traceback.format_exc()
+        state = 'failed'
+    job['elapsed'] = time.time() - start
+    if 'enqueued' in job:
+        job['latency'] = time.time() - job['enqueued']
+    finish(queue_dir, worker_id, job_name, job, state)
+    print(f"{state}: {job['path']} in {job['elapsed']:.1f}s")
+
+def run_worker(queue_dir=QUEUE_DIR, jobs=2):
+    init_queue(queue_dir)
+    worker_id, lock_file = register_worker(queue_dir)
+    requeue_stale(queue_dir)
+    last_requeue = time.time()
+    client = get_mongo_client()
+    db = client.swara
+    # tonic windows from every job share one pool of warm essentia processes
+    tonic_executor = make_executor()
+    slots = threading.Semaphore(jobs)
+
+    def run_and_release(job_name):
+        try:
+            run_job(queue_dir, worker_id, job_name, db, tonic_executor)
+        finally:
+            slots.release()
+
+    print(f'Watching {queue_dir} with {jobs} concurrent jobs')
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            while True:
+                slots.acquire()
+                if time.time() - last_requeue > REQUEUE_INTERVAL:
+                    requeue_stale(queue_dir)
+                    last_requeue = time.time()
+                job_name = claim_next(queue_dir, worker_id)
+                if job_name is None:
+                    slots.release()
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                executor.submit(run_and_release, job_name)
+        except KeyboardInterrupt:
+            print('Stopping; waiting for running jobs to finish')
+    tonic_executor.shutdown()
+    client.close()
+    # a job that couldn't be finished stays for another worker to requeue
+    if not os.listdir(os.path.join(queue_dir, 'running', worker_id)):
+        os.rmdir(os.path.join(queue_dir, 'running', worker_id))
+        os.remove(lock_file.name)
+    lock_file.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warm audio ingest worker')
+    parser.add_argument('--queue-dir', default=QUEUE_DIR)
+    parser.add_argument('--jobs', type=int,
+                        default=int(os.environ.get('INGEST_JOBS', 2)))
+    parser.add_argument('--enqueue', nargs=4,
+                        metavar=('PATH', 'OBJECT_ID', 'REC_IDX', 'REC_ID'),
+                        help='add a job to the queue instead of running')
+    args = parser.parse_args()
+    if args.enqueue:
+        print(enqueue(*args.enqueue, queue_dir=args.queue_dir))
+        sys.exit(0)
+    run_worker(args.queue_dir, args.jobs)
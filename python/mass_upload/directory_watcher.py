@@ -1,22 +1,173 @@
 import time
 import os
-import shutil
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from process_mass_uploaded_audio import process_file
+from process_audio import get_mongo_client
+from dedup_cache import DedupIndex
 
 MASS_UPLOADS_DIR = './mass_uploads'  # Use absolute path if necessary
+# a batch starts once its directory has been quiet for this long, so the
+# burst of events around one blank.txt only queues it once
+DEBOUNCE_SECONDS = 2
+WORKERS = int(os.environ.get('MASS_UPLOAD_WORKERS', 2))
+
+class Batch:
+    # The files of one uploaded directory at the time its batch started. They
+    # go into the shared pool alongside those of any other batch; the last one
+    # to finish removes the files that were processed.
+
+    def __init__(self, dir_path, files):
+        self.dir_path = dir_path
+        self.files = files
+        self.remaining = len(files)
+        self.failed = []
+        self.bytes = sum(os.path.getsize(f) for f in files)
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def file_done(self, file_path, error=None):
+        with self.lock:
+            if error is not None:
+                self.failed.append(file_path)
+            self.remaining -= 1
+            return self.remaining == 0
+
+    def report(self):
+        elapsed = time.time() - self.start
+        done = len(self.files) - len(self.failed)
+        print(f"Batch {os.path.basename(self.dir_path)}: {done}/"
+              f"{len(self.files)} files, {self.bytes / 2**20:.1f} MB in "
+              f"{elapsed:.1f}s ({60 * len(self.files) / max(elapsed, 1e-9):.1f} "
+              f"files/min, {self.bytes / 2**20 / max(elapsed, 1e-9):.2f} MB/s)")
+        for file_path in self.failed:
+            print(f"  failed: {file_path}")
+
+class BatchRunner:
+    # Debounces the directories that blank.txt shows up in and runs each one
+    # through a bounded pool of threads, one batch at a time per directory. A
+    # blank.txt arriving while a directory's batch runs queues it again for
+    # when the batch is done, so files sent after it started aren't lost.
+
+    def __init__(self, workers=WORKERS, debounce=DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.active = set()
+        self.rerun = set()
+        # sqlite connections stay on the thread that opened them; the mongo
+        # client is shared
+        self.local = threading.local()
+        self.client = None
+
+    def notify(self, dir_path):
+        with self.lock:
+            if dir_path in self.active:
+                self.rerun.add(dir_path)
+            else:
+                self.waiting[dir_path] = time.time()
+
+    def poll(self):
+        # start the batches that have been quiet for long enough
+        now = time.time()
+        with self.lock:
+            ready = [d for d, t in self.waiting.items()
+                     if now - t >= self.debounce]
+            for dir_path in ready:
+                del self.waiting[dir_path]
+                self.active.add(dir_path)
+        for dir_path in ready:
+            self.start_batch(dir_path)
+
+    def start_batch(self, dir_path):
+        if not os.path.exists(dir_path):
+            self.end_batch(dir_path)
+            return
+        files = []
+        for root, dirs, names in os.walk(dir_path):
+            for name in names:
+                if name != 'blank.txt':
+                    files.append(os.path.join(root, name))
+        batch = Batch(dir_path, files)
+        print(f"Starting batch {dir_path} with {len(files)} files")
+        if not files:
+            self.finish_batch(batch)
+        for file_path in files:
+            self.executor.submit(self.run_file, batch, file_path)
+
+    def run_file(self, batch, file_path):
+        print(f"Processing file {file_path}")
+        error = None
+        try:
+            process_file(file_path, self.index(), self.db())
+        except Exception:
+            error = traceback.format_exc()
+            print(f"Failed {file_path}:\n{error}")
+        if batch.file_done(file_path, error):
+            self.finish_batch(batch)
+
+    def index(self):
+        if not hasattr(self.local, 'index'):
+            self.local.index = DedupIndex()
+        return self.local.index
+
+    def db(self):
+        with self.lock:
+            if self.client is None:
+                self.client = get_mongo_client()
+        return self.client.swara
+
+    def finish_batch(self, batch):
+        batch.report()
+        # Only the batch's own files are deleted: anything that arrived after
+        # it started waits for the next batch, and failed files are kept to be
+        # looked at or retried (with blank.txt, so a restart picks them up).
+        failed = set(batch.failed)
+        for file_path in batch.files:
+            if file_path not in failed and os.path.exists(file_path):
+                os.remove(file_path)
+        if not failed:
+            blank_path = os.path.join(batch.dir_path, 'blank.txt')
+            if os.path.exists(blank_path):
+                os.remove(blank_path)
+        for root, _, _ in os.walk(batch.dir_path, topdown=False):
+            if not os.listdir(root):
+                os.rmdir(root)
+        if os.path.exists(batch.dir_path):
+            print(f"Kept {batch.dir_path}: {len(failed)} failed file(s), "
+                  f"{len(os.listdir(batch.dir_path))} entries left")
+        else:
+            print(f"Deleted directory {batch.dir_path}")
+        self.end_batch(batch.dir_path)
+
+    def end_batch(self, dir_path):
+        with self.lock:
+            self.active.discard(dir_path)
+            if dir_path in self.rerun:
+                self.rerun.discard(dir_path)
+                self.waiting[dir_path] = time.time()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        if self.client is not None:
+            self.client.close()
 
 class MyEventHandler(FileSystemEventHandler):
+    def __init__(self, runner):
+        self.runner = runner
+
     def on_created(self, event):
-        print(f"Created: {event.src_path}")
         self.check_for_blank_txt(event)
 
     def on_modified(self, event):
-        print(f"Modified: {event.src_path}")
         self.check_for_blank_txt(event)
 
     def on_moved(self, event):
-        print(f"Moved: from {event.src_path} to {event.dest_path}")
         self.check_for_blank_txt(event)
 
     def check_for_blank_txt(self, event):
@@ -29,45 +180,40 @@ class MyEventHandler(FileSystemEventHandler):
             paths_to_check.append(event.dest_path)
 
         for path in paths_to_check:
-            file_name = os.path.basename(path)
-            if file_name == 'blank.txt':
-                dir_path = os.path.dirname(path)
-                print(f"'blank.txt' detected in {dir_path}. Starting processing.")
-                self.process_and_cleanup(dir_path)
-                break  # Stop checking after processing
-
-    def process_and_cleanup(self, dir_path):
-        # Avoid processing the same directory multiple times
-        if not os.path.exists(dir_path):
-            return
+            if os.path.basename(path) == 'blank.txt':
+                self.runner.notify(os.path.dirname(path))
+                break
 
-        # Process the files in the directory
-        for root, dirs, files in os.walk(dir_path):
-            for file in files:
-                if file == 'blank.txt':
-                    continue  # Skip the flag file
-                file_path = os.path.join(root, file)
-                # Replace this with your processing function
-                print(f"Processing file {file_path}")
-                os.system(f'python3 process_mass_uploaded_audio.py {file_path}')
-                
-
-        # After processing, delete the directory
-        shutil.rmtree(dir_path)
-        print(f"Deleted directory {dir_path}")
+def pending_batches(uploads_dir):
+    # batches whose blank.txt arrived while the watcher wasn't running
+    for name in sorted(os.listdir(uploads_dir)):
+        dir_path = os.path.join(uploads_dir, name)
+        if os.path.exists(os.path.join(dir_path, 'blank.txt')):
+            yield dir_path
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=MASS_UPLOADS_DIR)
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="files processed at once, across all batches")
+    args = parser.parse_args()
     # Ensure MASS_UPLOADS_DIR is an absolute path
-    MASS_UPLOADS_DIR = os.path.abspath(MASS_UPLOADS_DIR)
+    uploads_dir = os.path.abspath(args.dir)
 
+    runner = BatchRunner(args.workers)
+    for dir_path in pending_batches(uploads_dir):
+        runner.notify(dir_path)
     observer = Observer()
-    event_handler = MyEventHandler()
-    observer.schedule(event_handler, path=MASS_UPLOADS_DIR, recursive=True)
+    observer.schedule(MyEventHandler(runner), path=uploads_dir, recursive=True)
     observer.start()
-    print(f"Watching for 'blank.txt' files in {MASS_UPLOADS_DIR}")
+    print(f"Watching for 'blank.txt' files in {uploads_dir} "
+          f"with {args.workers} workers")
     try:
         while True:
-            time.sleep(1)
+            runner.poll()
+            time.sleep(0.5)
     except KeyboardInterrupt:
         observer.stop()
+        print("Stopping; waiting for running files to finish")
     observer.join()
+    runner.shutdown()
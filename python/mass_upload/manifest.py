@@ -0,0 +1,91 @@
+import json, os, threading
+from datetime import datetime
+
+# Per-entry progress of a mass upload, kept as `manifest.json` in the uuid
+# working directory so that an interrupted run can be picked up again with
+# `mass_upload.py <dir> --resume <uuid>`. Entries are keyed by spreadsheet
+# row, and keep the object ids handed out on the first run so that a rerun
+# inserts and transfers under the same ids.
+#
+# `transferred` means an entry's file is on the server; `released` that the
+# `blank.txt` telling the server to process it has been sent since.
+
+MANIFEST_NAME = 'manifest.json'
+STAGES = ('cut', 'analysed', 'inserted', 'transferred', 'released')
+
+class Manifest:
+    path: str
+    data: dict
+
+    def __init__(self, dir: str, unique_id: str):
+        # entries are marked from the transfer thread as well as the main one
+        self.lock = threading.RLock()
+        self.path = os.path.join(dir, MANIFEST_NAME)
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+        else:
+            self.data = {
+                "unique_id": unique_id,
+                "created": datetime.now().isoformat(),
+                "entries": {},
+                "audio_events": {}
+            }
+
+    @staticmethod
+    def exists(dir: str) -> bool:
+        return os.path.exists(os.path.join(dir, MANIFEST_NAME))
+
+    def save(self):
+        # write-then-rename, so a crash mid-save leaves the old manifest intact
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def entry(self, row_idx: int) -> dict:
+        with self.lock:
+            entry = self.data["entries"].setdefault(str(row_idx), {
+                "stages": {}
+            })
+            # manifests from before a stage was added
+            for stage in STAGES:
+                entry["stages"].setdefault(stage, False)
+            return entry
+
+    def audio_event(self, name: str) -> dict:
+        return self.data["audio_events"].setdefault(name, {"inserted": False})
+
+    def done(self, row_idx: int, stage: str) -> bool:
+        return self.entry(row_idx)["stages"][stage]
+
+    def mark(self, row_idx: int, stage: str, **fields):
+        with self.lock:
+            entry = self.entry(row_idx)
+            entry["stages"][stage] = True
+            entry.update(fields)
+
+    def unmark(self, row_idx: int, stage: str):
+        with self.lock:
+            self.entry(row_idx)["stages"][stage] = False
+
+    def remaining(self, stage: str) -> list[int]:
+        with self.lock:
+            return sorted(int(row) for row in self.data["entries"]
+                          if not self.entry(int(row))["stages"][stage])
+
+    def complete(self) -> bool:
+        return len(self.remaining('released')) == 0
+
+    def report(self):
+        entries = self.data["entries"]
+        print(f"{len(entries)} entries in upload {self.data['unique_id']}")
+        for stage in STAGES:
+            rows = self.remaining(stage)
+            print(f"  {stage}: {len(entries) - len(rows)} done, "
+                  f"{len(rows)} to do {rows if rows else ''}")
+        events = self.data["audio_events"]
+        pending = [name for name, ae in events.items() if not ae["inserted"]]
+        print(f"  audio events: {len(events) - len(pending)} inserted, "
+              f"{len(pending)} to do {pending if pending else ''}")
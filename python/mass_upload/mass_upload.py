@@ -1,15 +1,20 @@
-import pandas as pd
 import os, sys, subprocess
 from typing import TypedDict
 from bson import ObjectId
-from mutagen import File
 from datetime import datetime
-import essentia.standard as ess
 from pymongo.server_api import ServerApi
-import pymongo, uuid, shutil
+import pymongo, uuid, shutil, argparse, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pymongo.errors import BulkWriteError
+from manifest import Manifest
+from sheet import load_sheet
+from transfer import TransferQueue, release, DEFAULT_TARGET
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tonic import estimate_tonic_file
+from media_info import probe
 
-def datetime_to_seconds(time):
-    return time.hour * 3600 + time.minute * 60 + time.second
+INSERT_BATCH_SIZE = 500
+DUPLICATE_KEY = 11000
 
 class Musician(TypedDict):
     name: str | None
@@ -40,6 +45,8 @@ class Audio_Event:
     
     def add_recording(self, entry: "Entry"):
         self.rec_entries.append(entry)
+
+    def sort_recordings(self):
         self.rec_entries.sort(key=lambda x: x.ae_track_num)
         
     def get_mongo_json(self):
@@ -65,7 +72,7 @@ class Audio_Event:
 class Entry:
     musicians: list[Musician]
     row_idx: int
-    row: pd.DataFrame
+    row: dict
     location: Location
     date: Date_Type
     _id: ObjectId
@@ -78,85 +85,42 @@ class Entry:
     oct_offset: int
     sa_freq: float | None
     
-    def __init__(self, df: pd.DataFrame, row_idx: int, dir: str):
+    def __init__(self, row: dict, row_idx: int, dir: str):
+        # `row` is a record of the sheet normalized by `load_sheet`, so empty
+        # cells are already None and times are in seconds
         self.sa_freq = None
         self.row_idx = row_idx
-        self.row = df.iloc[row_idx]
-        self.musicians = []
-        self.file_name = self.row["Initial File name"]
-        self.start_time = self.row["start (hh:mm:ss)"]
-        self.end_time = self.row["end (hh:mm:ss)"]
-        self.audio_event = self.row["Audio Event (optional)"]
-        self.ae_track_num = self.row["Track # (necessary if Audio Event)"]
-        ct = 0
-        trigger = True
-        keys = (
-            ('Name', 'Role', 'Instrument', 'Gharana'),
-            ('Name.1', 'Role.1', 'Instrument.1', 'Gharana.1'),
-            ('Name.2', 'Role.2', 'Instrument.2', 'Gharana.2'),
-            ('Name.3', 'Role.3', 'Instrument.3', 'Gharana.3')
-        )
-        while ct < 4 and trigger:
-            trigger = self.fill_musician(ct, *keys[ct])
-            ct += 1
-        self.fill_location()
-        self.fill_date()
-        self.raag = self.row["Raag"]
-        self.section = self.row["Section"]
-        self.song_title = self.row["Song Title"]
-        self.title = self.row["Title"]
-        self.note = self.row["Note"]
-        self.media = self.row["Recording Media"]
-        self.source_type = self.row["Source Type"]
-        self.source_detail = self.row["Source Detail"]
-        self.album_title = self.row["Album Title"]
-        self.album_track_title = self.row["Album Track Title"]
-        self.album_track_number = self.row["Album Track Number"]
+        self.row = row
+        self.musicians = row["musicians"]
+        self.file_name = row["Initial File name"]
+        self.start_time = row["start (hh:mm:ss)"]
+        self.end_time = row["end (hh:mm:ss)"]
+        self.audio_event = row["Audio Event (optional)"]
+        self.ae_track_num = row["Track # (necessary if Audio Event)"]
+        self.location = {
+            "continent": row["Continent"],
+            "country": row["Country"],
+            "city": row["City"]
+        }
+        self.date = {
+            "year": row["Year"],
+            "month": row["Month"],
+            "day": row["Day"]
+        }
+        self.raag = row["Raag"]
+        self.section = row["Section"]
+        self.song_title = row["Song Title"]
+        self.title = row["Title"]
+        self.note = row["Note"]
+        self.media = row["Recording Media"]
+        self.source_type = row["Source Type"]
+        self.source_detail = row["Source Detail"]
+        self.album_title = row["Album Title"]
+        self.album_track_title = row["Album Track Title"]
+        self.album_track_number = row["Album Track Number"]
         self.dir = dir
-        
-        if pd.isna(self.start_time):
-            self.start_time = None
-        else:
-            self.start_time = datetime_to_seconds(self.start_time)
-        if pd.isna(self.end_time):
-            self.end_time = None
-        else:
-            self.end_time = datetime_to_seconds(self.end_time)
-        if pd.isna(self.audio_event):
-            self.audio_event = None
-        if pd.isna(self.raag):
-            self.raag = None
-        if pd.isna(self.section):
-            self.section = None
-        if pd.isna(self.song_title):
-            self.song_title = None
-        if pd.isna(self.title):
-            self.title = None
-        if pd.isna(self.note):
-            self.note = None
-        if pd.isna(self.media):
-            self.media = None
-        if pd.isna(self.source_type):
-            self.source_type = None
-        if pd.isna(self.source_detail):
-            self.source_detail = None
-        if pd.isna(self.album_title):
-            self.album_title = None
-        if pd.isna(self.album_track_title):
-            self.album_track_title = None
-        if pd.isna(self.album_track_number):
-            self.album_track_number = None
-        if pd.isna(self.ae_track_num):
-            self.ae_track_num = None
-        if self.album_title is not None and self.album_track_title is None:
-            raise ValueError("Album title is present but album track title is missing")
-        if self.album_title is not None and self.album_track_number is None:
-            raise ValueError("Album title is present but album track number is missing")
         self._id = ObjectId()
-        if self.audio_event is not None:
-            if self.ae_track_num is None:
-                raise ValueError("Audio event is present but track number is missing")
-        
+
         if self.start_time is None and self.end_time is None:
             self.duration = self.get_duration()
         else:
@@ -166,70 +130,11 @@ class Entry:
             self.oct_offset = -1
         else:
             self.oct_offset = 0
-            
-    def fill_musician(self, idx: int, name_field: str, role_field: str, 
-                      instrument_field: int, gharana_field: int):
-        name = self.row[name_field]
-        role = self.row[role_field]
-        instrument = self.row[instrument_field]
-        gharana = self.row[gharana_field]
-        if pd.isna(name):
-            name = None
-        if pd.isna(role):
-            role = None
-        if pd.isna(instrument):
-            instrument = None
-        if pd.isna(gharana):
-            gharana = None
-        if not name and not role and not instrument and not gharana:
-            return False
-        self.musicians.append({
-            "name": name,
-            "role": role, 
-            "instrument": instrument,
-            "gharana": gharana
-        })
-        return True
-    
-    def fill_location(self):
-        continent = self.row["Continent"]
-        country = self.row["Country"]
-        city = self.row["City"]
-        if pd.isna(continent):
-            continent = None
-        if pd.isna(country):
-            country = None
-        if pd.isna(city):
-            city = None
-        self.location = {
-            "continent": continent,
-            "country": country,
-            "city": city
-        }
-        
-    def fill_date(self):
-        year = self.row["Year"]
-        month = self.row["Month"]
-        day = self.row["Day"]
-        if pd.isna(year):
-            year = None
-        if pd.isna(month):
-            month = None
-        if pd.isna(day):
-            day = None
-        self.date = {
-            "year": year,
-            "month": month,
-            "day": day
-        }
     
     def get_duration(self):
+        # from the file's header; raises ValueError if it isn't audio
         file_path = os.path.join(self.dir, self.file_name)
-        audio = File(file_path)
-        if audio is not None and audio.info is not None:
-            return audio.info.length
-        else:
-            raise ValueError("Could not get audio file")
+        return probe(file_path)['duration']
         
     def get_ae_mongo_json(self):
         # for adding to the audio_event class instance containing recoridng, if
@@ -336,69 +241,187 @@ class Entry:
             output_obj["saEstimate"] = self.sa_freq
         return output_obj
         
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        raise ValueError("Please provide the directory path")
-    dir = sys.argv[1]
-    unique_id = str(uuid.uuid4())
-    new_dir = os.path.join(dir, unique_id)
-    os.mkdir(new_dir)
-    path = os.path.join(dir, 'test_entry.xlsx')
-    df = pd.read_excel(path, header=1)
-    entries: list[Entry] = []
-    # before gathering entries, need to go thorugh all and get list of audio 
-    # events. This is because when we later call `get_mongo_json` on audio 
-    # events, we need, if there _is_ an associated "audio event", to get its 
-    # object id.
-    audio_event_names = []
-    audio_events: list[Audio_Event] = []
-    for idx in range(len(df)):
-        row = df.iloc[idx]
-        audio_event_name = row["Audio Event (optional)"]
-        if not pd.isna(audio_event_name):
-            if audio_event_name not in audio_event_names:
-                audio_event_names.append(audio_event_name)
-    for ae in audio_event_names:
-        audio_events.append(Audio_Event(ae))
-    for idx in range(len(df)):
-        e = Entry(df, idx, dir)
-        if e.audio_event is not None:
-            ae = next((x for x in audio_events if x.name == e.audio_event), None)
-            e.parentID = audio_events[audio_event_names.index(e.audio_event)]._id
-            # ae.rec_entries.append(e)
-            ae.add_recording(e)
-        entries.append(e)
-    for e_idx, entry in enumerate(entries):
-        file_path = os.path.join(dir, entry.file_name)
-        abs_file_path = os.path.abspath(file_path)
-        extension = file_path.split('.')[-1]
-        output_file = os.path.join(new_dir, f"{entry._id}.{extension}")
-        abs_output_file = os.path.abspath(output_file)
-        
-        if entry.start_time is None:
-            entry.start_time = 0
-        if entry.end_time is not None:
-            command = [
-                "ffmpeg",
-                "-i", abs_file_path,
-                "-ss", str(entry.start_time),
-                "-to", str(entry.end_time),
-                "-c", "copy",
-                abs_output_file
-            ]
+def cut_entry(abs_file_path: str, abs_output_file: str, start_time: float,
+              end_time: float | None):
+    if end_time is not None:
+        command = [
+            "ffmpeg",
+            "-i", abs_file_path,
+            "-ss", str(start_time),
+            "-to", str(end_time),
+            "-c", "copy",
+            abs_output_file
+        ]
+    else:
+        command = [
+            "ffmpeg",
+            "-i", abs_file_path,
+            "-c", "copy",
+            abs_output_file
+        ]
+    out = subprocess.run(command, capture_output=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed cutting {abs_output_file}:\n"
+                           + out.stderr.decode(errors='replace')[-2000:])
+
+def cut_and_analyse_source(abs_file_path: str,
+                           cuts: list[tuple[str, str, float, float | None, bool]]
+                           ) -> dict[str, tuple[float | None, str | None, bool]]:
+    # All the tracks cut from one source file. The cuts themselves are stream
+    # copies (no decoding), and each track's tonic is estimated from windows
+    # read out of its cut through ffmpeg seeks (tonic.estimate_tonic_file),
+    # so neither the source nor a whole track is ever decoded into memory;
+    # a pool worker's footprint stays at a few windows however long the
+    # sources are. `cuts` holds (key, output file, start, end, whether the
+    # cut still has to be made); the result maps each key to (Sa, traceback,
+    # whether the cut exists).
+    #
+    # This runs in a pool worker, so the tonic windows are done inline rather
+    # than in a pool of their own.
+    results = {}
+    for key, abs_output_file, start_time, end_time, needs_cut in cuts:
+        if needs_cut:
+            try:
+                cut_entry(abs_file_path, abs_output_file, start_time, end_time)
+            except Exception:
+                results[key] = (None, traceback.format_exc(), False)
+                continue
+        try:
+            duration = probe(abs_output_file)['duration']
+            sa = estimate_tonic_file(abs_output_file, duration,
+                                     workers=1)['frequency']
+            results[key] = (sa, None, True)
+        except Exception:
+            results[key] = (None, traceback.format_exc(), True)
+    return results
+
+def process_entries(entries: list[Entry], dir: str, new_dir: str,
+                    workers: int, manifest: Manifest,
+                    transfer: TransferQueue) -> dict[ObjectId, str]:
+    # Cuts and analyses every entry, one pool task per source file, and
+    # records each finished stage in the manifest. Analysed entries are queued
+    # for transfer straight away. Returns the tracebacks of entries that
+    # failed, keyed by entry id; the others get their `sa_freq` filled in.
+    errors = {}
+    by_source: dict[str, list[Entry]] = {}
+    for entry in entries:
+        by_source.setdefault(entry.file_name, []).append(entry)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for file_name, source_entries in by_source.items():
+            file_path = os.path.join(dir, file_name)
+            abs_file_path = os.path.abspath(file_path)
+            extension = file_path.split('.')[-1]
+            cuts = []
+            for entry in source_entries:
+                output_file = os.path.join(new_dir, f"{entry._id}.{extension}")
+                abs_output_file = os.path.abspath(output_file)
+                if entry.start_time is None:
+                    entry.start_time = 0
+                needs_cut = not manifest.done(entry.row_idx, 'cut')
+                cuts.append((str(entry._id), abs_output_file, entry.start_time,
+                             entry.end_time, needs_cut))
+            future = executor.submit(cut_and_analyse_source, abs_file_path, cuts)
+            futures[future] = (source_entries, extension)
+        ct = 0
+        for future in as_completed(futures):
+            source_entries, extension = futures[future]
+            try:
+                results = future.result()
+            except Exception:
+                # the worker itself died
+                error = traceback.format_exc()
+                results = {str(e._id): (None, error, False) for e in source_entries}
+            for entry in source_entries:
+                ct += 1
+                label = f"row {entry.row_idx} ({entry.file_name})"
+                sa, error, cut = results[str(entry._id)]
+                if cut:
+                    manifest.mark(entry.row_idx, 'cut',
+                                  cut_file=f"{entry._id}.{extension}")
+                if error is None:
+                    entry.sa_freq = sa
+                    manifest.mark(entry.row_idx, 'analysed', sa_freq=sa)
+                    transfer.put(entry.row_idx)
+                    print(f"[{ct}/{len(entries)}] {label}: Sa {sa:.2f}")
+                else:
+                    errors[entry._id] = error
+                    print(f"[{ct}/{len(entries)}] {label}: failed")
+            manifest.save()
+    return errors
+
+def restore_from_manifest(manifest: Manifest, entries: list[Entry],
+                          audio_events: list[Audio_Event]):
+    # On a rerun, give entries and audio events the ids (and any Sa already
+    # found) from the first run; on a first run, record the new ids.
+    for ae in audio_events:
+        saved = manifest.audio_event(ae.name)
+        if "_id" in saved:
+            ae._id = ObjectId(saved["_id"])
         else:
-            command = [
-                "ffmpeg",
-                "-i", abs_file_path,
-                "-c", "copy",
-                abs_output_file
-            ]
-        subprocess.run(command, check=True)
-        
-        loader = ess.EasyLoader(filename = output_file)
-        audio = loader()
-        entry.sa_freq = ess.TonicIndianArtMusic(maxTonicFrequency=200)(audio)
-        
+            saved["_id"] = str(ae._id)
+    ae_ids = {ae.name: ae._id for ae in audio_events}
+    for entry in entries:
+        saved = manifest.entry(entry.row_idx)
+        if "_id" in saved:
+            if saved["file_name"] != entry.file_name:
+                raise ValueError(f"Row {entry.row_idx} no longer matches the "
+                                 "manifest; was the spreadsheet edited?")
+            entry._id = ObjectId(saved["_id"])
+        else:
+            saved["_id"] = str(entry._id)
+            saved["file_name"] = entry.file_name
+        if entry.audio_event is not None:
+            entry.parentID = ae_ids[entry.audio_event]
+        if saved["stages"]["analysed"]:
+            entry.sa_freq = saved["sa_freq"]
+
+def ready_to_upload(entries: list[Entry], audio_events: list[Audio_Event],
+                    manifest: Manifest, new_dir: str):
+    # Entries that are analysed, minus any whose audio event still has
+    # unfinished entries: an audio event is only inserted once all of its
+    # recordings can go with it. Partial cuts of failed entries are removed.
+    for entry in entries:
+        if not manifest.done(entry.row_idx, 'cut'):
+            for f in os.listdir(new_dir):
+                if f.startswith(str(entry._id)):
+                    os.remove(os.path.join(new_dir, f))
+    analysed = {e._id for e in entries if manifest.done(e.row_idx, 'analysed')}
+    ready_aes = [ae for ae in audio_events
+                 if all(e._id in analysed for e in ae.rec_entries)]
+    held_back = {ae.name for ae in audio_events if ae not in ready_aes}
+    ready_entries = [e for e in entries
+                     if e._id in analysed and e.audio_event not in held_back]
+    return ready_entries, ready_aes
+
+def bulk_insert(collection, docs: list[dict]) -> dict[ObjectId, str]:
+    # insert_many in unordered batches; returns the error message of every
+    # document that did not go in, keyed by _id. A duplicate key means the
+    # document landed on an earlier run, so it counts as inserted.
+    errors = {}
+    for i in range(0, len(docs), INSERT_BATCH_SIZE):
+        batch = docs[i:i + INSERT_BATCH_SIZE]
+        try:
+            collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details["writeErrors"]:
+                if write_error["code"] == DUPLICATE_KEY:
+                    continue
+                doc = batch[write_error["index"]]
+                errors[doc["_id"]] = write_error["errmsg"]
+    return errors
+
+def insert_entries(entries: list[Entry], audio_events: list[Audio_Event],
+                   manifest: Manifest):
+    # Recordings are bulk inserted first, then the audio events whose
+    # recordings all made it. Recordings of an audio event that could not be
+    # inserted are deleted again, so no recording is left with a parentID
+    # that points nowhere; they stay un-inserted in the manifest for a rerun.
+    entries = [e for e in entries if not manifest.done(e.row_idx, 'inserted')]
+    audio_events = [ae for ae in audio_events
+                    if not manifest.audio_event(ae.name)["inserted"]]
+    if len(entries) == 0 and len(audio_events) == 0:
+        return
     username = os.environ.get('USER_NAME')
     password = os.environ.get('PASSWORD')
     query = "mongodb+srv://" + username + ":" + password + "@swara.f5cuf.mongodb.net/?retryWrites=true&w=majority"
@@ -406,34 +429,129 @@ if __name__ == "__main__":
     db = client.swara
     db_audio_events = db.audioEvents
     db_audio_recordings = db.audioRecordings
+
+    rec_errors = bulk_insert(db_audio_recordings,
+                             [e.get_mongo_json() for e in entries])
+    ready_aes = [ae for ae in audio_events
+                 if not any(e._id in rec_errors for e in ae.rec_entries)]
+    ae_errors = bulk_insert(db_audio_events,
+                            [ae.get_mongo_json() for ae in ready_aes])
+    failed_aes = [ae for ae in audio_events
+                  if ae not in ready_aes or ae._id in ae_errors]
+    orphans = [e._id for ae in failed_aes for e in ae.rec_entries
+               if e._id not in rec_errors]
+    if orphans:
+        db_audio_recordings.delete_many({"_id": {"$in": orphans}})
+    client.close()
+
+    orphans = set(orphans)
     for e in entries:
-        db_audio_recordings.insert_one(e.get_mongo_json())
+        if e._id in rec_errors:
+            print(f"row {e.row_idx} ({e.file_name}) not inserted: {rec_errors[e._id]}")
+        elif e._id in orphans:
+            print(f"row {e.row_idx} ({e.file_name}) not inserted: audio event "
+                  f"'{e.audio_event}' failed")
+        else:
+            manifest.mark(e.row_idx, 'inserted')
     for ae in audio_events:
-        db_audio_events.insert_one(ae.get_mongo_json())
-        
-    blank_file_path = os.path.join(new_dir, 'blank.txt')
-    with open(blank_file_path, 'w') as f:
-        f.write('')
- 
-    rsync_command = [
-        "rsync",
-        "-avz",
-        "--exclude=blank.txt",
-        "--partial",
-        "--progress",
-        new_dir + '/',
-        "root@swara.studio:mass_uploads/" + unique_id + '/'  # Ensure the trailing '/'
-    ]
-    subprocess.run(rsync_command, check=True)
+        if ae._id in ae_errors:
+            print(f"audio event '{ae.name}' not inserted: {ae_errors[ae._id]}")
+        elif ae in ready_aes:
+            manifest.audio_event(ae.name)["inserted"] = True
+    manifest.save()
+
+def release_entries(entries: list[Entry], manifest: Manifest, new_dir: str,
+                    target: str):
+    # entries whose recordings are in the database and whose files are on
+    # the server get handed over for processing
+    rows = [e.row_idx for e in entries
+            if manifest.done(e.row_idx, 'inserted')
+            and manifest.done(e.row_idx, 'transferred')
+            and not manifest.done(e.row_idx, 'released')]
+    if rows:
+        release(new_dir, target, manifest, rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir", help="directory with test_entry.xlsx and audio")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of entries to cut and analyse at once")
+    parser.add_argument("--resume", metavar="UUID",
+                        help="pick up an earlier run from its manifest")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report what is left to do")
+    parser.add_argument("--target", default=DEFAULT_TARGET,
+                        help="rsync destination holding the upload directories")
+    args = parser.parse_args()
+    dir = args.dir
+    unique_id = args.resume or str(uuid.uuid4())
+    new_dir = os.path.join(dir, unique_id)
+    if args.resume and not Manifest.exists(new_dir):
+        raise ValueError(f"No manifest found in {new_dir}")
+    manifest = Manifest(new_dir, unique_id)
+    sheet = load_sheet(dir)
+    entries: list[Entry] = []
+    # audio events in order of first appearance, each with the object id its
+    # recordings point back to
+    audio_events_by_name: dict[str, Audio_Event] = {}
+    duration_errors = []
+    for row_idx, row in zip(sheet.index, sheet.to_dict('records')):
+        try:
+            e = Entry(row, row_idx, dir)
+        except ValueError as err:
+            duration_errors.append(f"  row {row_idx} ({row['Initial File name']}): {err}")
+            continue
+        if e.audio_event is not None:
+            if e.audio_event not in audio_events_by_name:
+                audio_events_by_name[e.audio_event] = Audio_Event(e.audio_event)
+            ae = audio_events_by_name[e.audio_event]
+            e.parentID = ae._id
+            ae.add_recording(e)
+        entries.append(e)
+    if duration_errors:
+        raise ValueError("Could not read durations:\n" + '\n'.join(duration_errors))
+    audio_events = list(audio_events_by_name.values())
+    for ae in audio_events:
+        ae.sort_recordings()
+    restore_from_manifest(manifest, entries, audio_events)
+    if args.dry_run:
+        manifest.report()
+        sys.exit(0)
+    os.makedirs(new_dir, exist_ok=True)
+    manifest.save()
+
+    target = os.path.join(args.target, unique_id) + '/'
+    transfer = TransferQueue(new_dir, target, manifest)
+    transfer.start()
+    # analysed on an earlier run but never sent
+    for e in entries:
+        if (manifest.done(e.row_idx, 'analysed')
+                and not manifest.done(e.row_idx, 'transferred')):
+            transfer.put(e.row_idx)
+    to_analyse = [e for e in entries if not manifest.done(e.row_idx, 'analysed')]
+    errors = process_entries(to_analyse, dir, new_dir, args.workers, manifest,
+                             transfer)
+    if errors:
+        print(f"\n{len(errors)} of {len(to_analyse)} entries failed:")
+        for entry in to_analyse:
+            if entry._id in errors:
+                print(f"\nrow {entry.row_idx} ({entry.file_name}):\n{errors[entry._id]}")
+    ready_entries, ready_aes = ready_to_upload(entries, audio_events, manifest,
+                                               new_dir)
+    insert_entries(ready_entries, ready_aes, manifest)
+    transfer.close()
+    for row_idx, error in transfer.errors.items():
+        print(f"row {row_idx} not transferred: {error}")
+    # blank.txt only goes once every transfer of this run has finished, and
+    # not at all while any of them is failing
+    if transfer.errors:
+        print(f"Not releasing: {len(transfer.errors)} transfer(s) failed; "
+              f"rerun with --resume {unique_id}")
+    else:
+        release_entries(ready_entries, manifest, new_dir, target)
 
-    # Then rsync 'blank.txt' to ensure it's uploaded last
-    rsync_blank_command = [
-        "rsync",
-        "-avz",
-        "--partial",
-        "--progress",
-        blank_file_path,
-        "root@swara.studio:mass_uploads/" + unique_id + '/'
-    ]
-    subprocess.run(rsync_blank_command, check=True)
-    shutil.rmtree(new_dir)
+    if manifest.complete():
+        shutil.rmtree(new_dir)
+    else:
+        manifest.report()
+        print(f"\nFix the failures above and rerun with --resume {unique_id}")
@@ -1,30 +1,59 @@
 import sys, os
-import soundfile as sf
-import essentia.standard as ess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'visualization_scripts'))
+from bson.objectid import ObjectId
+from process_audio import ingest_stream, get_mongo_client
+from dedup_cache import DedupIndex, file_hash, reuse_artifacts
+from make_spec_data import make_spec_data
 
-file_path = sys.argv[1]
-rec_id, suffix = file_path.split('/')[-1].split('.')
-wav_path = 'audio/wav/' + rec_id + '.wav'
-mp3_path = 'audio/mp3/' + rec_id + '.mp3'
-opus_path = 'audio/opus/' + rec_id + '.opus'
-sr = 44100
+def recording_info(db, rec_id):
+    # duration and Sa estimate mass_upload.py inserted for the recording
+    if db is None:
+        return {}
+    recording = db.audioRecordings.find_one(
+        { '_id': ObjectId(rec_id) }, { 'duration': 1, 'saEstimate': 1 })
+    return recording or {}
 
-loader = ess.EasyLoader(filename = file_path)
-audio = loader()
+def process_file(file_path, index, db=None):
+    # `index` and `db` are left open by the caller, so that a long-running
+    # one (see directory_watcher.py) keeps its connections across files
+    rec_id, suffix = file_path.split('/')[-1].split('.')
+    recording = recording_info(db, rec_id)
 
-if suffix == 'mp3':
-    sf.write(wav_path, audio, sr)
-    os.system(f'ffmpeg -i {file_path} -codec:a libopus {opus_path}')
-    os.rename(file_path, mp3_path)
-elif suffix == 'wav':
-    
-    os.system(f'ffmpeg -i {file_path} -vn -ar 44100 -ac 2 -b:a 192k {mp3_path}')
-    os.system(f'ffmpeg -i {file_path} -codec:a libopus {opus_path}')
-    os.rename(file_path, wav_path)
-else:
-    sf.write(wav_path, audio, sr)
-    os.system(f'ffmpeg -i {file_path} -vn -ar 44100 -ac 2 -b:a 192k {mp3_path}')
-    os.system(f'ffmpeg -i {file_path} -codec:a libopus {opus_path}')
-    os.remove(file_path)
+    # the same source is often uploaded again; reuse the earlier recording's
+    # files when the bytes match
+    content_hash = file_hash(file_path)
+    cached = index.lookup(content_hash, exclude=rec_id)
+    if cached is not None:
+        print(f"{rec_id} matches {cached['rec_id']}; reusing its files")
+        reuse_artifacts(cached['rec_id'], rec_id)
+        os.remove(file_path)
+        duration = cached['duration']
+    else:
+        # decoded block by block, so memory stays flat however long the
+        # recording is; tonic and duration were already worked out by
+        # mass_upload.py
+        result = ingest_stream(file_path, rec_id, suffix, peaks=False,
+                               tonic=False)
+        duration = result['duration']
+    # recorded as process_audio.py does, so that a later upload of the same
+    # bytes gets them without decoding the wav again
+    if duration is None:
+        duration = recording.get('duration')
+    sa_estimate = recording.get('saEstimate')
+    if sa_estimate is None and cached is not None:
+        sa_estimate = cached['saEstimate']
+    index.add(content_hash, rec_id, duration, sa_estimate)
 
-os.system(f'python3 make_spec_data.py {rec_id}')
+    spec_dir = os.path.join('spec_data', rec_id)
+    if not os.path.exists(spec_dir):
+        os.makedirs(spec_dir)
+        make_spec_data(os.path.join('audio', 'wav', rec_id + '.wav'), spec_dir)
+
+if __name__ == '__main__':
+    index = DedupIndex()
+    client = get_mongo_client()
+    process_file(sys.argv[1], index, client.swara)
+    client.close()
+    index.close()
@@ -0,0 +1,140 @@
+import os
+from datetime import datetime, timedelta
+import pandas as pd
+
+# Loading and validation of the mass upload spreadsheet. The sheet is
+# normalized a column at a time rather than a cell at a time (empty cells
+# become None, hh:mm:ss times become seconds, the musician column groups
+# become a list of records per row), and every row is checked before any audio
+# work starts, so that all of a sheet's problems are reported in one go.
+
+SHEET_NAME = 'test_entry.xlsx'
+FILE_NAME = 'Initial File name'
+START = 'start (hh:mm:ss)'
+END = 'end (hh:mm:ss)'
+AUDIO_EVENT = 'Audio Event (optional)'
+AE_TRACK = 'Track # (necessary if Audio Event)'
+ALBUM_TITLE = 'Album Title'
+ALBUM_TRACK_TITLE = 'Album Track Title'
+ALBUM_TRACK_NUMBER = 'Album Track Number'
+MUSICIAN_FIELDS = ('Name', 'Role', 'Instrument', 'Gharana')
+MAX_MUSICIANS = 4
+OTHER_COLUMNS = (
+    'Raag', 'Section', 'Song Title', 'Title', 'Note', 'Recording Media',
+    'Source Type', 'Source Detail', 'Continent', 'Country', 'City', 'Year',
+    'Month', 'Day'
+)
+# times come back from excel as datetime.time (or, past 24 hours, as a
+# timedelta with [h]:mm:ss formats and a datetime otherwise) and as text when
+# typed in; all of them print as ...hh:mm:ss, the day part added separately
+TIME_PATTERN = r'(?<!\d)(\d{1,2}):(\d{2}):(\d{2})'
+# openpyxl's datetime for 24:00:00 and up: serial day 1 is 1900-01-01
+EXCEL_DAY_ZERO = datetime(1899, 12, 31)
+
+def musician_columns(slot: int) -> list[str]:
+    # 'Name', 'Role', ... for the first musician, 'Name.1', ... for the next
+    suffix = '' if slot == 0 else f'.{slot}'
+    return [field + suffix for field in MUSICIAN_FIELDS]
+
+def required_columns() -> list[str]:
+    columns = [FILE_NAME, START, END, AUDIO_EVENT, AE_TRACK, ALBUM_TITLE,
+               ALBUM_TRACK_TITLE, ALBUM_TRACK_NUMBER, *OTHER_COLUMNS]
+    for slot in range(MAX_MUSICIANS):
+        columns += musician_columns(slot)
+    return columns
+
+def day_part(value) -> int:
+    # whole days of a time cell, which hh:mm:ss leaves out
+    if pd.isna(value):
+        return 0
+    if isinstance(value, timedelta):
+        return value.days
+    if isinstance(value, datetime):
+        return (value - EXCEL_DAY_ZERO).days
+    return 0
+
+def to_seconds(col: pd.Series) -> tuple[pd.Series, pd.Series]:
+    # seconds (None where empty) and a mask of cells that aren't times
+    parts = col.astype(str).str.extract(TIME_PATTERN).astype(float)
+    seconds = parts[0] * 3600 + parts[1] * 60 + parts[2] \
+        + col.map(day_part).astype(float) * 86400
+    bad = col.notna() & seconds.isna()
+    seconds = seconds.astype('Int64').astype(object)
+    return seconds.where(seconds.notna(), None), bad
+
+def musician_records(sheet: pd.DataFrame) -> pd.Series:
+    # The musician column groups melted into one list of records per row. As
+    # before, a row's list stops at its first entirely empty group.
+    keys = [field.lower() for field in MUSICIAN_FIELDS]
+    groups = []
+    for slot in range(MAX_MUSICIANS):
+        group = sheet[musician_columns(slot)]
+        group.columns = keys
+        groups.append(group)
+    present = pd.concat([g.notna().any(axis=1) for g in groups], axis=1)
+    present = present.cummin(axis=1)
+    melted = pd.concat(groups, keys=range(MAX_MUSICIANS))
+    melted = melted[present.T.stack().to_numpy()]
+    records = {row_idx: [] for row_idx in sheet.index}
+    for (_, row_idx), record in zip(melted.index, melted.to_dict('records')):
+        records[row_idx].append(record)
+    return pd.Series(records, dtype=object)
+
+def normalize(df: pd.DataFrame) -> tuple[pd.DataFrame, list[tuple[int, str]]]:
+    sheet = df.astype(object).where(df.notna(), None)
+    errors = []
+    for column in (START, END):
+        sheet[column], bad = to_seconds(df[column])
+        errors += [(row_idx, f"{column} '{df[column][row_idx]}' is not a time")
+                   for row_idx in df.index[bad]]
+    sheet['musicians'] = musician_records(sheet)
+    return sheet, errors
+
+def validate(sheet: pd.DataFrame, dir: str) -> list[tuple[int, str]]:
+    errors = []
+
+    def check(mask: pd.Series, message: str):
+        errors.extend((row_idx, message) for row_idx in sheet.index[mask])
+
+    has = sheet.notna()
+    check(~has[FILE_NAME], "File name is missing")
+    # each source file is only looked up once, however many tracks it has
+    found = [name for name in sheet[FILE_NAME].dropna().unique()
+             if os.path.isfile(os.path.join(dir, name))]
+    check(has[FILE_NAME] & ~sheet[FILE_NAME].isin(found), "File not found")
+    check(has[ALBUM_TITLE] & ~has[ALBUM_TRACK_TITLE],
+          "Album title is present but album track title is missing")
+    check(has[ALBUM_TITLE] & ~has[ALBUM_TRACK_NUMBER],
+          "Album title is present but album track number is missing")
+    check(has[AUDIO_EVENT] & ~has[AE_TRACK],
+          "Audio event is present but track number is missing")
+    check(has[START] != has[END],
+          "Start and end times must be given together")
+    timed = has[START] & has[END]
+    check(timed & (sheet[END].where(timed, 0) <= sheet[START].where(timed, 0)),
+          "End time is not after start time")
+    tracks = sheet[has[AUDIO_EVENT] & has[AE_TRACK]]
+    check(tracks.duplicated([AUDIO_EVENT, AE_TRACK], keep=False)
+          .reindex(sheet.index, fill_value=False),
+          "Track number is repeated within its audio event")
+    check(sheet['musicians'].map(len) == 0, "No musicians are listed")
+    return errors
+
+def format_errors(sheet: pd.DataFrame, errors: list[tuple[int, str]]) -> str:
+    lines = [f"{len(errors)} problem(s) in the spreadsheet:"]
+    for row_idx, message in sorted(errors, key=lambda e: e[0]):
+        lines.append(f"  row {row_idx} ({sheet[FILE_NAME][row_idx]}): {message}")
+    return '\n'.join(lines)
+
+def load_sheet(dir: str) -> pd.DataFrame:
+    # The normalized sheet, with a `musicians` column added; raises a
+    # ValueError listing every problem found.
+    df = pd.read_excel(os.path.join(dir, SHEET_NAME), header=1)
+    missing = [c for c in required_columns() if c not in df.columns]
+    if missing:
+        raise ValueError(f"Spreadsheet is missing columns: {missing}")
+    sheet, errors = normalize(df)
+    errors += validate(sheet, dir)
+    if errors:
+        raise ValueError(format_errors(sheet, errors))
+    return sheet
@@ -0,0 +1,114 @@
+import os, queue, subprocess, tempfile, threading, time
+from manifest import Manifest
+
+# Background rsync of finished cuts, so that the network is busy while later
+# entries are still being cut and analysed. Whatever has queued up while the
+# previous rsync ran goes out together in the next one.
+
+DEFAULT_TARGET = "root@swara.studio:mass_uploads/"
+RETRIES = 3
+RETRY_DELAY = 5
+
+def rsync(files: list[str], src_dir: str, target: str, extra_args=()):
+    command = [
+        "rsync",
+        "-avz",
+        "--partial",
+        *extra_args,
+        "--files-from=-",
+        src_dir + '/',
+        target
+    ]
+    subprocess.run(command, input='\n'.join(files).encode(), check=True)
+
+class TransferQueue:
+    # `target` is the upload's own directory, with a trailing '/'; it may be
+    # a local path as well as a remote one.
+
+    def __init__(self, src_dir: str, target: str, manifest: Manifest):
+        self.src_dir = src_dir
+        self.target = target
+        self.manifest = manifest
+        self.queue: queue.Queue = queue.Queue()
+        self.errors: dict[int, str] = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, row_idx: int):
+        self.queue.put(row_idx)
+
+    def close(self):
+        # wait for everything queued so far to be sent
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        closing = False
+        while not closing:
+            rows = [self.queue.get()]
+            while not self.queue.empty():
+                rows.append(self.queue.get())
+            if None in rows:
+                closing = True
+                rows = [r for r in rows if r is not None]
+            if rows:
+                self.send(rows)
+
+    def send(self, rows: list[int]):
+        files = [self.manifest.entry(r)["cut_file"] for r in rows]
+        for attempt in range(1, RETRIES + 1):
+            try:
+                rsync(files, self.src_dir, self.target)
+                break
+            except subprocess.CalledProcessError as e:
+                if attempt == RETRIES:
+                    for r in rows:
+                        self.errors[r] = f"rsync failed: {e}"
+                    return
+                time.sleep(RETRY_DELAY)
+        for r in rows:
+            self.manifest.mark(r, 'transferred')
+        self.manifest.save()
+        print(f"transferred {len(files)} file(s)")
+
+def remove(files: list[str], target: str):
+    # Deletes `files` (names in the top of `target`) and nothing else: an
+    # empty directory is synced over the target with only those names
+    # included, and rsync never deletes what its filters exclude.
+    with tempfile.TemporaryDirectory() as empty_dir:
+        command = [
+            "rsync",
+            "-r",
+            "--delete",
+            "--include-from=-",
+            "--exclude=*",
+            empty_dir + '/',
+            target
+        ]
+        names = '\n'.join('/' + f for f in files)
+        subprocess.run(command, input=names.encode(), check=True)
+
+def release(src_dir: str, target: str, manifest: Manifest,
+            rows: list[int]):
+    # Send `blank.txt` so the server processes the files of `rows`. Files of
+    # entries that were sent early but then failed to insert are removed
+    # from the target first, so the server never processes audio without a
+    # recording; entries released by an earlier run are left alone, as the
+    # server may still be working on them.
+    withdrawn = [r for r in manifest.remaining('released')
+                 if r not in rows and manifest.done(r, 'transferred')]
+    if withdrawn:
+        remove([manifest.entry(r)["cut_file"] for r in withdrawn], target)
+        for r in withdrawn:
+            manifest.unmark(r, 'transferred')
+        manifest.save()
+    # already sent, but make sure they are all there before blank.txt
+    rsync([manifest.entry(r)["cut_file"] for r in rows], src_dir, target)
+    with open(os.path.join(src_dir, 'blank.txt'), 'w') as f:
+        f.write('')
+    rsync(['blank.txt'], src_dir, target)
+    for r in rows:
+        manifest.mark(r, 'released')
+    manifest.save()
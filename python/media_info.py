@@ -0,0 +1,330 @@
+import json, os, sqlite3, struct, subprocess, threading
+from typing import TypedDict
+
+# Duration, sample rate and channel count of audio files, read from the
+# container headers (wav, mp3, opus, flac) without decoding. A file is only
+# decoded when its header can't be trusted for the length: a wav or flac
+# written as a stream that never had its sizes filled in, an mp3 that is VBR
+# without a Xing/VBRI frame count. Other formats are left to ffprobe. Results
+# are cached in a local sqlite file keyed by path, mtime and size.
+
+PROBE_CACHE = os.environ.get('PROBE_CACHE', 'probe_cache.sqlite')
+DECODE_BLOCK = 2 ** 20
+OPUS_RATE = 48000
+# how many mp3 frames have to share one bitrate to take a file as CBR
+CBR_CHECK_FRAMES = 8
+OGG_TAIL = 2 ** 16
+
+class MediaInfo(TypedDict):
+    duration: float
+    sample_rate: int
+    channels: int
+    # 'header', 'ffprobe' or 'decode'
+    source: str
+
+class Unreliable(Exception):
+    # the header was read, but its length can't be trusted
+    def __init__(self, sample_rate, channels):
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+def skip_id3(f):
+    # position just past a leading ID3v2 tag, if there is one
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = 0
+        for b in header[6:10]:
+            size = (size << 7) | (b & 0x7f)
+        footer = 10 if header[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+def wav_header(f, file_size):
+    riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError('not a RIFF/WAVE file')
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ValueError('no data chunk')
+        chunk_id, size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', f.read(16))
+            f.seek(size - 16 + size % 2, 1)
+        elif chunk_id == b'data':
+            break
+        else:
+            f.seek(size + size % 2, 1)
+    if fmt is None:
+        raise ValueError('no fmt chunk')
+    _, channels, sample_rate, _, block_align, _ = fmt
+    # writers that stream a wav out fill the size in at the end, if at all
+    if size in (0, 0xffffffff) or f.tell() + size > file_size:
+        raise Unreliable(sample_rate, channels)
+    return size / block_align / sample_rate, sample_rate, channels
+
+def flac_header(f, file_size):
+    f.seek(skip_id3(f))
+    if f.read(4) != b'fLaC':
+        raise ValueError('not a flac file')
+    # STREAMINFO is always the first metadata block
+    f.read(4)
+    info = f.read(34)
+    packed = int.from_bytes(info[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xfffffffff
+    if total_samples == 0:
+        raise Unreliable(sample_rate, channels)
+    return total_samples / sample_rate, sample_rate, channels
+
+def opus_header(f, file_size):
+    # pre-skip and channels from OpusHead on the first page, the length from
+    # the granule position on the last page of the same stream
+    page = f.read(27)
+    if page[:4] != b'OggS':
+        raise ValueError('not an ogg file')
+    serial = page[14:18]
+    segments = page[26]
+    f.read(segments)
+    head = f.read(19)
+    if head[:8] != b'OpusHead':
+        raise ValueError('not an opus stream')
+    channels = head[9]
+    pre_skip = struct.unpack('<H', head[10:12])[0]
+    f.seek(max(0, file_size - OGG_TAIL))
+    tail = f.read()
+    pos = tail.rfind(b'OggS')
+    while pos != -1:
+        if tail[pos + 14:pos + 18] == serial and len(tail) >= pos + 27:
+            granule = struct.unpack('<q', tail[pos + 6:pos + 14])[0]
+            if granule >= 0:
+                return (granule - pre_skip) / OPUS_RATE, OPUS_RATE, channels
+        pos = tail.rfind(b'OggS', 0, pos)
+    raise Unreliable(OPUS_RATE, channels)
+
+MP3_BITRATES = {
+    # (mpeg 1, layer) and (mpeg 2/2.5, layer), in kbit/s
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000),
+             2.5: (11025, 12000, 8000)}
+
+def mp3_frame(header):
+    # (version, layer, bitrate, sample rate, padding, channels, frame length,
+    # samples per frame) of a 4 byte frame header, or None if it isn't one
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+    version = {3: 1, 2: 2, 0: 2.5}.get((header[1] >> 3) & 0x3)
+    layer = {3: 1, 2: 2, 1: 3}.get((header[1] >> 1) & 0x3)
+    bitrate_idx = header[2] >> 4
+    rate_idx = (header[2] >> 2) & 0x3
+    if version is None or layer is None or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_idx] * 1000
+    sample_rate = MP3_RATES[version][rate_idx]
+    padding = (header[2] >> 1) & 0x1
+    channels = 1 if header[3] >> 6 == 3 else 2
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 3 and version != 1 else 1152
+        length = samples // 8 * bitrate // sample_rate + padding
+    return version, layer, bitrate, sample_rate, padding, channels, length, samples
+
+def mp3_header(f, file_size):
+    start = skip_id3(f)
+    f.seek(start)
+    # the first frame may not sit right after the tag
+    buf = f.read(2 ** 16)
+    pos = 0
+    while True:
+        pos = buf.find(b'\xff', pos)
+        if pos == -1 or pos + 4 > len(buf):
+            raise ValueError('no mpeg frame found')
+        frame = mp3_frame(buf[pos:pos + 4])
+        if frame is not None:
+            break
+        pos += 1
+    version, layer, bitrate, sample_rate, _, channels, length, samples = frame
+    frame_start = start + pos
+    f.seek(frame_start)
+    data = f.read(max(length, 192))
+    side_info = (32 if channels == 2 else 17) if version == 1 else \
+        (17 if channels == 2 else 9)
+    xing = 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+            total = frames * samples
+            lame = xing + 8 + 4 * (flags & 0x1) + 4 * ((flags >> 1) & 0x1) \
+                + 100 * ((flags >> 2) & 0x1) + 4 * ((flags >> 3) & 0x1)
+            if data[lame:lame + 4] == b'LAME' and len(data) >= lame + 24:
+                # encoder delay and padding, for gapless playback
+                gapless = int.from_bytes(data[lame + 21:lame + 24], 'big')
+                total -= (gapless >> 12) + (gapless & 0xfff)
+            return total / sample_rate, sample_rate, channels
+    if data[36:40] == b'VBRI':
+        frames = struct.unpack('>I', data[50:54])[0]
+        return frames * samples / sample_rate, sample_rate, channels
+    # No frame count: the length can only be worked out from the size if
+    # the bitrate is constant, so look at the first few frames.
+    f.seek(frame_start)
+    for _ in range(CBR_CHECK_FRAMES):
+        next_frame = mp3_frame(f.read(4))
+        if next_frame is None:
+            break
+        if next_frame[2] != bitrate:
+            raise Unreliable(sample_rate, channels)
+        f.seek(next_frame[6] - 4, 1)
+    audio_bytes = file_size - frame_start
+    f.seek(max(0, file_size - 128))
+    if f.read(3) == b'TAG':
+        audio_bytes -= 128
+    return audio_bytes * 8 / bitrate, sample_rate, channels
+
+HEADER_READERS = {
+    'wav': wav_header,
+    'wave': wav_header,
+    'flac': flac_header,
+    'opus': opus_header,
+    'mp3': mp3_header,
+}
+
+def ffprobe_info(path):
+    command = [
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=sample_rate,channels:format=duration',
+        '-of', 'json', path
+    ]
+    out = subprocess.run(command, capture_output=True)
+    if out.returncode != 0:
+        raise ValueError(f'Could not probe {path}: '
+                         + out.stderr.decode(errors='replace').strip())
+    data = json.loads(out.stdout)
+    if not data.get('streams'):
+        raise ValueError(f'No audio stream in {path}')
+    stream = data['streams'][0]
+    duration = data.get('format', {}).get('duration')
+    return (None if duration is None else float(duration),
+            int(stream['sample_rate']), int(stream['channels']))
+
+def decode_duration(path, sample_rate):
+    # count the samples ffmpeg decodes, at the file's own rate
+    command = [
+        'ffmpeg', '-v', 'error', '-i', path, '-vn', '-f', 's16le',
+        '-ac', '1', '-ar', str(sample_rate), 'pipe:1'
+    ]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+    num_bytes = 0
+    for block in iter(lambda: proc.stdout.read(DECODE_BLOCK), b''):
+        num_bytes += len(block)
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise ValueError(f'Could not decode {path}')
+    return num_bytes / 2 / sample_rate
+
+def read_info(path) -> MediaInfo:
+    ext = path.rsplit('.', 1)[-1].lower()
+    reader = HEADER_READERS.get(ext)
+    if reader is not None:
+        try:
+            with open(path, 'rb') as f:
+                duration, sample_rate, channels = reader(f, os.path.getsize(path))
+            return { 'duration': duration, 'sample_rate': sample_rate,
+                     'channels': channels, 'source': 'header' }
+        except Unreliable as e:
+            return { 'duration': decode_duration(path, e.sample_rate),
+                     'sample_rate': e.sample_rate, 'channels': e.channels,
+                     'source': 'decode' }
+        except (ValueError, struct.error, IndexError, KeyError):
+            # misnamed or damaged; see what ffmpeg makes of it
+            pass
+    duration, sample_rate, channels = ffprobe_info(path)
+    if duration is None:
+        return { 'duration': decode_duration(path, sample_rate),
+                 'sample_rate': sample_rate, 'channels': channels,
+                 'source': 'decode' }
+    return { 'duration': duration, 'sample_rate': sample_rate,
+             'channels': channels, 'source': 'ffprobe' }
+
+class ProbeCache:
+    # shared by every thread of a process, hence the lock
+
+    def __init__(self, path=PROBE_CACHE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS media_info (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                duration REAL NOT NULL,
+                sample_rate INTEGER NOT NULL,
+                channels INTEGER NOT NULL,
+                source TEXT NOT NULL
+            )""")
+        self.conn.commit()
+
+    def get(self, path, stat) -> MediaInfo | None:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT duration, sample_rate, channels, source FROM media_info '
+                'WHERE path = ? AND mtime_ns = ? AND size = ?',
+                (path, stat.st_mtime_ns, stat.st_size)).fetchone()
+        if row is None:
+            return None
+        duration, sample_rate, channels, source = row
+        return { 'duration': duration, 'sample_rate': sample_rate,
+                 'channels': channels, 'source': source }
+
+    def put(self, path, stat, info: MediaInfo):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO media_info VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, stat.st_mtime_ns, stat.st_size, info['duration'],
+                 info['sample_rate'], info['channels'], info['source']))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def default_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProbeCache()
+        return _cache
+
+def probe(path, use_cache=True) -> MediaInfo:
+    # raises ValueError for files that can't be read as audio
+    if not use_cache:
+        return read_info(path)
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    cache = default_cache()
+    info = cache.get(path, stat)
+    if info is None:
+        info = read_info(path)
+        cache.put(path, stat, info)
+    return info
+
+if __name__ == '__main__':
+    import sys, time
+    start = time.time()
+    for path in sys.argv[1:]:
+        info = probe(path)
+        print(f"{path}: {info['duration']:.3f}s, {info['sample_rate']} Hz, "
+              f"{info['channels']} ch ({info['source']})")
+    print(f'{len(sys.argv) - 1} files in {time.time() - start:.2f}s')
@@ -0,0 +1,77 @@
+import argparse, time
+import numpy as np
+from melograph import (MIN_FREQUENCY, MAX_FREQUENCY, SEGMENT_SECONDS,
+                       SEGMENT_OVERLAP_SECONDS, melodia, segmented_pitch_track)
+
+# Segmented, pooled pitch tracking against a single Melodia pass, on real
+# recordings:
+#
+#   python3 melodia_benchmark.py audio/wav/<id>.wav ... --workers 8
+#
+# For each file, both tracks are timed and compared frame by frame: how many
+# frames' voicing differs, and over frames both voice, how far apart the
+# pitches are. The last line totals the corpus.
+
+DIFF_CENTS = 50
+
+def compare(single, segmented):
+    (p1, c1), (p2, c2) = single, segmented
+    n = min(len(p1), len(p2))
+    p1, p2 = p1[:n], p2[:n]
+    voiced1, voiced2 = p1 > 0, p2 > 0
+    both = voiced1 & voiced2
+    cents = np.abs(1200 * np.log2(p1[both] / p2[both]))
+    return {
+        'frames': n,
+        'length_diff': len(single[0]) - len(segmented[0]),
+        'voicing_diff': int(np.sum(voiced1 != voiced2)),
+        'both_voiced': int(both.sum()),
+        'pitch_diff': int(np.sum(cents > DIFF_CENTS)),
+        'cents': cents
+    }
+
+def report(name, seconds, single_time, segmented_time, diff):
+    median = float(np.median(diff['cents'])) if len(diff['cents']) else 0.0
+    print(f'{name}: {seconds / 60:.1f} min, single {single_time:.1f}s, '
+          f'segmented {segmented_time:.1f}s '
+          f'({single_time / max(segmented_time, 1e-9):.1f}x); voicing differs '
+          f'on {100 * diff["voicing_diff"] / max(diff["frames"], 1):.2f}% of '
+          f'frames, pitch by >{DIFF_CENTS} cents on '
+          f'{100 * diff["pitch_diff"] / max(diff["both_voiced"], 1):.2f}% of '
+          f'frames both voice (median {median:.2f} cents), '
+          f'length {diff["length_diff"]:+d} frames')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--segment', type=int, default=SEGMENT_SECONDS)
+    parser.add_argument('--overlap', type=int, default=SEGMENT_OVERLAP_SECONDS)
+    args = parser.parse_args()
+
+    import essentia.standard as ess
+    totals = None
+    total_seconds = total_single = total_segmented = 0
+    for path in args.paths:
+        audio = ess.EasyLoader(filename=path, replayGain=0)()
+        start = time.perf_counter()
+        single = melodia(audio, MIN_FREQUENCY, MAX_FREQUENCY)
+        single_time = time.perf_counter() - start
+        start = time.perf_counter()
+        segmented = segmented_pitch_track(audio, MIN_FREQUENCY, MAX_FREQUENCY,
+                                          args.workers, args.segment,
+                                          args.overlap)
+        segmented_time = time.perf_counter() - start
+        diff = compare(single, segmented)
+        report(path, len(audio) / 44100, single_time, segmented_time, diff)
+        total_seconds += len(audio) / 44100
+        total_single += single_time
+        total_segmented += segmented_time
+        if totals is None:
+            totals = dict(diff)
+        else:
+            for key in ('frames', 'length_diff', 'voicing_diff',
+                        'both_voiced', 'pitch_diff'):
+                totals[key] += diff[key]
+            totals['cents'] = np.concatenate((totals['cents'], diff['cents']))
+    report('all', total_seconds, total_single, total_segmented, totals)
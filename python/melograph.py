@@ -0,0 +1,186 @@
+import json, os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# The melograph: the predominant pitch track of a recording, split into
+# voiced runs and written as melograph.json for the front end. The track is
+# computed once over a wide range and cropped to each Sa's range (see
+# analysis_cache.py), so a new Sa doesn't need the audio again.
+
+# EasyLoader(replayGain=0) scales the decoded signal by db2amp(0 + 6); callers
+# passing in unit-gain audio should apply the same factor.
+REPLAY_GAIN_SCALE = 10 ** (6 / 20)
+SAMPLE_RATE = 44100
+FRAME_SIZE = 2048
+HOP_SIZE = 128
+# long recordings are tracked in segments of SEGMENT_SECONDS, each with
+# SEGMENT_OVERLAP_SECONDS more audio either side, across a process pool
+SEGMENT_MIN_SECONDS = 10 * 60
+SEGMENT_SECONDS = 120
+SEGMENT_OVERLAP_SECONDS = 10
+AGREE_CENTS = 20
+MIN_FREQUENCY = 75
+MAX_FREQUENCY = 2400
+CONFIDENCE_THRESHOLD = 0.1
+# in natural log frequency, about a third of an octave
+BREAK_THRESHOLD = 0.2
+DECIMATION = 4
+# melograph.json is still written for the front end; melograph.mel holds the
+# same points with a time index (melograph_store.py)
+WRITE_JSON_MELOGRAPH = True
+STORE_CONFIDENCE = True
+
+def sa_range(sa, octaves=3, offset=0.1):
+    # pitch range for a recording with a verified Sa: three octaves up from it,
+    # with a tenth of an octave to spare either side
+    min_freq = 2 ** (np.log2(sa) - offset)
+    max_freq = 2 ** (np.log2((2 ** octaves) * sa) + offset)
+    return min_freq, max_freq
+
+def melodia(audio, min_freq=MIN_FREQUENCY, max_freq=MAX_FREQUENCY):
+    import essentia.standard as ess
+    pExt = ess.PredominantPitchMelodia(
+        frameSize=FRAME_SIZE, hopSize=HOP_SIZE, minFrequency=min_freq,
+        maxFrequency=max_freq)
+    return pExt(audio)
+
+def pitch_track(audio, min_freq=MIN_FREQUENCY, max_freq=MAX_FREQUENCY,
+                workers=None):
+    # (pitch, confidence), one value per HOP_SIZE samples. Recordings longer
+    # than SEGMENT_MIN_SECONDS are tracked in overlapping segments across a
+    # process pool unless `workers` is 1 (as inside make_all.py's pool).
+    if workers == 1 or len(audio) < SEGMENT_MIN_SECONDS * SAMPLE_RATE:
+        return melodia(audio, min_freq, max_freq)
+    return segmented_pitch_track(audio, min_freq, max_freq, workers)
+
+def segment_bounds(num_samples, segment_seconds=SEGMENT_SECONDS,
+                   overlap_seconds=SEGMENT_OVERLAP_SECONDS):
+    # (start, end) samples of each segment: cores of `segment_seconds`
+    # widened by `overlap_seconds` either side, all on the hop grid so that
+    # frame i of a segment starting at `start` is frame start / HOP_SIZE + i
+    # of the whole recording
+    core = segment_seconds * SAMPLE_RATE // HOP_SIZE * HOP_SIZE
+    overlap = overlap_seconds * SAMPLE_RATE // HOP_SIZE * HOP_SIZE
+    return [(max(start - overlap, 0), min(start + core + overlap, num_samples))
+            for start in range(0, num_samples, core)], core
+
+def cut_frame(a, a_first, b, b_first, boundary, reach):
+    # Where to hand over from track `a` to track `b` (global frames from
+    # a_first and b_first): the frame within `reach` of `boundary` nearest to
+    # it at which the two agree, both unvoiced or within AGREE_CENTS, so that
+    # no contour is cut off mid-way; `boundary` if there is none.
+    lo = max(boundary - reach, b_first)
+    hi = min(boundary + reach, a_first + len(a), b_first + len(b))
+    if hi <= lo:
+        return boundary
+    pa = a[lo - a_first:hi - a_first]
+    pb = b[lo - b_first:hi - b_first]
+    voiced = (pa > 0) & (pb > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cents = np.abs(1200 * np.log2(pa / pb))
+    agree = ((pa <= 0) & (pb <= 0)) | (voiced & (cents < AGREE_CENTS))
+    candidates = np.flatnonzero(agree) + lo
+    if len(candidates) == 0:
+        return boundary
+    return int(candidates[np.argmin(np.abs(candidates - boundary))])
+
+def stitch(tracks, bounds, core):
+    # one (pitch, confidence) from the segments' tracks, each segment
+    # handing over to the next inside their overlap
+    pitch = []
+    confidence = []
+    frame = 0
+    for k, (p, c) in enumerate(tracks):
+        first = bounds[k][0] // HOP_SIZE
+        if k + 1 < len(tracks):
+            boundary = (k + 1) * core // HOP_SIZE
+            reach = (boundary - bounds[k + 1][0] // HOP_SIZE) // 2
+            cut = cut_frame(p, first, tracks[k + 1][0],
+                            bounds[k + 1][0] // HOP_SIZE, boundary, reach)
+        else:
+            cut = first + len(p)
+        pitch.append(p[frame - first:cut - first])
+        confidence.append(c[frame - first:cut - first])
+        frame = cut
+    return np.concatenate(pitch), np.concatenate(confidence)
+
+def segmented_pitch_track(audio, min_freq=MIN_FREQUENCY,
+                          max_freq=MAX_FREQUENCY, workers=None,
+                          segment_seconds=SEGMENT_SECONDS,
+                          overlap_seconds=SEGMENT_OVERLAP_SECONDS):
+    # Melodia's contour selection only looks SEGMENT_OVERLAP_SECONDS or so
+    # around a frame, but its voicing threshold comes from the statistics of
+    # all the contours it was given, so a segment can voice a little
+    # differently from the whole (see melodia_benchmark.py).
+    bounds, core = segment_bounds(len(audio), segment_seconds, overlap_seconds)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(melodia, audio[start:end], min_freq,
+                                   max_freq)
+                   for start, end in bounds]
+        tracks = [future.result() for future in futures]
+    return stitch(tracks, bounds, core)
+
+def crop_track(pitch, confidence, min_freq, max_freq):
+    # frames whose pitch is outside the range lose their confidence, so they
+    # are dropped as unvoiced
+    outside = (pitch < min_freq) | (pitch > max_freq)
+    return pitch, np.where(outside, 0, confidence).astype(confidence.dtype)
+
+def melograph_runs(pitch, confidence):
+    # Runs of frames with confidence of at least CONFIDENCE_THRESHOLD, split
+    # again wherever the (rounded) pitch jumps by more than BREAK_THRESHOLD
+    # in log frequency between neighbouring frames, and each run thinned to
+    # every DECIMATION-th frame from its start. Returns the kept frames, the
+    # offset of each run's first one among them and each run's first frame.
+    voiced = np.flatnonzero(~(confidence < CONFIDENCE_THRESHOLD))
+    if len(voiced) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    # round() on the float64 scalars was np.round
+    values = np.round(pitch[voiced].astype(np.float64), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jumps = np.abs(np.log(values[1:] / values[:-1])) > BREAK_THRESHOLD
+    breaks = np.flatnonzero((np.diff(voiced) != 1) | jumps) + 1
+    starts = np.concatenate(([0], breaks))
+    lengths = np.diff(np.concatenate((starts, [len(values)])))
+    # position of each frame within its run
+    position = np.arange(len(values)) - np.repeat(starts, lengths)
+    frames = voiced[position % DECIMATION == 0]
+    offsets = np.concatenate(([0], np.cumsum(-(-lengths // DECIMATION))[:-1]))
+    return frames, offsets, voiced[starts]
+
+def melograph_data(pitch, confidence, duration):
+    # melograph.json's contents
+    time = np.linspace(0, duration, len(pitch))
+    frames, offsets, first_frames = melograph_runs(pitch, confidence)
+    kept = np.round(pitch[frames].astype(np.float64), 1)
+    data_chunks = [chunk.tolist() for chunk in np.split(kept, offsets[1:])]
+    return {
+        'data_chunks': data_chunks if len(frames) else [],
+        'time_chunk_starts': time[first_frames].tolist(),
+        'time_increment': duration / (len(pitch) - 1) * DECIMATION
+    }
+
+def write_melograph(pitch, confidence, duration, folder_path, sa=None):
+    # melograph.mel (melograph_store.py), in cents relative to the Sa, or to
+    # MIN_FREQUENCY without one, and for now the legacy melograph.json
+    from melograph_store import write_melograph_store
+    if not os.path.exists(folder_path):
+        os.mkdir(folder_path)
+    frames, offsets, first_frames = melograph_runs(pitch, confidence)
+    write_melograph_store(
+        os.path.join(folder_path, 'melograph.mel'), pitch[frames], offsets,
+        first_frames, duration / (len(pitch) - 1), DECIMATION,
+        MIN_FREQUENCY if sa is None else sa,
+        confidence=confidence[frames] if STORE_CONFIDENCE else None,
+        sa_reference=sa is not None)
+    if WRITE_JSON_MELOGRAPH:
+        data_json = json.dumps(melograph_data(pitch, confidence, duration))
+        with open(os.path.join(folder_path, 'melograph.json'), 'w') as f:
+            f.write(data_json)
+
+def make_melograph(audio, folder_path, sample_rate=SAMPLE_RATE,
+                   min_freq=MIN_FREQUENCY, max_freq=MAX_FREQUENCY,
+                   workers=None):
+    pitch, confidence = pitch_track(audio, min_freq, max_freq, workers)
+    write_melograph(pitch, confidence, len(audio) / sample_rate, folder_path)
@@ -0,0 +1,95 @@
+import argparse, json, time
+import numpy as np
+from melograph import HOP_SIZE, melograph_data
+
+# The melograph's post-processing against the per-frame loop it replaced, on
+# a synthetic pitch track:
+#
+#   python3 melograph_benchmark.py --minutes 120
+#
+# The track is a random walk in log frequency with octave leaps and stretches
+# of low confidence, at Melodia's hop. Both versions' json must be identical.
+
+SR = 44100
+
+def synth_track(minutes, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * SR / HOP_SIZE)
+    steps = rng.normal(0, 0.01, n)
+    leaps = rng.random(n) < 0.002
+    steps[leaps] += rng.choice([-1, 1], leaps.sum()) * np.log(2)
+    log_pitch = np.log(220) + np.cumsum(steps)
+    # keep it in range by folding back into 100-1000 Hz
+    span = np.log(1000) - np.log(100)
+    log_pitch = np.log(100) + np.abs((log_pitch - np.log(100)) % (2 * span)
+                                     - span)
+    pitch = np.exp(log_pitch).astype(np.float32)
+    # voiced and unvoiced stretches of a few hundred frames
+    voiced = np.repeat(rng.random(n // 200 + 1) < 0.7, 200)[:n]
+    confidence = (rng.random(n) * np.where(voiced, 1, 0.15)).astype(np.float32)
+    pitch[~voiced & (rng.random(n) < 0.5)] = 0
+    return pitch, confidence, n * HOP_SIZE / SR
+
+def legacy_data(pitch, confidence, duration):
+    # generate_melograph.py's version, as it was
+    time = np.linspace(0, duration, len(pitch))
+    masked_pitch = np.ma.masked_where(confidence < 0.1, pitch)
+    unmasked_indices = np.where(~masked_pitch.mask)[0]
+    break_indices = np.where(np.diff(unmasked_indices) != 1)[0] + 1
+    data_chunks = np.split(masked_pitch.data[unmasked_indices], break_indices)
+    time_chunks = np.split(time[unmasked_indices], break_indices)
+    data_chunks_list = [chunk.tolist() for chunk in data_chunks]
+    data_chunks_list = [[round(y, 1) for y in chunk.astype('float64')] for chunk in data_chunks]
+    time_chunks_list = [chunk.tolist() for chunk in time_chunks]
+    new_data_chunks_list = []
+    new_time_chunks_list = []
+    for i, chunk in enumerate(data_chunks_list):
+        sub_data_chunk = [chunk[0]]
+        sub_time_chunk = [time_chunks_list[i][0]]
+        for j in range(len(chunk))[1:]:
+            diff = np.abs(np.log(chunk[j] / chunk[j-1]))
+            if (diff > 0.2):
+                new_data_chunks_list.append(sub_data_chunk)
+                new_time_chunks_list.append(sub_time_chunk)
+                sub_data_chunk = [chunk[j]]
+                sub_time_chunk = [time_chunks_list[i][j]]
+            else:
+                sub_data_chunk.append(chunk[j])
+                sub_time_chunk.append(time_chunks_list[i][j])
+        new_data_chunks_list.append(sub_data_chunk)
+        new_time_chunks_list.append(sub_time_chunk)
+    data_chunks_list = new_data_chunks_list
+    time_chunks_list = new_time_chunks_list
+    time_chunk_starts = [chunk[0] for chunk in time_chunks_list]
+    factor = 4
+    data_chunks_list = [[item for i, item in enumerate(j) if i%factor == 0] for j in data_chunks_list]
+    time_chunks_list = [[item for i, item in enumerate(j) if i%factor == 0] for j in time_chunks_list]
+    time_increment = duration / (len(pitch) - 1)
+    time_increment *= factor
+    return {
+        'data_chunks': data_chunks_list,
+        'time_chunk_starts': time_chunk_starts,
+        'time_increment': time_increment
+    }
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pitch, confidence, duration = synth_track(args.minutes, args.seed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        old, old_seconds = timed(legacy_data, pitch, confidence, duration)
+    new, new_seconds = timed(melograph_data, pitch, confidence, duration)
+    same = json.dumps(old) == json.dumps(new)
+    print(f'{len(pitch)} frames, {len(new["data_chunks"])} chunks: loop '
+          f'{old_seconds:.2f}s, numpy {new_seconds:.2f}s '
+          f'({old_seconds / max(new_seconds, 1e-9):.0f}x); json '
+          f'{"identical" if same else "DIFFERENT"}')
+    raise SystemExit(0 if same else 1)
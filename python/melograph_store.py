@@ -0,0 +1,188 @@
+import bisect, os, struct
+import numpy as np
+
+# Binary melographs, so that a stretch of a long recording's pitch track can
+# be read without parsing all of melograph.json.
+#
+# Layout (little-endian):
+#   header  magic 'IMEL', version u8, flags u8 (bit 0: confidence stored,
+#           bit 1: the reference is the verified Sa), units per cent u16,
+#           frames per point u16, number of chunks u32, number of points
+#           u32, longest chunk in frames u32, reference frequency f64,
+#           seconds per frame of the pitch track f64
+#   index   one entry per chunk, in order of start: pitch track frame of its
+#           first point u32, offset of its first point u32
+#   cents   int16 per point, relative to the reference, in 1/units of a cent;
+#           NO_PITCH where the track had a zero pitch
+#   conf    uint8 per point, confidence * 255, if stored
+#
+# The chunks are melograph.py's runs and the points the ones melograph.json
+# keeps: point i of a chunk starting at frame f is frame f + i * frames per
+# point, at that many seconds per frame.
+
+MAGIC = b'IMEL'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHHIIIdd')
+INDEX = np.dtype([('frame', '<u4'), ('offset', '<u4')])
+HAS_CONFIDENCE = 0x1
+SA_REFERENCE = 0x2
+UNITS_PER_CENT = 4
+NO_PITCH = -32768
+
+def to_cents(pitch, reference, units=UNITS_PER_CENT):
+    # NO_PITCH where there is no pitch, the rest clipped to the int16 range
+    # above it
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cents = np.round(1200 * units * np.log2(
+            np.asarray(pitch, dtype=np.float64) / reference))
+    valid = np.isfinite(cents)
+    cents = np.clip(np.where(valid, cents, 0), NO_PITCH + 1, 32767)
+    return np.where(valid, cents, NO_PITCH).astype(np.int16)
+
+def write_melograph_store(path, points, offsets, frames, frame_seconds,
+                          frames_per_point, reference, confidence=None,
+                          sa_reference=True, units=UNITS_PER_CENT):
+    # `points` are every chunk's pitches (Hz) end to end, `offsets` the index
+    # of each chunk's first point and `frames` its pitch track frame
+    points = np.asarray(points)
+    lengths = np.diff(np.append(offsets, len(points)))
+    longest = int(lengths.max() - 1) * frames_per_point if len(lengths) else 0
+    flags = (HAS_CONFIDENCE if confidence is not None else 0) \
+        | (SA_REFERENCE if sa_reference else 0)
+    index = np.empty(len(offsets), dtype=INDEX)
+    index['frame'] = frames
+    index['offset'] = offsets
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, units, frames_per_point,
+                            len(index), len(points), longest, reference,
+                            frame_seconds))
+        f.write(index.tobytes())
+        f.write(to_cents(points, reference, units).tobytes())
+        if confidence is not None:
+            conf = np.clip(np.round(np.asarray(confidence) * 255), 0, 255)
+            f.write(conf.astype(np.uint8).tobytes())
+    os.replace(tmp_path, path)
+
+class MelographReader:
+    # Reads the header on open and maps the rest; a time range is found by
+    # bisecting the index and only its chunks' points are read. `data`, the
+    # bytes of a melograph file (as downloaded), is read in place instead.
+
+    def __init__(self, path=None, data=None):
+        self.path = path
+        if data is None:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER.size)
+        else:
+            header = bytes(data[:HEADER.size])
+        (magic, version, flags, units, frames_per_point, num_chunks,
+         num_points, longest, reference, frame_seconds) = \
+            HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f'{path or "data"} is not a melograph file')
+        if version != VERSION:
+            raise ValueError(f'Unsupported melograph version {version}')
+        self.has_confidence = bool(flags & HAS_CONFIDENCE)
+        self.sa_reference = bool(flags & SA_REFERENCE)
+        self.units = units
+        self.frames_per_point = frames_per_point
+        self.num_chunks = num_chunks
+        self.num_points = num_points
+        self.longest = longest
+        self.reference = reference
+        self.frame_seconds = frame_seconds
+        offset = HEADER.size
+        self.index = read_array(path, data, INDEX, offset, num_chunks)
+        offset += INDEX.itemsize * num_chunks
+        self.cents = read_array(path, data, np.int16, offset, num_points)
+        offset += 2 * num_points
+        self.confidence = None
+        if self.has_confidence:
+            self.confidence = read_array(path, data, np.uint8, offset,
+                                         num_points)
+
+    @property
+    def time_increment(self):
+        # seconds between a chunk's points, melograph.json's time_increment
+        return self.frame_seconds * self.frames_per_point
+
+    def start_time(self, i):
+        return int(self.index[i]['frame']) * self.frame_seconds
+
+    def points(self, i):
+        # [lo, hi) of chunk i's points
+        lo = int(self.index[i]['offset'])
+        if i + 1 < self.num_chunks:
+            return lo, int(self.index[i + 1]['offset'])
+        return lo, self.num_points
+
+    def chunk_end(self, i):
+        # time of chunk i's last point
+        lo, hi = self.points(i)
+        return self.start_time(i) + (hi - lo - 1) * self.time_increment
+
+    def chunk_range(self, start_time=0, end_time=None, overlapping=False):
+        # indices [first, last) of the chunks starting in [start_time,
+        # end_time], or with `overlapping`, of every chunk with a point in it
+        starts = _Starts(self.index, self.frame_seconds)
+        lo = start_time - self.longest * self.frame_seconds if overlapping \
+            else start_time
+        first = bisect.bisect_left(starts, lo)
+        last = self.num_chunks if end_time is None \
+            else bisect.bisect_right(starts, end_time)
+        if overlapping:
+            while first < last and self.chunk_end(first) < start_time:
+                first += 1
+        return first, last
+
+    def to_hz(self, cents):
+        hz = self.reference * 2 ** (cents / (1200 * self.units))
+        return np.where(cents == NO_PITCH, 0, hz)
+
+    def chunks(self, start_time=0, end_time=None, overlapping=False,
+               cents=False):
+        # (times, values, confidence or None) for each chunk, values in Hz or
+        # with `cents` in cents relative to the reference
+        first, last = self.chunk_range(start_time, end_time, overlapping)
+        out = []
+        for i in range(first, last):
+            lo, hi = self.points(i)
+            raw = np.asarray(self.cents[lo:hi])
+            times = self.start_time(i) \
+                + np.arange(hi - lo) * self.time_increment
+            if cents:
+                values = np.where(raw == NO_PITCH, np.nan, raw / self.units)
+            else:
+                values = self.to_hz(raw)
+            conf = None
+            if self.confidence is not None:
+                conf = np.asarray(self.confidence[lo:hi]) / 255
+            out.append((times, values, conf))
+        return out
+
+def map_array(path, dtype, offset, count):
+    # np.memmap can't map an empty array
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                     shape=(count,))
+
+def read_array(path, data, dtype, offset, count):
+    # mapped from `path`, or a view of `data` when there is no file
+    if data is None:
+        return map_array(path, dtype, offset, count)
+    return np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+
+class _Starts:
+    # the chunks' start times as a sequence for bisect, reading only the
+    # index entries it probes
+    def __init__(self, index, frame_seconds):
+        self.index = index
+        self.frame_seconds = frame_seconds
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return int(self.index[i]['frame']) * self.frame_seconds
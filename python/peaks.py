@@ -0,0 +1,153 @@
+import struct
+import numpy as np
+
+# Binary multi-resolution waveform peaks.
+#
+# Layout (little-endian):
+#   header  magic 'IPKS', version u8, bytes per value u8 (1 = int8,
+#           2 = int16), number of levels u16, sample rate u32,
+#           number of samples u64
+#   table   one entry per level: block size u32, number of blocks u64,
+#           byte offset of the level's data u64
+#   data    per level, (max, min) pairs of quantized amplitudes, one pair per
+#           block, the last block possibly partial
+#
+# Levels go from the finest block size upwards, each twice the previous one.
+
+MAGIC = b'IPKS'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIQ')
+LEVEL = struct.Struct('<IQQ')
+DTYPES = { 1: np.dtype('<i1'), 2: np.dtype('<i2') }
+
+def build_levels(data, block_size=2**11, num_levels=5):
+    # One pass over the audio computes the finest level; each coarser level is
+    # reduced from the one below it, which gives the same maxima and minima as
+    # reducing the audio again since block sizes double.
+    starts = np.arange(0, len(data), block_size)
+    top = np.maximum.reduceat(data, starts)
+    bottom = np.minimum.reduceat(data, starts)
+    return coarsen(top, bottom, block_size, num_levels)
+
+def coarsen(top, bottom, block_size, num_levels):
+    levels = [(block_size, top, bottom)]
+    for i in range(1, num_levels):
+        if len(top) % 2 == 1:
+            top = np.append(top, top[-1])
+            bottom = np.append(bottom, bottom[-1])
+        top = top.reshape(-1, 2).max(axis=1)
+        bottom = bottom.reshape(-1, 2).min(axis=1)
+        levels.append((block_size * 2 ** i, top, bottom))
+    return levels
+
+class PeaksBuilder:
+    # Streaming version of build_levels: feed it consecutive blocks of audio
+    # of any length and only the finest level (plus one partial block) is kept
+    # in memory.
+
+    def __init__(self, block_size=2**11, num_levels=5):
+        self.block_size = block_size
+        self.num_levels = num_levels
+        self.num_samples = 0
+        self.tops = []
+        self.bottoms = []
+        self.remainder = np.zeros(0, dtype=np.float32)
+
+    def add(self, data):
+        self.num_samples += len(data)
+        if len(self.remainder) > 0:
+            data = np.concatenate((self.remainder, data))
+        full = len(data) - len(data) % self.block_size
+        if full > 0:
+            blocks = data[:full].reshape(-1, self.block_size)
+            self.tops.append(blocks.max(axis=1))
+            self.bottoms.append(blocks.min(axis=1))
+        self.remainder = data[full:].copy()
+
+    def finish(self):
+        if len(self.remainder) > 0:
+            self.tops.append(self.remainder.max(keepdims=True))
+            self.bottoms.append(self.remainder.min(keepdims=True))
+            self.remainder = self.remainder[:0]
+        top = np.concatenate(self.tops) if self.tops else np.zeros(0)
+        bottom = np.concatenate(self.bottoms) if self.bottoms else np.zeros(0)
+        return coarsen(top, bottom, self.block_size, self.num_levels)
+
+def quantize(values, value_bytes):
+    scale = 2 ** (8 * value_bytes - 1) - 1
+    values = np.round(np.clip(values, -1, 1) * scale)
+    return values.astype(DTYPES[value_bytes])
+
+def write_peaks(path, levels, num_samples, sample_rate=44100, value_bytes=2):
+    offset = HEADER.size + LEVEL.size * len(levels)
+    table = []
+    for block_size, top, bottom in levels:
+        table.append(LEVEL.pack(block_size, len(top), offset))
+        offset += 2 * len(top) * value_bytes
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, value_bytes, len(levels),
+                            sample_rate, num_samples))
+        f.write(b''.join(table))
+        for _, top, bottom in levels:
+            pairs = np.empty((len(top), 2), dtype=DTYPES[value_bytes])
+            pairs[:, 0] = quantize(top, value_bytes)
+            pairs[:, 1] = quantize(bottom, value_bytes)
+            f.write(pairs.tobytes())
+
+def make_peaks(path, data, block_size=2**11, num_levels=5, sample_rate=44100,
+               value_bytes=2):
+    levels = build_levels(data, block_size, num_levels)
+    write_peaks(path, levels, len(data), sample_rate, value_bytes)
+
+class PeaksReader:
+    # Reads only the header on open; `read` seeks straight to the requested
+    # blocks of one level.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            magic, version, value_bytes, num_levels, sample_rate, num_samples = \
+                HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a peaks file')
+            if version != VERSION:
+                raise ValueError(f'Unsupported peaks version {version}')
+            table = f.read(LEVEL.size * num_levels)
+        self.dtype = DTYPES[value_bytes]
+        self.scale = 2 ** (8 * value_bytes - 1) - 1
+        self.sample_rate = sample_rate
+        self.num_samples = num_samples
+        self.levels = [LEVEL.unpack_from(table, i * LEVEL.size)
+                       for i in range(num_levels)]
+
+    @property
+    def block_sizes(self):
+        return [block_size for block_size, _, _ in self.levels]
+
+    @property
+    def duration(self):
+        return self.num_samples / self.sample_rate
+
+    def level_for(self, block_size):
+        return self.block_sizes.index(block_size)
+
+    def read(self, level=0, start_time=0, end_time=None, quantized=False):
+        # (max, min) pairs of `level` covering [start_time, end_time) seconds,
+        # as floats in [-1, 1] unless `quantized`.
+        block_size, num_blocks, offset = self.levels[level]
+        start = int(start_time * self.sample_rate) // block_size
+        if end_time is None:
+            end = num_blocks
+        else:
+            end = -(-int(np.ceil(end_time * self.sample_rate)) // block_size)
+        start = min(max(start, 0), num_blocks)
+        end = min(max(end, start), num_blocks)
+        pair_bytes = 2 * self.dtype.itemsize
+        with open(self.path, 'rb') as f:
+            f.seek(offset + start * pair_bytes)
+            pairs = np.fromfile(f, dtype=self.dtype, count=2 * (end - start))
+        pairs = pairs.reshape(-1, 2)
+        if quantized:
+            return pairs
+        return pairs.astype(np.float32) / self.scale
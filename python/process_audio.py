@@ -6,89 +6,303 @@ import numpy as np
 import sys, os, pymongo, math
 import soundfile as sf
 import json
+from concurrent.futures import ThreadPoolExecutor
+from tonic import estimate_tonic, estimate_tonic_file, TonicSampler
+from peaks import build_levels, write_peaks, PeaksBuilder
+from audio_stream import read_blocks, probe_duration, PipeEncoder, BLOCK_SECONDS
+from dedup_cache import (DedupIndex, file_hash, reuse_artifacts,
+                         spec_data_dir, melograph_dir)
+from media_info import probe
 
-def get_peaks(data, num_levels=4, block_size=64):
+MP3_ARGS = ['-vn', '-ar', '44100', '-ac', '2', '-b:a', '192k']
+OPUS_ARGS = ['-codec:a', 'libopus']
+PIPE_BLOCK = 2 ** 20
+TONIC_TIME_BUDGET = 60
+# the nested-list json peaks are still written for existing consumers;
+# `peaks/<id>.peaks` holds the same levels in the compact format (peaks.py)
+WRITE_JSON_PEAKS = True
+# recordings longer than this are streamed in blocks rather than decoded
+# into memory in full
+STREAM_MIN_SECONDS = 60 * 60
+
+def levels_to_json(levels):
     obj = {}
-    for i in range(num_levels):
-        top = []
-        bottom = []
-        size = block_size * 2 ** i
-        indices = np.repeat(size, len(data) // size)
-        if len(data) % size != 0:
-            indices = np.append(indices, len(data) % size)
-        cur_top = np.maximum.reduceat(data, np.append([0], np.cumsum(indices[:-1])))/size
-        top.append(cur_top)
-        cur_bottom = np.minimum.reduceat(data, np.append([0], np.cumsum(indices[:-1])))/size
-        bottom.append(cur_bottom)
-        peaks = np.dstack((top, bottom))
-        obj[size] = peaks[0].tolist()
+    for size, top, bottom in levels:
+        obj[size] = np.stack((top / size, bottom / size), axis=1).tolist()
     return obj
 
-username = os.environ.get('USER_NAME')
-password = os.environ.get('PASSWORD')
-query = "mongodb+srv://" + username + ":" + password + "@swara.f5cuf.mongodb.net/?retryWrites=true&w=majority"
-client = pymongo.MongoClient(query, server_api=ServerApi('1'))
-db = client.swara
-audio_events = db.audioEvents
-audio_recordings = db.audioRecordings
-
-
-path = sys.argv[1]
-objectId = sys.argv[2]
-recording_idx = sys.argv[3]
-recording_id = sys.argv[4]
-
-file_path = 'uploads/'
-
-split_f = path.split('.')
-suffix = split_f[-1]
-file_name = '.'.join(split_f[:-1])
-
-loader = ess.EasyLoader(filename = file_path + path)
-audio = loader()
-duration = ess.Duration()(audio)
-
-# this could be sped up by just sampling chunks rather than whole file ...
-tonic_guess = ess.TonicIndianArtMusic(maxTonicFrequency=200)(audio)
-
-dur = duration
-if objectId != 'undefined':
-    query = { '_id': ObjectId(objectId) }
-    dur_path = 'recordings.' + str(recording_idx) + '.duration'
-    sa_path = 'recordings.' + str(recording_idx) + '.saEstimate'
-    verified_path = 'recordings.' + str(recording_idx) + '.saVerified'
-    update = { '$set': { dur_path: dur, sa_path: tonic_guess, verified_path: False } }
-    audio_events.update_one(query, update, upsert=True)
-
-if recording_id:
-    query = { '_id': ObjectId(recording_id) }
-    dur_path = 'duration'
-    sa_path = 'saEstimate'
-    verified_path = 'saVerified'
-    update = { '$set': { dur_path: dur, sa_path: tonic_guess, verified_path: False } }
-    audio_recordings.update_one(query, update, upsert=True)
-
-wav_path = 'audio/wav/' + file_name + '.wav'
-mp3_path = 'audio/mp3/' + file_name + '.mp3'
-opus_path = 'audio/opus/' + file_name + '.opus'
-sr = 44100
-
-if suffix == 'mp3':
-    sf.write(wav_path, audio, sr)
-    os.system(f'ffmpeg -i {file_path + path} -codec:a libopus {opus_path}')
-    os.rename(file_path + path, mp3_path)
-elif suffix == 'wav':
-    
-    os.system(f'ffmpeg -i {file_path + path} -vn -ar 44100 -ac 2 -b:a 192k {mp3_path}')
-    os.system(f'ffmpeg -i {file_path + path} -codec:a libopus {opus_path}')
-    os.rename(file_path + path, wav_path)
-else:
-    sf.write(wav_path, audio, sr)
-    os.system(f'ffmpeg -i {file_path + path} -vn -ar 44100 -ac 2 -b:a 192k {mp3_path}')
-    os.system(f'ffmpeg -i {file_path + path} -codec:a libopus {opus_path}')
-    os.remove(file_path + path)
-
-
-peaks = get_peaks(audio, block_size=2**11, num_levels=5)
-with open('peaks/' + file_name + '.json', 'w') as outfile:
-    json.dump(peaks, outfile)
+def get_peaks(data, num_levels=4, block_size=64):
+    return levels_to_json(build_levels(data, block_size, num_levels))
+
+def save_peaks(file_name, levels, num_samples, sr):
+    write_peaks('peaks/' + file_name + '.peaks', levels, num_samples, sr)
+    if WRITE_JSON_PEAKS:
+        with open('peaks/' + file_name + '.json', 'w') as outfile:
+            json.dump(levels_to_json(levels), outfile)
+
+def decode(path, sr=44100):
+    # Decode the upload a single time. `stereo` keeps the source channels and
+    # rate for the encoders; `mono` is what EasyLoader would have returned
+    # (MonoLoader's mix + resample, unit gain) and feeds all of the analysis.
+    stereo, src_sr, channels, _, _, _ = ess.AudioLoader(filename=path)()
+    mono = ess.MonoMixer()(stereo, channels)
+    if src_sr != sr:
+        mono = ess.Resample(inputSampleRate=src_sr, outputSampleRate=sr)(mono)
+    if channels == 1:
+        stereo = stereo[:, 0]
+    return stereo, int(src_sr), mono
+
+def encode(pcm, sr, out_path, codec_args):
+    # pipe raw float PCM into ffmpeg rather than having it decode the source
+    channels = 1 if pcm.ndim == 1 else pcm.shape[1]
+    encoder = PipeEncoder(out_path, codec_args, sr, channels)
+    try:
+        for i in range(0, len(pcm), PIPE_BLOCK):
+            encoder.write(pcm[i:i + PIPE_BLOCK])
+    except Exception:
+        encoder.abort()
+        raise
+    encoder.close()
+
+def encode_all(pcm, sr, targets):
+    # run every encoder at once, each fed from the same buffer
+    with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+        futures = [executor.submit(encode, pcm, sr, out_path, args)
+                   for out_path, args in targets]
+        for future in futures:
+            future.result()
+
+def get_targets(file_name, suffix):
+    # Which derived files have to be made for an upload, and what becomes of
+    # the original: mp3 and wav uploads are kept as the mp3/wav masters.
+    wav_path = 'audio/wav/' + file_name + '.wav'
+    mp3_path = 'audio/mp3/' + file_name + '.mp3'
+    opus_path = 'audio/opus/' + file_name + '.opus'
+    if suffix == 'mp3':
+        return wav_path, [(opus_path, OPUS_ARGS)], mp3_path
+    elif suffix == 'wav':
+        return None, [(mp3_path, MP3_ARGS), (opus_path, OPUS_ARGS)], wav_path
+    else:
+        return wav_path, [(mp3_path, MP3_ARGS), (opus_path, OPUS_ARGS)], None
+
+def finish_source(source, keep_path):
+    if keep_path is None:
+        os.remove(source)
+    else:
+        os.rename(source, keep_path)
+
+def make_visuals(audio, file_name, wav_path=None):
+    # Spectrogram and melograph, from the already decoded buffer when there
+    # is one and otherwise from the wav master. The wide-range CQT and pitch
+    # track they are made from are kept (analysis_cache.py), so the log
+    # spectrograms and the melograph for the verified Sa are only crops.
+    import analysis_cache
+    from melograph import REPLAY_GAIN_SCALE
+    if wav_path is None:
+        wav_path = analysis_cache.wav_path(file_name)
+    if audio is None:
+        audio = ess.EasyLoader(filename=wav_path)()
+    # same output locations the two scripts use when run on their own
+    spec_dir = spec_data_dir(file_name)
+    os.makedirs(spec_dir, exist_ok=True)
+    analysis_cache.spectrograms(file_name, spec_dir=spec_dir,
+                                full_path=wav_path, audio=audio)
+    analysis_cache.melograph(file_name, None, melograph_dir(file_name),
+                             full_path=wav_path,
+                             audio=audio * REPLAY_GAIN_SCALE)
+
+def ingest(source, file_name, suffix, sr=44100, tonic_executor=None,
+           visuals=False, ready=None):
+    stereo, src_sr, audio = decode(source, sr)
+    duration = len(audio) / sr
+    tonic_guess = estimate_tonic(audio, sr, time_budget=TONIC_TIME_BUDGET,
+                                 executor=tonic_executor)['frequency']
+
+    wav_path, targets, keep_path = get_targets(file_name, suffix)
+    if wav_path is not None:
+        sf.write(wav_path, audio, sr)
+    encode_all(stereo, src_sr, targets)
+    finish_source(source, keep_path)
+    del stereo
+
+    levels = build_levels(audio, block_size=2**11, num_levels=5)
+    save_peaks(file_name, levels, len(audio), sr)
+    result = { 'duration': duration, 'saEstimate': tonic_guess }
+    if ready is not None:
+        ready(result)
+    if visuals:
+        make_visuals(audio, file_name)
+    return result
+
+def ingest_stream(source, file_name, suffix, sr=44100, tonic_executor=None,
+                  peaks=True, tonic=True, visuals=False, ready=None):
+    # Same outputs as `ingest`, but the upload is decoded in BLOCK_SECONDS
+    # blocks that are handed to the wav writer, encoders, peaks and tonic
+    # sampler in turn, so memory use doesn't grow with the recording's length.
+    # Decoding goes through ffmpeg at 44.1k stereo; the analysis signal is the
+    # channel mean, as MonoMixer computes it.
+    wav_path, targets, keep_path = get_targets(file_name, suffix)
+    sampler = None
+    try:
+        encoders = []
+        wav_file = None
+        try:
+            encoders = [PipeEncoder(out_path, args, sr, 2)
+                        for out_path, args in targets]
+            if wav_path is not None:
+                wav_file = sf.SoundFile(wav_path, 'w', sr, 1)
+            peaks_builder = PeaksBuilder(2**11, 5) if peaks else None
+            if tonic:
+                expected = int(probe_duration(source) * sr)
+                sampler = TonicSampler(expected, sr, executor=tonic_executor)
+            offset = 0
+            for block in read_blocks(source, sr, 2, BLOCK_SECONDS * sr):
+                for encoder in encoders:
+                    encoder.write(block)
+                mono = block.mean(axis=1)
+                if wav_file is not None:
+                    wav_file.write(mono)
+                if peaks_builder is not None:
+                    peaks_builder.add(mono)
+                if sampler is not None:
+                    sampler.add(mono, offset)
+                offset += len(mono)
+        except Exception:
+            for encoder in encoders:
+                encoder.abort()
+            raise
+        finally:
+            if wav_file is not None:
+                wav_file.close()
+        for encoder in encoders:
+            encoder.close()
+        finish_source(source, keep_path)
+
+        result = { 'duration': offset / sr, 'saEstimate': None }
+        if sampler is not None:
+            estimate = sampler.result(TONIC_TIME_BUDGET)
+            result['saEstimate'] = estimate['frequency']
+    finally:
+        # the sampler's pool, if it has its own, whether or not ingest failed
+        if sampler is not None:
+            sampler.close()
+    if peaks_builder is not None:
+        save_peaks(file_name, peaks_builder.finish(), offset, sr)
+    if ready is not None:
+        ready(result)
+    if visuals:
+        make_visuals(None, file_name, wav_path or keep_path)
+    return result
+
+def reuse_cached(cached, source, file_name, sr=44100, tonic_executor=None,
+                 visuals=False, ready=None):
+    # An identical upload was processed before: copy its files to the new id.
+    # Entries without a duration or tonic have those read back from the
+    # cached wav. The melograph depends on the Sa, so it isn't copied; with
+    # `visuals` it is cropped again from the copied pitch track.
+    reuse_artifacts(cached['rec_id'], file_name)
+    os.remove(source)
+    duration = cached['duration']
+    tonic_guess = cached['saEstimate']
+    wav_path = 'audio/wav/' + file_name + '.wav'
+    if duration is None:
+        duration = probe(wav_path)['duration']
+    if tonic_guess is None:
+        tonic_guess = estimate_tonic_file(
+            wav_path, duration, time_budget=TONIC_TIME_BUDGET,
+            executor=tonic_executor)['frequency']
+    result = { 'duration': duration, 'saEstimate': tonic_guess,
+               'reusedFrom': cached['rec_id'] }
+    if ready is not None:
+        ready(result)
+    if visuals:
+        import analysis_cache
+        analysis_cache.melograph(file_name, None, melograph_dir(file_name),
+                                 full_path=wav_path)
+    return result
+
+def update_recording(db, objectId, recording_idx, recording_id, dur, tonic_guess):
+    audio_events = db.audioEvents
+    audio_recordings = db.audioRecordings
+    if objectId != 'undefined':
+        query = { '_id': ObjectId(objectId) }
+        dur_path = 'recordings.' + str(recording_idx) + '.duration'
+        sa_path = 'recordings.' + str(recording_idx) + '.saEstimate'
+        verified_path = 'recordings.' + str(recording_idx) + '.saVerified'
+        update = { '$set': { dur_path: dur, sa_path: tonic_guess, verified_path: False } }
+        audio_events.update_one(query, update, upsert=True)
+
+    if recording_id:
+        query = { '_id': ObjectId(recording_id) }
+        dur_path = 'duration'
+        sa_path = 'saEstimate'
+        verified_path = 'saVerified'
+        update = { '$set': { dur_path: dur, sa_path: tonic_guess, verified_path: False } }
+        audio_recordings.update_one(query, update, upsert=True)
+
+def get_mongo_client():
+    username = os.environ.get('USER_NAME')
+    password = os.environ.get('PASSWORD')
+    query = "mongodb+srv://" + username + ":" + password + "@swara.f5cuf.mongodb.net/?retryWrites=true&w=majority"
+    return pymongo.MongoClient(query, server_api=ServerApi('1'))
+
+def process_audio(path, objectId, recording_idx, recording_id, db,
+                  tonic_executor=None, file_path='uploads/', visuals=False,
+                  stream=None, dedup=True, ready=None):
+    # `db` and `tonic_executor` are passed in so that a long-running caller
+    # (see ingest_worker.py) can keep them warm across uploads. `stream`
+    # forces (True) or rules out (False) block-wise ingest; by default it is
+    # used for recordings longer than STREAM_MIN_SECONDS. The recording is
+    # updated, and `ready` called with the result, before any visuals are
+    # made, so that the upload can be answered without waiting for them.
+    split_f = path.split('.')
+    suffix = split_f[-1]
+    file_name = '.'.join(split_f[:-1])
+    source = file_path + path
+
+    index = DedupIndex() if dedup else None
+    content_hash = file_hash(source) if dedup else None
+    cached = index.lookup(content_hash, exclude=file_name) if dedup else None
+
+    def record(result):
+        if dedup:
+            index.add(content_hash, file_name, result['duration'],
+                      result['saEstimate'])
+        update_recording(db, objectId, recording_idx, recording_id,
+                         result['duration'], result['saEstimate'])
+        if ready is not None:
+            ready(result)
+
+    try:
+        if cached is not None:
+            return reuse_cached(cached, source, file_name,
+                                tonic_executor=tonic_executor,
+                                visuals=visuals, ready=record)
+        if stream is None:
+            stream = probe_duration(source) > STREAM_MIN_SECONDS
+        if stream:
+            return ingest_stream(source, file_name, suffix,
+                                 tonic_executor=tonic_executor,
+                                 visuals=visuals, ready=record)
+        return ingest(source, file_name, suffix,
+                      tonic_executor=tonic_executor, visuals=visuals,
+                      ready=record)
+    finally:
+        if dedup:
+            index.close()
+
+if __name__ == '__main__':
+    path = sys.argv[1]
+    objectId = sys.argv[2]
+    recording_idx = sys.argv[3]
+    recording_id = sys.argv[4]
+    visuals = '--visuals' in sys.argv[5:]
+    stream = None
+    if '--stream' in sys.argv[5:]:
+        stream = True
+    elif '--no-stream' in sys.argv[5:]:
+        stream = False
+    dedup = '--no-dedup' not in sys.argv[5:]
+    client = get_mongo_client()
+    process_audio(path, objectId, recording_idx, recording_id, client.swara,
+                  visuals=visuals, stream=stream, dedup=dedup)
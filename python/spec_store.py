@@ -0,0 +1,174 @@
+import math, os, shutil, struct, tempfile, zlib
+import numpy as np
+
+# Tiled uint8 spectrograms, so that a window of a long recording can be read
+# without inflating the rest of it.
+#
+# Layout (little-endian):
+#   header  magic 'ISPC', version u8, flags u8 (bit 0: row 0 is the highest
+#           frequency bin), bins per octave u16, number of bins u32, sample
+#           rate u32, hop in samples u32, number of columns u64, tile width
+#           in columns u32, lowest bin frequency f64
+#   index   one entry per tile: byte offset u64, compressed length u32
+#   tiles   zlib-compressed (bins, tile width) uint8 arrays in row-major
+#           order, the last one possibly narrower
+#
+# Column n is centred on sample n * hop, as in cqt.py.
+
+MAGIC = b'ISPC'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIIIQId')
+TILE = struct.Struct('<QI')
+TILE_WIDTH = 1024
+FLIPPED = 0x1
+COMPRESS_LEVEL = 6
+
+class SpecWriter:
+    # Takes (bins, n) uint8 column blocks of any width in order; complete tiles
+    # are compressed as they fill up and spooled to a temp file, which is
+    # copied in behind the header and index on `close`.
+
+    def __init__(self, path, num_bins, sample_rate, hop, min_frequency,
+                 bins_per_octave, flipped=True, tile_width=TILE_WIDTH):
+        self.path = path
+        self.num_bins = num_bins
+        self.sample_rate = sample_rate
+        self.hop = hop
+        self.min_frequency = min_frequency
+        self.bins_per_octave = bins_per_octave
+        self.flags = FLIPPED if flipped else 0
+        self.tile_width = tile_width
+        self.num_columns = 0
+        self.lengths = []
+        self.pending = np.zeros((num_bins, 0), dtype=np.uint8)
+        self.spool = tempfile.TemporaryFile(
+            dir=os.path.dirname(os.path.abspath(path)))
+
+    def write_tile(self, tile):
+        data = zlib.compress(np.ascontiguousarray(tile).tobytes(),
+                             COMPRESS_LEVEL)
+        self.spool.write(data)
+        self.lengths.append(len(data))
+
+    def add(self, columns):
+        if columns.shape[0] != self.num_bins or columns.dtype != np.uint8:
+            raise ValueError('Expected uint8 columns with '
+                             f'{self.num_bins} bins')
+        self.num_columns += columns.shape[1]
+        if self.pending.shape[1]:
+            columns = np.hstack((self.pending, columns))
+        full = columns.shape[1] - columns.shape[1] % self.tile_width
+        for start in range(0, full, self.tile_width):
+            self.write_tile(columns[:, start:start + self.tile_width])
+        self.pending = columns[:, full:].copy()
+
+    def close(self):
+        if self.pending.shape[1]:
+            self.write_tile(self.pending)
+            self.pending = self.pending[:, :0]
+        offset = HEADER.size + TILE.size * len(self.lengths)
+        index = []
+        for length in self.lengths:
+            index.append(TILE.pack(offset, length))
+            offset += length
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.flags,
+                                self.bins_per_octave, self.num_bins,
+                                self.sample_rate, self.hop, self.num_columns,
+                                self.tile_width, self.min_frequency))
+            f.write(b''.join(index))
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, f)
+        self.spool.close()
+        os.replace(tmp_path, self.path)
+
+def write_spec(path, arr, sample_rate, hop, min_frequency, bins_per_octave,
+               flipped=True, tile_width=TILE_WIDTH):
+    writer = SpecWriter(path, arr.shape[0], sample_rate, hop, min_frequency,
+                        bins_per_octave, flipped, tile_width)
+    writer.add(arr)
+    writer.close()
+
+class SpecReader:
+    # Reads the header and tile index on open; `read` inflates only the tiles
+    # that overlap the requested columns.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            (magic, version, flags, bins_per_octave, num_bins, sample_rate,
+             hop, num_columns, tile_width, min_frequency) = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a spectrogram file')
+            if version != VERSION:
+                raise ValueError(f'Unsupported spectrogram version {version}')
+            num_tiles = -(-num_columns // tile_width)
+            index = f.read(TILE.size * num_tiles)
+        self.flipped = bool(flags & FLIPPED)
+        self.bins_per_octave = bins_per_octave
+        self.num_bins = num_bins
+        self.sample_rate = sample_rate
+        self.hop = hop
+        self.num_columns = num_columns
+        self.tile_width = tile_width
+        self.min_frequency = min_frequency
+        self.tiles = [TILE.unpack_from(index, i * TILE.size)
+                      for i in range(num_tiles)]
+
+    @property
+    def shape(self):
+        return (self.num_bins, self.num_columns)
+
+    @property
+    def duration(self):
+        return self.num_columns * self.hop / self.sample_rate
+
+    def tile(self, f, i):
+        offset, length = self.tiles[i]
+        f.seek(offset)
+        data = zlib.decompress(f.read(length))
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.num_bins, -1)
+
+    def read(self, start=0, end=None, low_row=0, high_row=None):
+        # rows [low_row, high_row) of columns [start, end), in stored order
+        end = self.num_columns if end is None else end
+        start = min(max(start, 0), self.num_columns)
+        end = min(max(end, start), self.num_columns)
+        high_row = self.num_bins if high_row is None else high_row
+        out = np.empty((max(high_row - low_row, 0), end - start), dtype=np.uint8)
+        if end == start:
+            return out
+        first = start // self.tile_width
+        last = (end - 1) // self.tile_width
+        with open(self.path, 'rb') as f:
+            for i in range(first, last + 1):
+                tile_start = i * self.tile_width
+                tile = self.tile(f, i)
+                lo = max(start, tile_start)
+                hi = min(end, tile_start + tile.shape[1])
+                out[:, lo - start:hi - start] = \
+                    tile[low_row:high_row, lo - tile_start:hi - tile_start]
+        return out
+
+    def column_for(self, time):
+        return int(round(time * self.sample_rate / self.hop))
+
+    def bin_for(self, frequency):
+        k = int(round(self.bins_per_octave
+                      * math.log2(frequency / self.min_frequency)))
+        return min(max(k, 0), self.num_bins - 1)
+
+    def read_window(self, start_time=0, end_time=None, min_frequency=None,
+                    max_frequency=None):
+        # the columns covering [start_time, end_time) seconds, limited to the
+        # bins between the two frequencies when they are given
+        start = self.column_for(start_time)
+        end = None if end_time is None else self.column_for(end_time)
+        low = 0 if min_frequency is None else self.bin_for(min_frequency)
+        high = self.num_bins - 1 if max_frequency is None \
+            else self.bin_for(max_frequency)
+        if self.flipped:
+            low, high = self.num_bins - 1 - high, self.num_bins - 1 - low
+        return self.read(start, end, low, high + 1)
@@ -0,0 +1,74 @@
+import math, os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+# WebP zoom pyramid of a uint8 spectrogram. Each tile is coloured through a
+# 256-entry lookup table with numpy indexing and handed to the WebP encoder as
+# an RGB array, giving the pixels plt.imsave produced (each tile stretched
+# over its own value range, then mapped through the colormap) without the
+# round trip through a PNG. Tiles are encoded across a process pool.
+
+MAX_TILE_WIDTH = 16383
+NUM_LEVELS = 5
+WEBP_QUALITY = 95
+
+def colormap_lut(name):
+    # (256, 3) uint8 colours, as matplotlib converts them to bytes
+    from matplotlib import colormaps
+    return colormaps[name](np.arange(256), bytes=True)[:, :3]
+
+def halve(arr):
+    # averages neighbouring columns, repeating the last one if the width is odd
+    if arr.shape[-1] % 2 == 1:
+        arr = np.concatenate((arr, arr[:, -1:]), axis=1)
+    return arr.reshape((arr.shape[0], arr.shape[1] // 2, -1)) \
+        .mean(axis=2).astype(np.uint8)
+
+def pyramid(arr, num_levels=NUM_LEVELS):
+    levels = [arr]
+    for _ in range(num_levels - 1):
+        levels.append(halve(levels[-1]))
+    return levels
+
+def render(tile, lut):
+    # RGB image of `tile`, highest bin at the top
+    lo, hi = tile.min(), tile.max()
+    if hi > lo:
+        norm = (tile.astype(np.float32) - lo) / np.float32(hi - lo)
+        idx = np.minimum((norm * 256).astype(np.intp), 255)
+    else:
+        idx = np.zeros(tile.shape, dtype=np.intp)
+    return lut[np.flip(idx, axis=0)]
+
+def save_tile(tile, lut, path):
+    Image.fromarray(render(tile, lut), 'RGB').save(
+        path, format='webp', quality=WEBP_QUALITY)
+
+def write_pyramid(levels, folder_path, cmap='magma', workers=None,
+                  max_tile_width=MAX_TILE_WIDTH):
+    # levels[i] goes to `<folder_path>/<i>/<j>.webp`, j counting tiles of
+    # `max_tile_width` columns; stale tiles from an earlier run are removed
+    lut = colormap_lut(cmap)
+    os.makedirs(folder_path, exist_ok=True)
+    jobs = []
+    for i, arr in enumerate(levels):
+        subfolder_path = os.path.join(folder_path, str(i))
+        if os.path.exists(subfolder_path):
+            for the_file in os.listdir(subfolder_path):
+                os.remove(os.path.join(subfolder_path, the_file))
+        else:
+            os.mkdir(subfolder_path)
+        for j in range(math.ceil(arr.shape[1] / max_tile_width)):
+            tile = arr[:, j * max_tile_width:(j + 1) * max_tile_width]
+            jobs.append((tile, os.path.join(subfolder_path, f'{j}.webp')))
+    if workers == 1:
+        # already inside a pool (see make_all.py)
+        for tile, path in jobs:
+            save_tile(tile, lut, path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(save_tile, tile, lut, path)
+                   for tile, path in jobs]
+        for future in futures:
+            future.result()
@@ -0,0 +1,183 @@
+import gzip, json, math, os, tempfile
+import numpy as np
+from cqt import get_plan, LogQuantizer, cqt_blocks, cqt_file, log_magnitude
+from spec_store import SpecWriter
+
+# One constant-Q pass per recording for both spectrogram products: the uint8
+# spec data (75-2400 Hz, all recordings) and the WebP pyramid of the log
+# spectrogram (three octaves up from just below the Sa). The Sa crop is a
+# range of rows of the same transform, both sharing the 72 bins per octave
+# grid anchored at 75 Hz, so the crop's edges land on the nearest bin of that
+# grid and it shares the spec data's hop. Each product is quantized over its
+# own rows' range, as when they were computed separately, with zero
+# magnitudes given the smallest nonzero one of their SEGMENT_SECONDS, as the
+# NSGConstantQ passes those were computed in had. The float16 logs of
+# every row can also be kept (see analysis_cache.py), so that a later Sa's
+# crop doesn't need another transform.
+
+SAMPLE_RATE = 44100
+MIN_FREQUENCY = 75
+MAX_FREQUENCY = 2400
+BINS_PER_OCTAVE = 72
+GAMMA = 20
+SPEC_LEVELS = 256
+LOG_LEVELS = 64
+LOG_OCTAVES = 3
+LOG_OFFSET = 0.1
+MAX_TILE_WIDTH = 16383
+# length of the passes the NSGConstantQ spectrograms were computed in, over
+# which zero magnitudes were replaced
+SEGMENT_SECONDS = 600
+
+# the single gzip blob is still written for the current spectrogram worker;
+# `spec_data.spc` holds the same array in independently readable time tiles
+# (spec_store.py)
+WRITE_GZIP_SPEC_DATA = True
+GZIP_ROWS = 16
+# where the quantizers spill their logs when there is no spec_dir; None is
+# tempfile's default directory, never the audio store
+SPILL_DIR = os.environ.get('SPECTROGRAM_SPILL_DIR')
+
+def spec_plan(sample_rate=SAMPLE_RATE):
+    return get_plan(sample_rate, MIN_FREQUENCY, MAX_FREQUENCY, BINS_PER_OCTAVE,
+                    GAMMA, 1)
+
+def log_range(sa):
+    # frequency range of the log spectrograms for a given Sa
+    return (2 ** (math.log2(sa) - LOG_OFFSET),
+            2 ** (math.log2((2 ** LOG_OCTAVES) * sa) + LOG_OFFSET))
+
+def grid_bin(frequency):
+    # nearest bin of the 75 Hz grid, negative below it
+    return int(round(BINS_PER_OCTAVE * math.log2(frequency / MIN_FREQUENCY)))
+
+def wide_plan(sa=None, sample_rate=SAMPLE_RATE, cover=None):
+    # The plan covering the spec data's range, the log spectrogram crop of
+    # `sa` if one is given and the (low, high) frequencies of `cover`, with
+    # the row of 75 Hz. Most Sas fall well inside 75-2400 Hz and get the spec
+    # data plan itself; for the rest the grid is extended, keeping the spec
+    # data's hop and frame size so its rows are unchanged.
+    base = spec_plan(sample_rate)
+    ranges = [] if sa is None else [log_range(sa)]
+    if cover is not None:
+        ranges.append(cover)
+    first = min([0] + [grid_bin(lo) for lo, _ in ranges])
+    last = max([base.num_bins - 1] + [grid_bin(hi) for _, hi in ranges])
+    if first == 0 and last == base.num_bins - 1:
+        return base, 0
+    plan = get_plan(sample_rate,
+                    MIN_FREQUENCY * 2 ** (first / BINS_PER_OCTAVE),
+                    MIN_FREQUENCY * 2 ** ((last + 0.5) / BINS_PER_OCTAVE),
+                    BINS_PER_OCTAVE, GAMMA, 1, base.hop, base.frame_size)
+    return plan, -first
+
+def segment_columns(hop, sample_rate=SAMPLE_RATE):
+    # columns centred in each SEGMENT_SECONDS of audio
+    return math.ceil(SEGMENT_SECONDS * sample_rate / hop)
+
+def log_rows(sa, offset):
+    # rows of a wide plan (with 75 Hz at row `offset`) in the Sa crop
+    lo, hi = log_range(sa)
+    return slice(grid_bin(lo) + offset, grid_bin(hi) + offset + 1)
+
+def write_spec_data(quantizer, output_dir, sample_rate, hop, min_frequency):
+    # second pass of the spec data's quantizer, into spec_data.spc and (for
+    # now) the legacy spec_data.gz with its spec_shape.json
+    shape = (quantizer.num_bins, quantizer.num_columns)
+    writer = SpecWriter(output_dir + '/spec_data.spc', shape[0], sample_rate,
+                        hop, min_frequency, BINS_PER_OCTAVE, flipped=True)
+    legacy = None
+    if WRITE_GZIP_SPEC_DATA:
+        # the blob is row-major over the whole recording, so the columns are
+        # gathered in a disk-backed array first
+        legacy = np.memmap(tempfile.TemporaryFile(dir=output_dir),
+                           dtype=np.uint8, mode='w+', shape=shape)
+    col = 0
+    for arr in quantizer.chunks():
+        # flip vertically
+        arr = np.flipud(arr)
+        writer.add(arr)
+        if legacy is not None:
+            legacy[:, col:col + arr.shape[1]] = arr
+        col += arr.shape[1]
+    writer.close()
+    if legacy is not None:
+        with gzip.open(output_dir + '/spec_data.gz', 'wb') as f:
+            for row in range(0, shape[0], GZIP_ROWS):
+                f.write(legacy[row:row + GZIP_ROWS].tobytes())
+
+        with open(output_dir + '/spec_shape.json', 'w') as f:
+            json.dump({'shape': shape}, f)
+
+def write_log_spectrograms(arr, folder_path, cmap='magma', workers=None):
+    from spec_tiles import pyramid, write_pyramid
+    write_pyramid(pyramid(arr), folder_path, cmap=cmap, workers=workers,
+                  max_tile_width=MAX_TILE_WIDTH)
+
+def make_spectrograms(file_path=None, audio=None, sample_rate=SAMPLE_RATE,
+                      spec_dir=None, sa=None, tiles_dir=None, cmap='magma',
+                      workers=None, cover=None, cache_path=None):
+    # Writes the spec data to `spec_dir` and/or the log spectrogram pyramid
+    # for `sa` to `tiles_dir`, from one CQT of `audio` (already decoded) or of
+    # the file at `file_path` (streamed in blocks). The log magnitudes are
+    # spilled to disk until each product's range is known. With `cache_path`,
+    # the logs of all rows (widened to `cover`) are written there as float16,
+    # columns x bins; returns a description of the transform.
+    if tiles_dir is not None and sa is None:
+        raise ValueError('The log spectrograms need an Sa')
+    plan, offset = wide_plan(sa if tiles_dir is not None else None,
+                             sample_rate, cover)
+    if audio is None:
+        # check if there is even a file at the file_path, and if not, print something
+        # and return
+        if not os.path.exists(file_path):
+            print("File not found: " + file_path)
+            return
+        chunks = cqt_file(file_path, plan)
+    else:
+        chunks = cqt_blocks([audio], plan)
+    spill_dir = spec_dir or SPILL_DIR
+    segment = segment_columns(plan.hop, sample_rate)
+    spec = log = cache = None
+    if spec_dir is not None:
+        spec_rows = slice(offset, offset + spec_plan(sample_rate).num_bins)
+        spec = LogQuantizer(SPEC_LEVELS, spill_dir, segment)
+    if tiles_dir is not None:
+        crop = log_rows(sa, offset)
+        log = LogQuantizer(LOG_LEVELS, spill_dir, segment)
+    if cache_path is not None:
+        cache_tmp = f'{cache_path}.{os.getpid()}.tmp'
+        cache = open(cache_tmp, 'wb')
+    num_columns = 0
+    try:
+        for mags in chunks:
+            logs = log_magnitude(mags)
+            num_columns += logs.shape[1]
+            if spec is not None:
+                spec.add_logs(logs[spec_rows])
+            if log is not None:
+                log.add_logs(logs[crop])
+            if cache is not None:
+                cache.write(logs.T.astype(np.float16).tobytes())
+    except BaseException:
+        if cache is not None:
+            cache.close()
+            os.remove(cache_tmp)
+        raise
+    if cache is not None:
+        cache.close()
+        os.replace(cache_tmp, cache_path)
+    if spec is not None:
+        write_spec_data(spec, spec_dir, sample_rate, plan.hop,
+                        plan.freqs[offset])
+    if log is not None:
+        write_log_spectrograms(np.hstack(list(log.chunks())), tiles_dir, cmap,
+                               workers)
+    return {
+        'shape': [num_columns, plan.num_bins],
+        'offset': offset,
+        'hop': plan.hop,
+        'sample_rate': sample_rate,
+        'min_frequency': float(plan.freqs[0]),
+        'bins_per_octave': BINS_PER_OCTAVE
+    }
@@ -0,0 +1,81 @@
+import argparse, os, shutil, subprocess, sys, tempfile, time
+import numpy as np
+import soundfile as sf
+
+# Peak memory of in-memory vs. streamed ingest on synthetic input:
+#
+#   python3 stream_benchmark.py --hours 3
+#
+# A synthetic recording (a drone with harmonics, a slow melody and noise) is
+# written to a temp directory, then each ingest mode runs in its own child
+# process so that its peak RSS can be read back with wait4.
+
+SR = 44100
+BLOCK_SECONDS = 60
+
+def synth_block(start, length, sr=SR):
+    t = (start + np.arange(length)) / sr
+    sa = 146.8
+    drone = sum(np.sin(2 * np.pi * sa * h * t) / h for h in (1, 2, 3, 4))
+    melody_freq = sa * 2 ** (np.floor(t / 2) % 12 / 12)
+    melody = np.sin(2 * np.pi * np.cumsum(melody_freq) / sr)
+    noise = np.random.default_rng(start).normal(0, 0.02, length)
+    return (0.1 * drone + 0.2 * melody + noise).astype(np.float32)
+
+def write_synthetic(path, seconds):
+    total = int(seconds * SR)
+    block = BLOCK_SECONDS * SR
+    with sf.SoundFile(path, 'w', SR, 2, subtype='PCM_16') as f:
+        for start in range(0, total, block):
+            mono = synth_block(start, min(block, total - start))
+            f.write(np.stack((mono, mono), axis=1))
+
+def run_child(mode, source, work_dir):
+    os.makedirs(work_dir)
+    for sub_dir in ('audio/wav', 'audio/mp3', 'audio/opus', 'peaks'):
+        os.makedirs(os.path.join(work_dir, sub_dir))
+    # the ingest functions move the source into place, so hand them a copy
+    upload = os.path.join(work_dir, 'upload.flac')
+    shutil.copy(source, upload)
+    start = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', mode, upload],
+        cwd=work_dir)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - start
+    if status != 0:
+        raise RuntimeError(f'{mode} ingest failed')
+    # ru_maxrss is in kilobytes on linux
+    return rusage.ru_maxrss / 1024, elapsed
+
+def child(mode, upload):
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from process_audio import ingest, ingest_stream
+    if mode == 'stream':
+        result = ingest_stream(upload, 'upload', 'flac')
+    else:
+        result = ingest(upload, 'upload', 'flac')
+    print(f"{mode}: duration {result['duration']:.0f}s, "
+          f"sa {result['saEstimate']:.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=3)
+    parser.add_argument('--modes', nargs='+', default=['stream', 'memory'])
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        sys.exit(0)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp_dir, 'synthetic.flac')
+        print(f'writing {args.hours}h of synthetic audio')
+        write_synthetic(source, args.hours * 3600)
+        for mode in args.modes:
+            peak_mb, elapsed = run_child(mode, source,
+                                         os.path.join(tmp_dir, mode))
+            print(f'{mode}: peak RSS {peak_mb:.0f} MB, {elapsed:.0f}s')
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,8 @@
+import os, sys
+
+# the scripts import their neighbours by name, as when run from their own
+# directories
+PYTHON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for path in (PYTHON_DIR, os.path.join(PYTHON_DIR, 'mass_upload')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import analysis_cache
+import spectrogram
+
+# A log spectrogram cropped from the float16 cache against the one a fresh
+# transform quantizes from float64 logs. float16 keeps about three
+# significant digits, so a value lying on a level boundary can round across
+# it: at most LEVEL_TOLERANCE levels apart, on no more than PIXEL_FRACTION of
+# the pixels.
+
+LEVEL_TOLERANCE = 1
+PIXEL_FRACTION = 0.01
+SAMPLE_RATE = 44100
+
+@pytest.fixture(scope='module')
+def audio():
+    rng = np.random.default_rng(0)
+    n = 20 * SAMPLE_RATE
+    t = np.arange(n) / SAMPLE_RATE
+    audio = (0.3 * np.sin(2 * np.pi * 220 * t)
+             + 0.2 * np.sin(2 * np.pi * 331 * t * (1 + 0.01 * np.sin(t)))
+             + 0.02 * rng.normal(size=n))
+    # leading digital silence, for the zero replacement
+    audio[:SAMPLE_RATE] = 0
+    return audio
+
+@pytest.mark.parametrize('sa', [110, 150, 290])
+def test_crop_matches_fresh_build(audio, sa, tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis_cache, 'ANALYSIS_DIR', str(tmp_path))
+    fresh = []
+    monkeypatch.setattr(spectrogram, 'write_log_spectrograms',
+                        lambda arr, *args, **kwargs: fresh.append(arr))
+    rec_dir = tmp_path / 'rec'
+    rec_dir.mkdir()
+    info = spectrogram.make_spectrograms(
+        audio=audio, sa=sa, tiles_dir=str(tmp_path / 'tiles'),
+        cover=analysis_cache.CACHE_RANGE,
+        cache_path=str(rec_dir / analysis_cache.CQT_NAME))
+    rows = spectrogram.log_rows(sa, info['offset'])
+    crop = analysis_cache.crop_spectrogram('rec', info, rows)
+    assert crop.shape == fresh[0].shape
+    diff = np.abs(crop.astype(int) - fresh[0])
+    assert diff.max() <= LEVEL_TOLERANCE
+    assert (diff > 0).mean() <= PIXEL_FRACTION
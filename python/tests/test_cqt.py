@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+from cqt import CQTPlan, LogQuantizer, cqt, cqt_blocks
+
+# The chunked constant-Q engine against what its definition gives for tones
+# that complete a whole number of periods in every frame: such a tone is a
+# single FFT bin, so bin k of a column reads amplitude * H_k(tone frequency),
+# H_k being the Hann window of width alpha * f_k + gamma around f_k. That is
+# exact up to rounding; TOLERANCE (relative to the amplitude) allows for it.
+
+TOLERANCE = 1e-9
+# the shape of a tone's peak, as against NSGConstantQ, in dB
+NSG_DB = 1.5
+SAMPLE_RATE = 44100
+
+@pytest.fixture(scope='module')
+def plan():
+    return CQTPlan(SAMPLE_RATE, 75, 2400, 72, 20, 1)
+
+def expected_column(plan, tones):
+    # tones are (FFT bin, amplitude) pairs
+    alpha = 2 ** (1 / 72) - 2 ** (-1 / 72)
+    bandwidths = alpha * plan.freqs + 20
+    column = np.zeros(plan.num_bins)
+    bin_hz = plan.sample_rate / plan.frame_size
+    for fft_bin, amplitude in tones:
+        offset = fft_bin * bin_hz - plan.freqs
+        inside = np.abs(offset) <= bandwidths / 2
+        # the tones' windows mustn't overlap, or their phases would matter
+        assert not np.any(inside & (column > 0))
+        column += np.where(inside, amplitude
+                           * (0.5 + 0.5 * np.cos(2 * np.pi * offset
+                                                 / bandwidths)), 0)
+    return column
+
+def tones_signal(plan, tones, num_samples, onset=0):
+    t = np.arange(num_samples - onset)
+    audio = np.zeros(num_samples)
+    for fft_bin, amplitude in tones:
+        audio[onset:] += amplitude * np.cos(2 * np.pi * fft_bin * t
+                                            / plan.frame_size + 0.3)
+    return audio
+
+def test_tone_matches_definition(plan):
+    # about 220 Hz and 880 Hz
+    tones = [(82, 0.5), (328, 0.25)]
+    num_samples = 4 * SAMPLE_RATE
+    onset = SAMPLE_RATE
+    mags = cqt(tones_signal(plan, tones, num_samples, onset), plan)
+    assert mags.shape == (plan.num_bins, plan.num_columns(num_samples))
+    centres = np.arange(mags.shape[1]) * plan.hop
+    half = plan.frame_size // 2
+    # frames wholly before the onset see nothing, those wholly inside the
+    # tone the steady state
+    silent = centres + half <= onset
+    steady = (centres - half >= onset) & (centres + half <= num_samples)
+    assert silent.sum() > 0 and steady.sum() > 0
+    assert np.all(mags[:, silent] == 0)
+    expected = expected_column(plan, tones)
+    np.testing.assert_allclose(
+        mags[:, steady], np.repeat(expected[:, None], steady.sum(), axis=1),
+        rtol=0, atol=TOLERANCE)
+    # the loudest bin of each tone is the one nearest it on the 72 per
+    # octave grid
+    for fft_bin, _ in tones:
+        f = fft_bin * plan.sample_rate / plan.frame_size
+        nearest = int(round(72 * np.log2(f / 75)))
+        lobe = slice(nearest - 3, nearest + 4)
+        assert np.argmax(mags[lobe, steady].mean(axis=1)) + nearest - 3 \
+            == nearest
+
+@pytest.mark.parametrize('seconds', [0.01, 1, 7.3])
+def test_chunked_matches_single_pass(plan, seconds):
+    # the output doesn't depend on how the audio is split into blocks
+    rng = np.random.default_rng(0)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    audio = (np.sin(2 * np.pi * 220 * t) + 0.1 * rng.normal(size=n)
+             ).astype(np.float32)
+    single = cqt(audio, plan)
+    assert single.shape == (plan.num_bins, plan.num_columns(n))
+    for block_size in (1000, 4410, 44100, 123457):
+        blocks = [audio[i:i + block_size] for i in range(0, n, block_size)]
+        chunked = np.hstack(list(cqt_blocks(blocks, plan)) or
+                            [np.empty((plan.num_bins, 0))])
+        assert np.array_equal(single, chunked)
+
+def test_profile_matches_nsgconstantq(plan):
+    # Against the NSGConstantQ the spectrograms used to be made with, on the
+    # same bins. Its time grid and scaling differ, so each bin's mean
+    # magnitude is compared in dB below the peak: the peak must be the same
+    # bin, and the bins above -20 dB in NSGConstantQ within NSG_DB of it.
+    ess = pytest.importorskip('essentia.standard')
+    num_samples = 2 * SAMPLE_RATE
+    audio = tones_signal(plan, [(82, 0.5)], num_samples).astype(np.float32)
+    nsg = ess.NSGConstantQ(inputSize=num_samples, minFrequency=75,
+                           maxFrequency=2400, binsPerOctave=72,
+                           windowSizeFactor=1, gamma=20)
+    reference = np.abs(nsg(audio)[0]).mean(axis=1)
+    ours = cqt(audio, plan).mean(axis=1)
+    assert len(reference) == len(ours)
+    assert np.argmax(ours) == np.argmax(reference)
+    ref_db = 20 * np.log10(reference / reference.max())
+    with np.errstate(divide='ignore'):
+        our_db = 20 * np.log10(ours / ours.max())
+    lobe = ref_db > -20
+    assert lobe.sum() > 1
+    np.testing.assert_allclose(our_db[lobe], ref_db[lobe], rtol=0,
+                               atol=NSG_DB)
+
+def test_quantizer_matches_replace_zeros():
+    # The two-pass quantizer against what make_spec_data.py did with the
+    # whole array: float64 log10 after replaceZeros on each segment, and one
+    # global min and max. Silence in the second segment takes that segment's
+    # smallest magnitude, not the recording's.
+    rng = np.random.default_rng(1)
+    segment_columns = 50
+    mags = rng.uniform(1e-4, 1, size=(12, 130))
+    mags[:, 40:60] = 0
+    mags[:, 60:100] *= 10
+    expected = []
+    for start in range(0, mags.shape[1], segment_columns):
+        segment = mags[:, start:start + segment_columns].copy()
+        segment[segment == 0] = segment[segment != 0].min()
+        expected.append(np.log10(segment))
+    expected = np.hstack(expected)
+    expected = (256 * (expected - expected.min())
+                / (expected.max() - expected.min())).astype(np.uint8)
+    quantizer = LogQuantizer(segment_columns=segment_columns)
+    for start in range(0, mags.shape[1], 17):
+        quantizer.add(mags[:, start:start + 17])
+    assert np.array_equal(np.hstack(list(quantizer.chunks())), expected)
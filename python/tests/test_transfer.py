@@ -0,0 +1,76 @@
+import os, shutil
+import pytest
+import transfer
+from manifest import Manifest
+from transfer import TransferQueue, release
+
+# rsync between two local directories, standing in for the server's upload
+# directory
+
+pytestmark = pytest.mark.skipif(shutil.which('rsync') is None,
+                                reason='rsync is not installed')
+
+def make_upload(tmp_path, num_entries):
+    src_dir = tmp_path / 'upload'
+    src_dir.mkdir()
+    target_dir = tmp_path / 'target'
+    target_dir.mkdir()
+    manifest = Manifest(str(src_dir), 'test')
+    for row in range(num_entries):
+        cut_file = f'{row}.mp3'
+        (src_dir / cut_file).write_bytes(bytes([row]) * 100)
+        manifest.mark(row, 'cut', cut_file=cut_file)
+        manifest.mark(row, 'analysed')
+    manifest.save()
+    return str(src_dir), str(target_dir) + '/', manifest
+
+def transfer_rows(src_dir, target, manifest, rows):
+    queue = TransferQueue(src_dir, target, manifest)
+    queue.start()
+    for row in rows:
+        queue.put(row)
+    queue.close()
+    return queue
+
+def test_transfer_queue_sends_only_queued_files(tmp_path):
+    src_dir, target, manifest = make_upload(tmp_path, 4)
+    queue = transfer_rows(src_dir, target, manifest, [0, 2])
+    assert queue.errors == {}
+    assert sorted(os.listdir(target)) == ['0.mp3', '2.mp3']
+    with open(os.path.join(target, '2.mp3'), 'rb') as f:
+        assert f.read() == bytes([2]) * 100
+    assert manifest.remaining('transferred') == [1, 3]
+
+def test_transfer_queue_records_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer, 'RETRY_DELAY', 0)
+    src_dir, _, manifest = make_upload(tmp_path, 2)
+    missing = str(tmp_path / 'missing' / 'target') + '/'
+    queue = transfer_rows(src_dir, missing, manifest, [0, 1])
+    assert sorted(queue.errors) == [0, 1]
+    assert manifest.remaining('transferred') == [0, 1]
+
+def test_release_withdraws_files_that_were_not_inserted(tmp_path):
+    src_dir, target, manifest = make_upload(tmp_path, 3)
+    transfer_rows(src_dir, target, manifest, [0, 1, 2])
+    # the server's own files in the upload directory are not touched
+    with open(os.path.join(target, 'other.mp3'), 'w') as f:
+        f.write('x')
+    # row 1 was sent early but failed to insert
+    release(src_dir, target, manifest, [0, 2])
+    assert sorted(os.listdir(target)) == ['0.mp3', '2.mp3', 'blank.txt',
+                                          'other.mp3']
+    assert manifest.remaining('released') == [1]
+    assert manifest.remaining('transferred') == [1]
+
+def test_resume_leaves_earlier_releases_alone(tmp_path):
+    src_dir, target, manifest = make_upload(tmp_path, 3)
+    transfer_rows(src_dir, target, manifest, [0])
+    release(src_dir, target, manifest, [0])
+    # the server may still be processing 0.mp3 when the run is resumed
+    resumed = Manifest(src_dir, 'test')
+    assert resumed.remaining('released') == [1, 2]
+    transfer_rows(src_dir, target, resumed, [1, 2])
+    release(src_dir, target, resumed, [1, 2])
+    assert sorted(os.listdir(target)) == ['0.mp3', '1.mp3', '2.mp3',
+                                          'blank.txt']
+    assert resumed.complete()
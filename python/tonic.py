@@ -0,0 +1,202 @@
+import math, os
+from concurrent.futures import (ProcessPoolExecutor, Future, wait,
+                                FIRST_COMPLETED)
+from typing import TypedDict
+import numpy as np
+
+# Sampled tonic (Sa) estimation. Rather than running TonicIndianArtMusic over
+# a whole recording, it is run on `num_windows` evenly spaced windows in a
+# process pool, and the per-window guesses are reduced to a consensus. Windows
+# that have not finished when `time_budget` runs out are dropped.
+
+NUM_WINDOWS = 8
+WINDOW_SECONDS = 30
+MAX_TONIC_FREQUENCY = 200
+# two window estimates agree if they are within this many cents of each other
+AGREEMENT_CENTS = 50
+
+class TonicEstimate(TypedDict):
+    frequency: float
+    confidence: float
+    estimates: list[float]
+    windows_planned: int
+
+_algs = {}
+
+class InlineExecutor:
+    # Runs windows one after another in this process, for callers that are
+    # already pool workers themselves. The time budget has no effect here.
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+def _get_alg(max_tonic):
+    # one warm algorithm per worker process (and per max frequency)
+    if max_tonic not in _algs:
+        import essentia.standard as ess
+        _algs[max_tonic] = ess.TonicIndianArtMusic(maxTonicFrequency=max_tonic)
+    return _algs[max_tonic]
+
+def _window_tonic(window, max_tonic):
+    return float(_get_alg(max_tonic)(np.asarray(window, dtype=np.float32)))
+
+def _file_window_tonic(path, start, end, max_tonic):
+    # EasyLoader(startTime, endTime) decodes the whole file and then trims
+    # it, so the window is read through an ffmpeg seek instead
+    from audio_stream import read_window
+    return _window_tonic(read_window(path, start, end - start), max_tonic)
+
+def window_starts(total, window, num_windows):
+    # evenly spaced window starts covering the whole recording
+    if total <= window:
+        return [0]
+    num_windows = min(num_windows, math.ceil(total / window))
+    return np.linspace(0, total - window, num_windows).tolist()
+
+def consensus(estimates):
+    # Octave and fifth errors are common for single windows, so rather than
+    # averaging we pick the estimate with the most neighbours (within
+    # AGREEMENT_CENTS) and take the median of that cluster.
+    if len(estimates) == 0:
+        raise ValueError('No tonic estimates to combine')
+    cents = 1200 * np.log2(np.asarray(estimates))
+    close = np.abs(cents[:, None] - cents[None, :]) <= AGREEMENT_CENTS
+    counts = close.sum(axis=1)
+    cluster = cents[close[np.argmax(counts)]]
+    frequency = float(2 ** (np.median(cluster) / 1200))
+    confidence = float(len(cluster) / len(estimates))
+    return frequency, confidence
+
+def _collect(futures, time_budget, windows_planned):
+    done, not_done = wait(futures, timeout=time_budget)
+    if len(done) == 0:
+        # nothing finished inside the budget; settle for the first that does
+        done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+    for future in not_done:
+        future.cancel()
+    estimates = [f.result() for f in done if f.exception() is None]
+    # confidence also reflects how many of the planned windows contributed
+    frequency, agreement = consensus(estimates)
+    return {
+        'frequency': frequency,
+        'confidence': agreement * len(estimates) / windows_planned,
+        'estimates': estimates,
+        'windows_planned': windows_planned
+    }
+
+def _run(submit, time_budget, windows_planned, executor, workers):
+    own_executor = executor is None
+    if own_executor and workers == 1:
+        executor = InlineExecutor()
+    elif own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = submit(executor)
+        return _collect(futures, time_budget, windows_planned)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def estimate_tonic(audio, sample_rate=44100, num_windows=NUM_WINDOWS,
+                   window_seconds=WINDOW_SECONDS, time_budget=None,
+                   executor=None, workers=None,
+                   max_tonic=MAX_TONIC_FREQUENCY) -> TonicEstimate:
+    # `audio` is an already decoded mono signal. Pass a long-lived `executor`
+    # to reuse warm worker processes between recordings.
+    window = int(window_seconds * sample_rate)
+    starts = [int(s) for s in window_starts(len(audio), window, num_windows)]
+
+    def submit(ex):
+        return [ex.submit(_window_tonic, audio[s:s + window], max_tonic)
+                for s in starts]
+    return _run(submit, time_budget, len(starts), executor, workers)
+
+def estimate_tonic_file(path, duration, num_windows=NUM_WINDOWS,
+                        window_seconds=WINDOW_SECONDS, time_budget=None,
+                        executor=None, workers=None,
+                        max_tonic=MAX_TONIC_FREQUENCY) -> TonicEstimate:
+    # Same as estimate_tonic, but each worker loads only its own window from
+    # disk, so the recording never has to be decoded in full here.
+    starts = window_starts(duration, window_seconds, num_windows)
+
+    def submit(ex):
+        return [ex.submit(_file_window_tonic, path, s,
+                          min(s + window_seconds, duration), max_tonic)
+                for s in starts]
+    return _run(submit, time_budget, len(starts), executor, workers)
+
+class TonicSampler:
+    # Picks the same windows as estimate_tonic out of a stream of consecutive
+    # blocks, so a recording can be sampled while it is being decoded. Each
+    # window is submitted as soon as it is complete. `total` is the expected
+    # length in samples; windows running past the real end are cut short.
+
+    def __init__(self, total, sample_rate=44100, executor=None,
+                 num_windows=NUM_WINDOWS, window_seconds=WINDOW_SECONDS,
+                 max_tonic=MAX_TONIC_FREQUENCY, workers=None):
+        self.window = int(window_seconds * sample_rate)
+        self.starts = [int(s) for s in
+                       window_starts(total, self.window, num_windows)]
+        self.buffers = [[] for _ in self.starts]
+        self.filled = [0 for _ in self.starts]
+        self.futures = []
+        self.max_tonic = max_tonic
+        self.own_executor = executor is None
+        if self.own_executor:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        self.executor = executor
+        self.submitted = set()
+
+    def add(self, block, offset):
+        # `offset` is the sample index of block[0] in the whole recording
+        end = offset + len(block)
+        for i, start in enumerate(self.starts):
+            if i in self.submitted:
+                continue
+            lo = max(start, offset)
+            hi = min(start + self.window, end)
+            if hi > lo:
+                self.buffers[i].append(block[lo - offset:hi - offset].copy())
+                self.filled[i] += hi - lo
+            if self.filled[i] == self.window:
+                self._submit(i)
+
+    def _submit(self, i):
+        window = np.concatenate(self.buffers[i])
+        self.buffers[i] = []
+        self.submitted.add(i)
+        self.futures.append(
+            self.executor.submit(_window_tonic, window, self.max_tonic))
+
+    def result(self, time_budget=None) -> TonicEstimate:
+        for i in range(len(self.starts)):
+            if i not in self.submitted and self.filled[i] > 0:
+                self._submit(i)
+        try:
+            return _collect(self.futures, time_budget, len(self.starts))
+        finally:
+            self.close()
+
+    def close(self):
+        # shuts down the sampler's own pool, if it made one; callers that
+        # might not reach result() (the decode failing, say) must call this
+        if self.own_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+def _warm(max_tonic):
+    _get_alg(max_tonic)
+
+def make_executor(workers=None, max_tonic=MAX_TONIC_FREQUENCY):
+    # start the worker processes and build their algorithms up front
+    workers = workers or os.cpu_count()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    wait([executor.submit(_warm, max_tonic) for _ in range(workers)])
+    return executor
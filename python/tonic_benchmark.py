@@ -0,0 +1,58 @@
+import argparse, os, time
+import numpy as np
+import essentia.standard as ess
+from tonic import estimate_tonic, make_executor, MAX_TONIC_FREQUENCY
+
+# Compares the sampled tonic estimate against TonicIndianArtMusic run on the
+# whole file, for every audio file in a local directory:
+#
+#   python3 tonic_benchmark.py ./audio/wav --windows 8 --budget 30
+
+AUDIO_SUFFIXES = ('.wav', '.mp3', '.opus', '.flac')
+
+def cents(a, b):
+    return 1200 * np.log2(a / b)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory')
+    parser.add_argument('--windows', type=int, default=8)
+    parser.add_argument('--window-seconds', type=float, default=30)
+    parser.add_argument('--budget', type=float, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    files = sorted(f for f in os.listdir(args.directory)
+                   if f.lower().endswith(AUDIO_SUFFIXES))
+    # the pool is warmed up front, so process start-up isn't charged to the
+    # first file
+    executor = make_executor(args.workers)
+    full_alg = ess.TonicIndianArtMusic(maxTonicFrequency=MAX_TONIC_FREQUENCY)
+    rows = []
+    for f in files:
+        audio = ess.EasyLoader(filename=os.path.join(args.directory, f))()
+        start = time.time()
+        full = full_alg(audio)
+        full_time = time.time() - start
+        start = time.time()
+        sampled = estimate_tonic(
+            audio, num_windows=args.windows,
+            window_seconds=args.window_seconds, time_budget=args.budget,
+            executor=executor)
+        sampled_time = time.time() - start
+        diff = cents(sampled['frequency'], full)
+        rows.append((full_time, sampled_time, diff))
+        print(f"{f}: full {full:.2f} Hz in {full_time:.1f}s, "
+              f"sampled {sampled['frequency']:.2f} Hz in {sampled_time:.1f}s "
+              f"({diff:+.0f} cents, confidence {sampled['confidence']:.2f})")
+    executor.shutdown()
+    if len(rows) == 0:
+        print('No audio files found')
+    else:
+        full_times, sampled_times, diffs = np.array(rows).T
+        print(f'\n{len(rows)} files')
+        print(f'full-file total: {full_times.sum():.1f}s, '
+              f'sampled total: {sampled_times.sum():.1f}s, '
+              f'speedup {full_times.sum() / sampled_times.sum():.1f}x')
+        print(f'median |error|: {np.median(np.abs(diffs)):.1f} cents, '
+              f'within 50 cents: {np.mean(np.abs(diffs) <= 50):.0%}')
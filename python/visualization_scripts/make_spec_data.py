@@ -1,71 +1,14 @@
-import json, math, gzip, os, sys
-import essentia.standard as ess
-import numpy as np
-from matplotlib import pyplot as plt
-
-def replaceZeros(data):
-    min_nonzero = np.min(data[np.nonzero(data)])
-    data[data == 0] = min_nonzero
-    return data
-
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
-
-def make_spec_data(file_path, output_dir):
-    loader = ess.EasyLoader(filename = file_path, replayGain=0, startTime=0)
-    # check if there is even a file at the file_path, and if not, print something
-    # and return
-    if not os.path.exists(file_path):
-        print("File not found: " + file_path)
-        return
-    audio = loader()
-    params = {
-              'inputSize': audio.size,
-              'minFrequency': 75,
-              'maxFrequency': 2400,
-              'binsPerOctave': 72,
-              'windowSizeFactor': 1,
-              'gamma': 20
-             }
-    cqGen = ess.NSGConstantQ(**params)
-    max_seconds = 600
-    max_samples = int(max_seconds * loader.paramValue('sampleRate'))
-
-
-    passes = math.ceil(len(audio) / max_samples)
-    arrs = []
-
-    for i in range(passes):
-        print(i)
-        if i < passes - 1:
-            audio_segment = audio[i * max_samples: (i+1) * max_samples]
-        else:
-            audio_segment = audio[i * max_samples:]
-        constantq, _, _ = cqGen(audio_segment)
-        abs_constantq = replaceZeros(np.abs(constantq))
-        arr = np.log10(abs_constantq)
-        arrs.append(arr)
-
-    arr = np.hstack(arrs)
-    arr =  (256 * (arr - np.min(arr)) / (np.max(arr) - np.min(arr))).astype(np.uint8)
-    # flip vertically
-    arr = np.flipud(arr)
-    shape = np.shape(arr)
-    offset = 10
-    # Take the last 10 columns of the spectrogram
-    # and put them at the beginning
-    # arr = np.hstack((arr[:, -offset:], arr[:, :-offset]))    
-    arr_bytes = arr.tobytes()
-
-    compressed_data = gzip.compress(arr_bytes)
-    with open(output_dir + '/spec_data.gz', 'wb') as f:
-        f.write(compressed_data)
-
-    with open(output_dir + '/spec_shape.json', 'w') as f:
-        json.dump({'shape': shape}, f)
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from spectrogram import make_spectrograms
+
+def make_spec_data(file_path, output_dir, audio=None, sample_rate=44100):
+    # `audio` lets a caller that has already decoded the recording (see
+    # process_audio.py) skip loading it again from `file_path`; otherwise the
+    # file is streamed through the CQT in blocks. When the log spectrograms
+    # are wanted too, call spectrogram.make_spectrograms with both outputs
+    # instead, so the CQT is only run once.
+    make_spectrograms(file_path, audio, sample_rate, spec_dir=output_dir)
         
 # if main
 if __name__ == '__main__':
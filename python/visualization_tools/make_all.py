@@ -0,0 +1,215 @@
+import argparse, json, os, sys, time, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from bson.objectid import ObjectId
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from process_audio import get_mongo_client
+from dedup_cache import file_hash
+import analysis_cache
+
+# One driver for regenerating spec data, spectrograms and melographs across
+# the whole collection, run from the server root:
+#
+#   python3 visualization_tools/make_all.py spec_data --workers 8
+#   python3 visualization_tools/make_all.py all --since 2024-01-01 --limit 50
+#
+# Each finished artifact directory gets a `build.json` stamp recording the
+# wav's mtime, size and hash, the Sa it was made for and the version of the
+# parameters below; artifacts whose stamp still matches are skipped, so an
+# interrupted run picks up where it left off when simply started again. Bump
+# a version when that artifact's output changes.
+
+KINDS = {
+    # kind: (output root, parameter version, whether it depends on the Sa)
+    'spec_data': ('spec_data', 2, False),
+    'spectrograms': ('spectrograms', 3, True),
+    'melographs': ('melographs', 3, True),
+}
+STAMP_NAME = 'build.json'
+WAV_DIR = os.path.join('audio', 'wav')
+
+def wav_path(rec_id):
+    return os.path.join(WAV_DIR, rec_id + '.wav')
+
+def out_dir(kind, rec_id):
+    return os.path.join(KINDS[kind][0], rec_id)
+
+def read_stamp(kind, rec_id):
+    try:
+        with open(os.path.join(out_dir(kind, rec_id), STAMP_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_stamp(kind, rec_id, sa, stat, content_hash):
+    stamp = {
+        'version': KINDS[kind][1],
+        'sa': sa,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'hash': content_hash,
+        'built': time.time()
+    }
+    tmp_path = os.path.join(out_dir(kind, rec_id), STAMP_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(stamp, f)
+    os.replace(tmp_path, os.path.join(out_dir(kind, rec_id), STAMP_NAME))
+
+def is_fresh(kind, rec_id, sa):
+    # Only a stat for most files; the wav is hashed only when its mtime
+    # moved but the size didn't (a copy, or a touch), and if the bytes are the
+    # same the stamp is brought up to date.
+    stamp = read_stamp(kind, rec_id)
+    if stamp is None or stamp['version'] != KINDS[kind][1]:
+        return False
+    if KINDS[kind][2] and stamp['sa'] != sa:
+        return False
+    stat = os.stat(wav_path(rec_id))
+    if stat.st_size != stamp['size']:
+        return False
+    if stat.st_mtime_ns == stamp['mtime_ns']:
+        return True
+    content_hash = file_hash(wav_path(rec_id))
+    if content_hash != stamp['hash']:
+        return False
+    write_stamp(kind, rec_id, sa, stat, content_hash)
+    return True
+
+def build(kinds, rec_id, sa):
+    # runs in a pool worker; returns the seconds it took. Spec data and
+    # spectrograms of the same recording come from one CQT (spectrogram.py),
+    # and spectrograms and melographs are cropped from the recording's cached
+    # intermediates when it has them (analysis_cache.py).
+    start = time.time()
+    path = wav_path(rec_id)
+    stat = os.stat(path)
+    for kind in kinds:
+        os.makedirs(out_dir(kind, rec_id), exist_ok=True)
+    if 'spec_data' in kinds or 'spectrograms' in kinds:
+        spec_dir = out_dir('spec_data', rec_id) if 'spec_data' in kinds \
+            else None
+        tiles_dir = out_dir('spectrograms', rec_id) \
+            if 'spectrograms' in kinds else None
+        analysis_cache.spectrograms(rec_id, sa, tiles_dir=tiles_dir,
+                                    spec_dir=spec_dir, full_path=path,
+                                    workers=1)
+    if 'melographs' in kinds:
+        analysis_cache.melograph(rec_id, sa, out_dir('melographs', rec_id),
+                                 full_path=path, workers=1)
+    # the hash is taken after the build, so it is in the worker's time
+    content_hash = file_hash(path)
+    for kind in kinds:
+        write_stamp(kind, rec_id, sa if KINDS[kind][2] else None, stat,
+                    content_hash)
+    return time.time() - start
+
+def list_recordings(db, kind, since=None):
+    # (recording id, Sa) pairs; spectrograms and melographs are only made for
+    # recordings whose Sa has been verified
+    query = {}
+    if since is not None:
+        query['_id'] = { '$gte': ObjectId.from_datetime(since) }
+    if not KINDS[kind][2]:
+        return [(str(rec['_id']), None)
+                for rec in db.audioRecordings.find(query, { '_id': 1 })]
+    recs = []
+    projection = { '_id': 1, 'recordings': 1 }
+    for audio_event in db.audioEvents.find({}, projection):
+        for rec in audio_event['recordings'].values():
+            if not rec.get('saVerified'):
+                continue
+            rec_id = rec['audioFileId']
+            if since is not None and ObjectId(rec_id).generation_time < since:
+                continue
+            recs.append((str(rec_id), rec['saEstimate']))
+    return recs
+
+def plan_jobs(db, kinds, since=None, limit=None, force=False):
+    # (kinds, recording id, Sa) jobs; a recording whose spec data and
+    # spectrograms are both out of date gets a single job for the two
+    jobs = []
+    spectral = {}
+    skipped = 0
+    missing = 0
+    for kind in kinds:
+        for rec_id, sa in list_recordings(db, kind, since):
+            if not os.path.exists(wav_path(rec_id)):
+                missing += 1
+            elif not force and is_fresh(kind, rec_id, sa):
+                skipped += 1
+            elif kind == 'melographs':
+                jobs.append(((kind,), rec_id, sa))
+            elif rec_id in spectral:
+                job_kinds, _, job_sa = spectral[rec_id]
+                if kind in job_kinds:
+                    continue
+                spectral[rec_id] = (job_kinds + (kind,), rec_id,
+                                    sa if sa is not None else job_sa)
+            else:
+                spectral[rec_id] = ((kind,), rec_id, sa)
+    jobs = list(spectral.values()) + jobs
+    if limit is not None:
+        jobs = jobs[:limit]
+    return jobs, skipped, missing
+
+def run(jobs, workers):
+    failures = {}
+    done = 0
+    busy = 0
+    total_bytes = 0
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = { executor.submit(build, *job): job for job in jobs }
+        for future in as_completed(futures):
+            kinds, rec_id, _ = job = futures[future]
+            kind = '+'.join(kinds)
+            try:
+                busy += future.result()
+                done += 1
+                total_bytes += os.path.getsize(wav_path(rec_id))
+                print(f"[{done + len(failures)}/{len(jobs)}] {kind} {rec_id}")
+            except Exception:
+                failures[job] = traceback.format_exc()
+                print(f"[{done + len(failures)}/{len(jobs)}] {kind} {rec_id} "
+                      f"failed")
+    return done, failures, busy, total_bytes, time.time() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Regenerate visualizations')
+    parser.add_argument('kind', choices=[*KINDS, 'all'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--limit', type=int,
+                        help='at most this many builds this run')
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help='only recordings created on or after this date')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild even when up to date')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only report what would be built')
+    args = parser.parse_args(argv)
+    kinds = list(KINDS) if args.kind == 'all' else [args.kind]
+    since = args.since
+    if since is not None and since.tzinfo is None:
+        since = since.astimezone()
+
+    client = get_mongo_client()
+    jobs, skipped, missing = plan_jobs(client.swara, kinds, since, args.limit,
+                                       args.force)
+    client.close()
+    print(f"{len(jobs)} to build, {skipped} up to date, {missing} without a wav")
+    if args.dry_run:
+        for kinds, rec_id, sa in jobs:
+            print(f"  {'+'.join(kinds)} {rec_id}")
+        return
+    done, failures, busy, total_bytes, elapsed = run(jobs, args.workers)
+    print(f"\n{done} built, {len(failures)} failed, {skipped} skipped in "
+          f"{elapsed:.0f}s ({60 * done / max(elapsed, 1e-9):.1f} per minute, "
+          f"{total_bytes / 2**20 / max(elapsed, 1e-9):.1f} MB of wav/s, "
+          f"{busy / max(elapsed, 1e-9):.1f} workers busy on average)")
+    for (kinds, rec_id, _), error in failures.items():
+        print(f"\n{'+'.join(kinds)} {rec_id}:\n{error}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -49,6 +49,83 @@ function runPythonScript(scriptPath, args = []) {
   });
 }
 
+// Uploads are processed by the long-running python/ingest_worker.py rather
+// than a process_audio.py spawn each; a job is a JSON file written to
+// `pending` under the queue directory, and ends up in `done` or `failed`.
+// The worker also makes the spectrograms and melograph (`visuals`), and marks
+// the job `ingested` once the recording itself is stored.
+const ingestQueueDir = process.env.INGEST_QUEUE_DIR || 'ingest_queue';
+
+const enqueueIngestJob = async (fn, audioEventID, recIdx, newId) => {
+  const job = {
+    path: fn,
+    objectId: String(audioEventID),
+    recordingIdx: String(recIdx),
+    recordingId: String(newId),
+    visuals: true,
+    enqueued: Date.now() / 1000
+  };
+  // time-prefixed names keep the queue roughly first in, first out, and
+  // writing to a temp name keeps the worker from reading half a job
+  const rand = Math.random().toString(16).slice(2);
+  const jobName = `${process.hrtime.bigint()}_${rand}.json`;
+  const tmpPath = `${ingestQueueDir}/${jobName}.tmp`;
+  await fs.mkdir(`${ingestQueueDir}/pending`, { recursive: true });
+  await fs.writeFile(tmpPath, JSON.stringify(job));
+  await fs.rename(tmpPath, `${ingestQueueDir}/pending/${jobName}`);
+  return jobName;
+};
+
+// how long an upload waits for the worker before giving up
+const ingestTimeout = Number(process.env.INGEST_TIMEOUT_MS) || 10 * 60 * 1000;
+
+// resolves with the job once the recording is ingested (the visuals may
+// still be in progress), or rejects with its traceback, or once `timeout` ms
+// have passed (the worker being down, say)
+const waitForIngestJob = async (jobName, timeout = ingestTimeout,
+                                interval = 500) => {
+  const deadline = Date.now() + timeout;
+  while (Date.now() < deadline) {
+    for (const state of ['ingested', 'done', 'failed']) {
+      const jobPath = `${ingestQueueDir}/${state}/${jobName}`;
+      if (await exists(jobPath)) {
+        const job = JSON.parse(await fs.readFile(jobPath, 'utf8'));
+        if (state === 'failed') {
+          if (job.result === undefined) {
+            throw new Error(job.error);
+          }
+          // only the visuals failed; the recording itself is stored
+          console.error('Error in visuals generation:', job.error);
+        }
+        return job;
+      }
+    }
+    await new Promise(resolve => setTimeout(resolve, interval));
+  }
+  throw new Error(`ingest job ${jobName} not finished after ${timeout} ms`);
+};
+
+// keeps one ingest worker running alongside the server, unless it is run
+// separately (INGEST_WORKER=external)
+const startIngestWorker = () => {
+  const args = ['ingest_worker.py', '--queue-dir', ingestQueueDir];
+  const worker = spawn('python3', args);
+  worker.stdout.on('data', data => {
+    console.log(`ingest worker: ${data}`)
+  });
+  worker.stderr.on('data', data => {
+    console.error(`ingest worker stderr: ${data}`)
+  });
+  worker.on('close', code => {
+    console.error(`ingest worker exited with code ${code}; restarting`);
+    setTimeout(startIngestWorker, 5000);
+  });
+};
+
+if (process.env.INGEST_WORKER !== 'external') {
+  startIngestWorker();
+}
+
 const deleteFiles = async (audioID) => {
   const peaksPath = 'peaks/' + audioID + '.json';
   const spectrogramsPath = 'spectrograms/' + audioID;
@@ -1792,11 +1869,9 @@ const runServer = async () => {
               console.log('opus conversion finished')
             })
           }
-          const spawns = ['process_audio.py', fn, audioEventID, recIdx, newId];
-          const processAudio = spawn('python3', spawns);
-          processAudio.stderr.on('data', data => {
-            console.error(`stderr: ${data}`)
-          });
+          const jobName = await enqueueIngestJob(
+            fn, audioEventID, recIdx, newId
+          );
           // processAudio.on('close', async () => {
           //   console.log('audio processing finished')
           //   const script1 = './visualization_scripts/generate_melograph.py';
@@ -1821,7 +1896,7 @@ const runServer = async () => {
           //     res.status(500).send(err)
           //   }
           // });
-          processAudio.on('close', () => {
+          waitForIngestJob(jobName).then(() => {
             console.log('audio processing finished');
             res.send({
               status: true,
@@ -1833,14 +1908,13 @@ const runServer = async () => {
                 audioFileId: newId
               }
             });
-            const script1 = './visualization_scripts/generate_melograph.py';
-            const script2 = './visualization_scripts/make_spec_data.py';
-            runPythonScript(script1, [newId])
-              .then(() => console.log('Melograph generation finished'))
-              .catch(err => console.error('Error in melograph generation:', err));
-            runPythonScript(script2, [newId])
-              .then(() => console.log('Spectrogram data generation finished'))
-              .catch(err => console.error('Error in spectrogram data generation:', err));
+          }).catch(err => {
+            console.error('Error in audio processing:', err);
+            res.status(500).send({
+              status: false,
+              message: 'Audio processing failed',
+              data: { audioFileId: newId }
+            });
           });
         }
       } catch (err) {